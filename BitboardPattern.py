@@ -0,0 +1,378 @@
+import chess
+from CheckmatePattern import CheckmatePattern, CheckmateResult
+from geometry import KING_SQUARES, CENTER_FRAMES, BB_DISTANCE_2, BB_RAW_SURROUNDING, BB_LADDER_SUPPORT
+
+# Same labels as CheckmatePattern, but every question about the position is answered with
+# python-chess integer bitboards that are computed once per position instead of square by square.
+# The rules copy CheckmatePattern exactly, including its quirks (see the comments on each one),
+# so the two classifiers can be swapped without changing any results.
+
+BB_BACK_RANKS = chess.BB_RANK_1 | chess.BB_RANK_8
+
+# Where the queen and the bishop stand in Scholar's mate, by winner (CheckmatePattern wants a white bishop either way)
+SCHOLARS_SQUARES = {True: (chess.F7, chess.BB_C4), False: (chess.F2, chess.BB_C5)}
+
+# Dovetail bishop mate by the slot the queen checks from: the square the bishop guards and the square it covers.
+# These four are mirror images of each other rather than turns, so they can't use the canonical center frame
+DOVETAIL_BISHOP_SLOTS = {7: (1, 3), 5: (1, 4), 0: (4, 6), 2: (6, 3)}
+
+
+class BitboardPattern(CheckmatePattern):
+
+    def is_blocked(self, square):
+        return bool(self.blockers & chess.BB_SQUARES[square])
+
+    def free_squares(self, available_squares):
+        return [i for i in available_squares if not self.blockers & chess.BB_SQUARES[i]]
+
+    def attackers(self, square):
+        # Attackers of the winning side, cached per square for the rest of the position
+        mask = self.attacker_masks.get(square)
+        if mask is None:
+            mask = self.attacker_masks[square] = self.board.attackers_mask(self.winning_side, square)
+        return mask
+
+    def add(self, name, count=1):
+        for _ in range(count):
+            self.result.add(name)
+
+    ### Checkmate patterns
+
+    def smothered(self, available_squares):
+        if self.blockers & self.neighbours == self.neighbours:
+            self.add('Smothered mate')
+
+    def suffocation_corner(self, available_squares):
+        # CheckmatePattern flips a flag for every free square, so it ends up true on an odd count
+        if len(self.free_squares(available_squares)) % 2:
+            self.add('Suffocation mate')
+
+    def suffocation_and_pillsburys(self, available_squares, square):
+        # At most 3 free squares are collected
+        squares_free = self.free_squares(available_squares)[:3]
+        if self.board.knights & chess.BB_SQUARES[square]:
+            if len(squares_free) == 1:
+                self.add('Suffocation mate')
+            elif len(squares_free) == 2 and self.attackers(squares_free[0]) == self.attackers(squares_free[1]):
+                self.add('Suffocation mate')
+        elif self.board.rooks & chess.BB_SQUARES[square]:
+            if len(squares_free) <= 2:
+                for i in squares_free:
+                    if self.attackers(i) & self.white_bishops:
+                        self.add("Pillsbury's mate")
+                        break
+
+    def back_rank(self, available_squares, square):
+        # (a and b in attacks) only looks at b, unless a is a1 (square 0)
+        middle = self.masks(available_squares[1:4])
+        if (self.blockers & middle == middle and available_squares[0] and
+                self.attacks(square) & chess.BB_SQUARES[available_squares[4]]):
+            self.add('Back-rank mate')
+
+    def back_rank_corner(self, available_squares, square):
+        if (self.is_blocked(available_squares[1]) and self.is_blocked(available_squares[2]) and
+                self.attacks(square) & chess.BB_SQUARES[available_squares[0]]):
+            self.add('Back-rank mate')
+
+    def scholars(self, available_squares, square):
+        queen_square, bishop = SCHOLARS_SQUARES[self.winning_side]
+        if square == queen_square and self.white_bishops & bishop:
+            self.add("Scholar's mate")
+
+    def anastasias(self, available_squares):
+        knights = self.board.knights & chess.BB_KNIGHT_ATTACKS[available_squares[3]]
+        for i in (available_squares[1], available_squares[3]):
+            self.add("Anastasia's mate", chess.popcount(self.attackers(i) & knights))
+
+    def anastasias_corner(self, available_squares):
+        if self.is_blocked(available_squares[1]):
+            self.add("Anastasia's mate", chess.popcount(self.attackers(available_squares[0]) & self.board.knights))
+
+    def arabian(self, available_squares, square):
+        self.add('Arabian mate', chess.popcount(self.attackers(square) & self.board.knights & BB_DISTANCE_2[self.king]))
+
+    def epaulette(self, available_squares, square):
+        if (self.is_blocked(available_squares[0]) and self.is_blocked(available_squares[4]) and
+                chess.square_distance(self.king, square) == 2):
+            self.add('Epaulette mate')
+
+    def blind_swine(self, available_squares, square):
+        only_one_square_blocked = chess.popcount(self.blockers & self.masks(available_squares)) % 2
+        # (rook on the square and same file) or same rank, the rank check stands on its own
+        if self.is_blocked(available_squares[4]) and only_one_square_blocked:
+            if ((self.board.rooks & chess.BB_SQUARES[available_squares[1]] and
+                    chess.square_file(square) == chess.square_file(available_squares[1])) or
+                    chess.square_rank(square) == chess.square_rank(available_squares[1])):
+                self.add('Blind swine mate')
+        elif self.is_blocked(available_squares[0]) and only_one_square_blocked:
+            if ((self.board.rooks & chess.BB_SQUARES[available_squares[3]] and
+                    chess.square_file(square) == chess.square_file(available_squares[3])) or
+                    chess.square_rank(square) == chess.square_rank(available_squares[3])):
+                self.add('Blind swine mate')
+
+    def swallows_tail(self, available_squares, square):
+        # In the canonical frame the queen checks from below and both squares diagonally above are blocked
+        frame = self.center_frame
+        if frame and frame[6] == square and self.is_blocked(frame[0]) and self.is_blocked(frame[2]):
+            self.add("Swallow's tail mate")
+
+    def corner_and_morphys(self, available_squares, square):
+        # One match for every rook or queen attacking either of the last two squares
+        if self.board.bishops & chess.BB_SQUARES[square]:
+            name = "Morphy's mate"
+        elif self.board.knights & chess.BB_SQUARES[square]:
+            name = 'Corner mate'
+        else:
+            return
+        if self.is_blocked(available_squares[2]):
+            heavy = self.board.rooks | self.board.queens
+            for i in available_squares[1:]:
+                self.add(name, chess.popcount(self.attackers(i) & heavy))
+
+    def opera(self, available_squares, square):
+        if square == available_squares[0] and self.is_blocked(available_squares[3]):
+            self.add('Opera mate', chess.popcount(self.attackers(available_squares[0]) & self.white_bishops))
+        elif square == available_squares[4] and self.is_blocked(available_squares[1]):
+            self.add('Opera mate', chess.popcount(self.attackers(available_squares[4]) & self.white_bishops))
+
+    def mayets_corner(self, available_squares, square):
+        if square == available_squares[0] and (self.is_blocked(available_squares[2]) or self.is_blocked(available_squares[1])):
+            self.add("Mayet's mate", chess.popcount(self.attackers(available_squares[0]) & self.white_bishops))
+
+    def damianos_and_max_langes(self, available_squares, square):
+        if square == available_squares[1] or square == available_squares[3]:
+            for defender in chess.scan_forward(self.attackers(square) & self.board.occupied_co[chess.WHITE]):
+                bb = chess.BB_SQUARES[defender]
+                if self.board.pawns & bb:
+                    self.add("Damiano's mate")
+                elif self.board.bishops & bb:
+                    self.add("Max Lange's mate")
+
+    def damianos_bishop_and_lollis(self, available_squares, square):
+        # Distances are measured from the black king whoever lost
+        if square == available_squares[2]:
+            for defender in chess.scan_forward(self.attackers(square) & BB_DISTANCE_2[self.black_king]):
+                bb = chess.BB_SQUARES[defender]
+                if self.board.bishops & bb:
+                    self.add("Damiano's bishop mate")
+                elif self.board.pawns & bb:
+                    self.add("Lolli's mate")
+
+    def damianos_bishop_corner_and_lollis_corner(self, available_squares, square):
+        if square == available_squares[0] or square == available_squares[2]:
+            lollis = ((chess.square_rank(square) == 6 and chess.square_rank(self.king) == 7) or
+                      (chess.square_rank(square) == 1 and chess.square_rank(self.king) == 0))
+            for defender in chess.scan_forward(self.attackers(square) & BB_DISTANCE_2[self.black_king]):
+                bb = chess.BB_SQUARES[defender]
+                if self.board.bishops & bb:
+                    self.add("Damiano's bishop mate")
+                elif self.board.pawns & bb and lollis:
+                    self.add("Lolli's mate")
+
+    def box(self, available_squares):
+        if chess.BB_KING_ATTACKS[self.winner_king] & chess.BB_SQUARES[available_squares[3]]:
+            self.add('Box mate')
+
+    def queen_and_king(self, available_squares, square):
+        if BB_RAW_SURROUNDING[self.winner_king] & chess.BB_SQUARES[square] and square in available_squares[1:3]:
+            self.add('Queen and king mate')
+
+    def queen_and_king_corner(self, square):
+        if BB_RAW_SURROUNDING[self.winner_king] & chess.BB_SQUARES[square]:
+            self.add('Queen and king mate')
+
+    def dovetail(self, available_squares, square):
+        # In the canonical frame the queen checks from below on the right and the squares above and left are blocked
+        frame = self.center_frame
+        if frame and frame[7] == square and self.is_blocked(frame[1]) and self.is_blocked(frame[3]):
+            self.add('Dovetail mate')
+
+    def dovetail_bishop(self, available_squares, square):
+        slots = self.center_slot is not None and DOVETAIL_BISHOP_SLOTS.get(self.center_slot)
+        if slots:
+            guarded_slot, covered_slot = slots
+            for attacker in chess.scan_forward(self.attackers(available_squares[guarded_slot]) & self.white_bishops):
+                if self.attacks(attacker) & chess.BB_SQUARES[available_squares[covered_slot]]:
+                    self.add('Dovetail bishop mate')
+
+    def kill_box(self, available_squares, square):
+        if square == available_squares[0]:
+            target = available_squares[4]
+        elif square == available_squares[4]:
+            # (a and b in attacks) with a on a1 never matches
+            if not available_squares[0]:
+                return
+            target = available_squares[1]
+        else:
+            return
+        for defender in chess.scan_forward(self.attackers(square) & self.board.queens & BB_DISTANCE_2[square]):
+            if self.attacks(defender) & chess.BB_SQUARES[target]:
+                self.add('Kill box mate')
+
+    def triangle_center(self, available_squares, square):
+        blocked = self.is_blocked
+        if (blocked(available_squares[1]) or blocked(available_squares[3]) or
+                blocked(available_squares[4]) or blocked(available_squares[6])):
+            self.add('Triangle mate', chess.popcount(
+                self.attackers(square) & self.board.rooks & BB_DISTANCE_2[square] & self.masks(available_squares)))
+
+    def balestra(self, available_squares, square):
+        if chess.square_distance(square, self.black_king) == 2:
+            for attacker in chess.scan_forward(self.attackers(available_squares[2]) & BB_DISTANCE_2[self.black_king]):
+                if chess.square_distance(square, attacker) == 3:
+                    self.add('Balestra mate')
+
+    def hook(self, available_squares, square):
+        # In the canonical frame the rook checks from below, defended by a knight on one of the squares diagonally above
+        frame = self.center_frame
+        if frame and frame[6] == square:
+            knights = self.masks((frame[0], frame[2]))
+            self.add('Hook mate', chess.popcount(self.attackers(square) & self.board.knights & knights))
+
+    def hook_side(self, available_squares, square):
+        if square == available_squares[0]:
+            knight = chess.BB_SQUARES[available_squares[3]]
+        elif square == available_squares[4]:
+            knight = chess.BB_SQUARES[available_squares[1]]
+        else:
+            return
+        self.add('Hook mate', chess.popcount(self.attackers(square) & self.board.knights & knight))
+
+    def anderssens(self, available_squares, square):
+        # On a corner there are only 3 squares, so available_squares[4] raises IndexError like it does in CheckmatePattern
+        if (self.board.pawns & self.board.occupied_co[self.winning_side] & chess.BB_SQUARES[available_squares[2]] and
+                chess.BB_SQUARES[square] & BB_BACK_RANKS and
+                (square == available_squares[0] or square == available_squares[4])):
+            self.add("Anderssen's mate")
+
+    def ladder(self, available_squares, square):
+        # (a and b) is a1 when a is a1
+        target = available_squares[4] if available_squares[0] else available_squares[0]
+        if not self.attacks(square) & chess.BB_SQUARES[target]:
+            return
+        support = BB_LADDER_SUPPORT[square]
+        if not support:
+            return
+
+        # Only the last queen or rook attacking the middle squares counts
+        last_attacker = None
+        heavy = self.board.queens | self.board.rooks
+        for i in available_squares[1:4]:
+            if square != i:
+                attackers = self.attackers(i) & heavy
+                if attackers:
+                    last_attacker = chess.msb(attackers)
+
+        if last_attacker is not None and support & chess.BB_SQUARES[last_attacker]:
+            self.add('Ladder mate')
+
+    ### Helpers
+
+    def masks(self, squares):
+        mask = 0
+        for i in squares:
+            mask |= chess.BB_SQUARES[i]
+        return mask
+
+    def attacks(self, square):
+        return self.board.attacks_mask(square)
+
+    def classify(self):
+        board = self.board
+        self.result = CheckmateResult()
+
+        # CheckmatePattern.winner() is only True for "1-0", i.e. black to move and mated
+        self.winning_side = board.turn == chess.BLACK and board.is_check() and board.is_checkmate()
+        self.king = board.king(not self.winning_side)
+        self.winner_king = board.king(self.winning_side)
+        self.black_king = board.king(chess.BLACK)
+        if self.king is None or self.winner_king is None or self.black_king is None:
+            # Positions without both kings hit the error handling in CheckmatePattern, let it decide
+            return CheckmatePattern.classify(self)
+
+        checkers = board.checkers_mask()
+        if not checkers:
+            return self.result
+        if checkers & (checkers - 1):
+            self.result.double_check = True
+            return self.result
+
+        square = chess.lsb(checkers)
+        piece = board.piece_type_at(square)
+        self.blockers = board.occupied_co[not self.winning_side]
+        self.white_bishops = board.bishops & board.occupied_co[chess.WHITE]
+        self.attacker_masks = {}
+
+        king_square = KING_SQUARES[self.king]
+        available_squares = king_square.squares
+        self.neighbours = king_square.mask
+        result = self.result
+        result.piece = chess.piece_symbol(piece).upper()
+        result.region = king_square.region
+
+        # The calls below follow RULES in rules.py, written out because looking rules up and calling them by
+        # name costs more than most of these patterns take. The prefilters there only leave out rules that
+        # can't match, so calling every rule gives the same labels. Where CheckmatePattern calls a pattern
+        # with the wrong arguments the TypeError ends the whole branch, so those branches stop there too
+        try:
+            if king_square.region == 'corner':
+                if piece == chess.QUEEN:
+                    self.back_rank_corner(available_squares, square)
+                    self.damianos_bishop_corner_and_lollis_corner(available_squares, square)
+                    self.queen_and_king_corner(square)
+                    self.box_corner(available_squares)
+                elif piece == chess.ROOK:
+                    self.back_rank_corner(available_squares, square)
+                    self.anderssens(available_squares, square)
+                    self.anastasias_corner(available_squares)
+                    self.arabian(available_squares, square)
+                    self.mayets_corner(available_squares, square)
+                    self.box_corner(available_squares)
+                elif piece == chess.BISHOP:
+                    self.corner_and_morphys(available_squares, square)
+                elif piece == chess.KNIGHT:
+                    self.smothered(available_squares)
+                    self.suffocation_corner(available_squares)
+                    self.corner_and_morphys(available_squares, square)
+
+            elif king_square.region == 'center':
+                self.center_slot, self.center_frame = CENTER_FRAMES[self.king].get(square, (None, None))
+                if piece == chess.QUEEN:
+                    self.swallows_tail(available_squares, square)
+                    self.dovetail(available_squares, square)
+                    self.dovetail_bishop(available_squares, square)
+                    self.triangle_center(available_squares, square)
+                elif piece == chess.ROOK:
+                    self.hook(available_squares, square)
+                    self.blind_swine(available_squares)
+
+            else:
+                if piece == chess.QUEEN:
+                    self.scholars(available_squares, square)
+                    self.back_rank(available_squares, square)
+                    self.epaulette(available_squares, square)
+                    self.damianos_bishop_and_lollis(available_squares, square)
+                    self.damianos_and_max_langes(available_squares, square)
+                    self.queen_and_king(available_squares, square)
+                    self.box(available_squares)
+                    self.ladder(available_squares, square)
+                elif piece == chess.ROOK:
+                    self.ladder(available_squares, square)
+                    self.suffocation_and_pillsburys(available_squares, square)
+                    self.blind_swine(available_squares, square)
+                    self.back_rank(available_squares, square)
+                    self.anastasias(available_squares)
+                    self.opera(available_squares, square)
+                    self.kill_box(available_squares, square)
+                    self.box(available_squares)
+                    self.anderssens(available_squares, square)
+                    self.hook_side(available_squares, square)
+                elif piece == chess.BISHOP:
+                    self.balestra(available_squares, square)
+                elif piece == chess.KNIGHT:
+                    self.smothered(available_squares)
+                    self.suffocation_and_pillsburys(available_squares)
+        except TypeError as error:
+            self.swallowed(error)
+
+        return result
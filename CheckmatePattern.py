@@ -1,9 +1,163 @@
+import functools
+
 import chess
+from geometry import KING_SQUARES, SURROUNDING_SQUARES, SIDE_SQUARES, CORNER_SQUARES
+from rules import BOTH, RULES_BY_BRANCH, board_piece_types, candidates
+
+# Every pattern the classifier knows about. A pattern's ID is its index in this list
+PATTERN_NAMES = [
+    'Smothered mate',
+    'Suffocation mate',
+    "Pillsbury's mate",
+    'Back-rank mate',
+    "Scholar's mate",
+    "Anastasia's mate",
+    'Arabian mate',
+    'Epaulette mate',
+    'Blind swine mate',
+    "Swallow's tail mate",
+    "Morphy's mate",
+    'Corner mate',
+    'Opera mate',
+    "Mayet's mate",
+    "Damiano's mate",
+    "Max Lange's mate",
+    "Damiano's bishop mate",
+    "Lolli's mate",
+    'Box mate',
+    'Queen and king mate',
+    "Greco's mate",
+    'Dovetail mate',
+    'Dovetail bishop mate',
+    'Kill box mate',
+    'Triangle mate',
+    'Balestra mate',
+    'Hook mate',
+    "Anderssen's mate",
+    'Ladder mate',
+]
+
+PATTERN_IDS = {name: i for i, name in enumerate(PATTERN_NAMES)}
+
+# Bump this whenever a pattern rule changes, so labels stored by older versions get worked out again
+CLASSIFIER_VERSION = 1
+
+
+class CheckmateResult:
+    # What the classifier found in one position:
+    # piece - letter of the piece that gave mate ('Q', 'R', 'B', 'N', 'P'), None on a double check
+    # region - where the losing king is ('corner', 'side' or 'center')
+    # patterns - pattern IDs in the order they matched (a pattern can match more than once)
+    # double_check - True if the king was mated by two pieces at once
+
+    __slots__ = ('piece', 'region', 'patterns', 'double_check')
+
+    def __init__(self, piece=None, region=None, patterns=None, double_check=False):
+        self.piece = piece
+        self.region = region
+        self.patterns = patterns if patterns is not None else []
+        self.double_check = double_check
+
+    def add(self, name):
+        self.patterns.append(PATTERN_IDS[name])
+
+    def names(self):
+        return [PATTERN_NAMES[i] for i in self.patterns]
+
+    def copy(self):
+        return CheckmateResult(self.piece, self.region, list(self.patterns), self.double_check)
+
+    def __eq__(self, other):
+        if not isinstance(other, CheckmateResult):
+            return NotImplemented
+        return (self.piece, self.region, self.patterns, self.double_check) == (other.piece, other.region, other.patterns, other.double_check)
+
+    def __repr__(self):
+        return 'CheckmateResult(piece={!r}, region={!r}, patterns={!r}, double_check={!r})'.format(
+            self.piece, self.region, self.patterns, self.double_check)
+
+
+class PositionContext:
+    # What the patterns ask about a position that is the same for all of them, worked out once per classify()
+    # instead of in every pattern: who won (winner() goes through board.result(), which generates every legal
+    # move), both kings, the checkers and the losing side's pieces. The winner's attackers of a square and the
+    # squares a piece attacks are kept the first time a pattern asks for them, most patterns ask about the
+    # same few squares around the king
+
+    __slots__ = ('board', 'winner', 'losing_king', 'winner_king', 'black_king', 'checkers', 'blockers',
+                 'attacker_sets', 'attack_sets')
+
+    def __init__(self, board, winner):
+        self.board = board
+        self.winner = winner
+        self.losing_king = board.king(not winner)
+        self.winner_king = board.king(winner)
+        # Some patterns have always asked for board.king(not self.winner), with the method rather than what it
+        # returns, which is the black king whoever won
+        self.black_king = board.king(chess.BLACK)
+        self.checkers = board.checkers()
+        self.blockers = board.occupied_co[not winner]
+        self.attacker_sets = {}
+        self.attack_sets = {}
+
+    def attackers(self, square):
+        # board.attackers(winner, square)
+        attackers = self.attacker_sets.get(square)
+        if attackers is None:
+            attackers = self.attacker_sets[square] = self.board.attackers(self.winner, square)
+        return attackers
+
+    def attacks(self, square):
+        # board.attacks(square)
+        attacks = self.attack_sets.get(square)
+        if attacks is None:
+            attacks = self.attack_sets[square] = self.board.attacks(square)
+        return attacks
+
+
+def classify_pattern(pattern):
+    # pattern.classify(), except that a position the classifier gives up on leaves pattern.result None and
+    # returns None. Anderssen's mate on a corner looks past the end of the corner squares, and every caller
+    # that classifies positions goes through here (or classify_position) instead of catching that itself
+    try:
+        return pattern.classify()
+    except IndexError:
+        pattern.result = None
+        return None
+
+
+def classify_position(position, engine=None):
+    # What (engine or CheckmatePattern)(position).classify() finds, None if the classifier gives up on it
+    return classify_pattern((engine or CheckmatePattern)(position))
+
+
+def classify_many(positions, engine=None, cache=None):
+    # Classify FENs or chess.Board objects one after another without printing anything.
+    # engine is the classifier class to use (CheckmatePattern unless something like BitboardPattern is passed).
+    # With a cache (cache.ResultCache) repeated positions are looked up, using the cache's own engine.
+    # A position the classifier gives up on yields None
+    if cache is not None:
+        for position in positions:
+            yield cache.classify(position)
+        return
+
+    for position in positions:
+        yield classify_position(position, engine)
+
 
 class CheckmatePattern:
 
     def __init__(self, board):
-        self.board = chess.Board(board)
+        if isinstance(board, chess.Board):
+            self.board = board
+        else:
+            self.board = chess.Board(board)
+        self.result = CheckmateResult()
+
+    @functools.cached_property
+    def context(self):
+        # classify() asks for it before any pattern, a pattern called on its own builds it the first time it asks
+        return PositionContext(self.board, self.winner())
 
     def get_full_name(self, letter):
         full_piece_names = {
@@ -17,62 +171,18 @@ class CheckmatePattern:
 
     # Check if a square around the king is blocked by his own piece
     def is_blocked(self, square):
-        if self.board.color_at(square) == (not self.winner()):
-            return True
-        else:
-            return False
+        return bool(self.context.blockers & chess.BB_SQUARES[square])
 
-    def surrounding_squares(self, king):
+    # The squares around a king come from the tables in geometry.py, see there for the slot orders
 
-        #012
-        #3 4
-        #567
+    def surrounding_squares(self, king):
+        return SURROUNDING_SQUARES[king]
 
-        return [king + 7, king + 8, king + 9,
-                king - 1,           king + 1,
-                king - 9, king - 8, king - 7]
-    
     def king_on_side(self, king):
-
-        #01     34      123     4 0     
-        # 2     2       0 4     321
-        #43     10
-
-        # If the king is on the left side
-        if chess.square_file(king) == 0:
-            return [king + 8, king + 9, king + 1, king - 7, king - 8]
-        # If king is on right
-        elif chess.square_file(king) == 7:
-            return [king - 8, king - 9, king - 1, king + 7, king + 8]
-        # Bottom
-        elif chess.square_rank(king) == 0:
-            return [king - 1, king + 7, king + 8, king + 9, king + 1]
-        # Top
-        elif chess.square_rank(king) == 7:
-            return [king + 1, king - 7, king - 8, king - 9, king - 1]
+        return SIDE_SQUARES[king]
 
     def king_on_corner(self, king):
-
-        #21     12      0       0
-        # 0     0      21       12
-
-        if chess.square_rank(king) == 0:
-            # Bottom left
-            if chess.square_file(king) == 0:
-                return [1, 9, 8]
-            
-            # Bottom right
-            if chess.square_file(king) == 7:
-                return [6, 14, 15]
-
-        if chess.square_rank(king) == 7:
-            # Top left
-            if chess.square_file(king) == 0:
-                return [57, 49, 48]
-
-            # Top right
-            if chess.square_file(king) == 7:
-                return [62, 54, 55]
+        return CORNER_SQUARES[king]
 
     def winner(self):
         if str(self.board.result()) == "1-0":
@@ -85,7 +195,7 @@ class CheckmatePattern:
     def smothered(self, available_squares):
         # If all the squares around the king are blocked by its friendly pieces
         if all(self.is_blocked(i) for i in available_squares):
-            print('Smothered mate')
+            self.result.add('Smothered mate')
     
     def suffocation_and_pillsburys(self, available_squares, square):
         # If there is 2 squares that is not blocked by the king's own pieces and those 2 squares are attacked by the same piece
@@ -102,19 +212,19 @@ class CheckmatePattern:
                     squares_free.append(i)
         if str(self.board.piece_at(square)).upper() == 'N':
             if len(squares_free) == 1:
-                print('Suffocation mate')
-            elif len(squares_free) == 2 and (self.board.attackers(self.winner(), squares_free[0]) == self.board.attackers(self.winner(), squares_free[1])):
-                print('Suffocation mate')
+                self.result.add('Suffocation mate')
+            elif len(squares_free) == 2 and (self.context.attackers(squares_free[0]) == self.context.attackers(squares_free[1])):
+                self.result.add('Suffocation mate')
         elif str(self.board.piece_at(square)).upper() == 'R':
             if len(squares_free) <= 2:
                 for i in squares_free:
-                    for attacker in self.board.attackers(self.winner(), i):
-                        if str(self.board.piece_at(attacker)) == 'B' and (i in self.board.attacks(attacker)):
+                    for attacker in self.context.attackers(i):
+                        if str(self.board.piece_at(attacker)) == 'B' and (i in self.context.attacks(attacker)):
                             # Prints multiple times
                             pillsburys = True
 
                 if pillsburys:
-                    print("Pillsbury's mate")
+                    self.result.add("Pillsbury's mate")
     
     def suffocation_corner(self, available_squares):
         # If there is only 1 square that is not blocked by the king's own pieces
@@ -129,54 +239,54 @@ class CheckmatePattern:
                     one_square_free = True
     # found zero or one True value
         if one_square_free:
-            print('Suffocation mate')
+            self.result.add('Suffocation mate')
         
 
     def back_rank(self, available_squares, square):
         # On a board, there are 2 realistic ways back ranks can happen (white checkmated on his side, and vice versa)
-        if all(self.is_blocked(i) for i in available_squares[1:4]) and (available_squares[0] and available_squares[4] in self.board.attacks(square)):
-            print('Back-rank mate')
+        if all(self.is_blocked(i) for i in available_squares[1:4]) and (available_squares[0] and available_squares[4] in self.context.attacks(square)):
+            self.result.add('Back-rank mate')
         
     def back_rank_corner(self, available_squares, square):
         # Thre are 4 realistic ways back ranks with losing king on corner can happen
-        if all(self.is_blocked(i) for i in available_squares[1:]) and (available_squares[0] in self.board.attacks(square)):
-            print('Back-rank mate')
+        if all(self.is_blocked(i) for i in available_squares[1:]) and (available_squares[0] in self.context.attacks(square)):
+            self.result.add('Back-rank mate')
 
     def scholars(self, available_squares, queen_pos):
         # If the queen is on f7 or f2 and a bishop on c4 or c5 (white and black, respectively) is defending it
-        if self.winner():
+        if self.context.winner:
             if queen_pos == chess.F7 and str(self.board.piece_at(chess.C4)) == 'B':
-                print("Scholar's mate")
+                self.result.add("Scholar's mate")
         else:
             if queen_pos == chess.F2 and str(self.board.piece_at(chess.C5)) == 'B':
-                print("Scholar's mate")
+                self.result.add("Scholar's mate")
 
     def anastasias(self, available_squares):
         # If the king is blocked by one of his own pieces and the remaining squares are control by the knight and a rook in a particular manner
         squares_free = [available_squares[1], available_squares[3]]
         anastasias = False
-        if self.board.attackers(self.winner(), squares_free[0]) == self.board.attackers(self.winner(), squares_free[0]):
+        if self.context.attackers(squares_free[0]) == self.context.attackers(squares_free[0]):
             for i in squares_free:
-                for attacker in self.board.attackers(self.winner(), i):
-                    if str(self.board.piece_at(attacker)).upper() == 'N' and (squares_free[0] and squares_free[1] in self.board.attacks(attacker)):
-                        print("Anastasia's mate")
+                for attacker in self.context.attackers(i):
+                    if str(self.board.piece_at(attacker)).upper() == 'N' and (squares_free[0] and squares_free[1] in self.context.attacks(attacker)):
+                        self.result.add("Anastasia's mate")
 
     def anastasias_corner(self, available_squares):
-        for attacker in self.board.attackers(self.winner(), available_squares[0]):
+        for attacker in self.context.attackers(available_squares[0]):
             if self.is_blocked(available_squares[1]) and str(self.board.piece_at(attacker)).upper() == 'N':
-                print("Anastasia's mate")
+                self.result.add("Anastasia's mate")
 
     def arabian(self, available_squares, rook_pos):
-        for attacker in self.board.attackers(self.winner(), rook_pos):
-            if str(self.board.piece_at(attacker)).upper() == 'N' and chess.square_distance(self.board.king(not self.winner()), attacker) == 2:
-                print('Arabian mate')
+        for attacker in self.context.attackers(rook_pos):
+            if str(self.board.piece_at(attacker)).upper() == 'N' and chess.square_distance(self.context.losing_king, attacker) == 2:
+                self.result.add('Arabian mate')
 
     def epaulette(self, available_squares, queen_pos):
         # If the losing king is blocked by 2 pieces each on each side and the queen is 2 squares away from him
-        distance_king_queen = chess.square_distance(self.board.king(not self.winner()), queen_pos)
+        distance_king_queen = chess.square_distance(self.context.losing_king, queen_pos)
         
         if self.is_blocked(available_squares[0]) and self.is_blocked(available_squares[4]) and distance_king_queen == 2:
-            print('Epaulette mate')
+            self.result.add('Epaulette mate')
     
     def blind_swine(self, available_squares, square):
         only_one_square_blocked = False
@@ -190,208 +300,208 @@ class CheckmatePattern:
         if self.is_blocked(available_squares[4]) and only_one_square_blocked:
             if (str(self.board.piece_at(available_squares[1])).upper() == 'R' and 
             (chess.square_file(square) == chess.square_file(available_squares[1])) or (chess.square_rank(square) == chess.square_rank(available_squares[1]))):
-                print('Blind swine mate')
+                self.result.add('Blind swine mate')
 
         elif self.is_blocked(available_squares[0]) and only_one_square_blocked:
             if (str(self.board.piece_at(available_squares[3])).upper() == 'R' and 
             (chess.square_file(square) == chess.square_file(available_squares[3])) or (chess.square_rank(square) == chess.square_rank(available_squares[3]))):
-                print('Blind swine mate')
+                self.result.add('Blind swine mate')
 
     def swallows_tail(self, available_squares, square):
         if ((self.is_blocked(available_squares[0]) and self.is_blocked(available_squares[2]) and square == available_squares[6]) or 
         (self.is_blocked(available_squares[2]) and self.is_blocked(available_squares[7]) and square == available_squares[3]) or 
         (self.is_blocked(available_squares[7]) and self.is_blocked(available_squares[5]) and square == available_squares[1]) or 
         (self.is_blocked(available_squares[5]) and self.is_blocked(available_squares[0]) and square == available_squares[4]) and 
-        chess.square_distance(self.board.king(not self.winner()), square) == 1):
-            print("Swallow's tail mate")
+        chess.square_distance(self.context.losing_king, square) == 1):
+            self.result.add("Swallow's tail mate")
 
     def corner_and_morphys(self, available_squares, square):
         # This pattern takes care of the corner mate (given with knight) and Murphy's mate (given with bishop)
         if (self.is_blocked(available_squares[2])):
             for i in available_squares[1:]:
-                for attacker in self.board.attackers(self.winner(), i):
+                for attacker in self.context.attackers(i):
                     if str(self.board.piece_at(attacker)).upper() == 'R' or str(self.board.piece_at(attacker)).upper() == 'Q':
                         if str(self.board.piece_at(square)).upper() == 'B':
-                            print("Morphy's mate")
+                            self.result.add("Morphy's mate")
                         elif str(self.board.piece_at(square)).upper() == 'N':
-                            print('Corner mate')
+                            self.result.add('Corner mate')
 
     def opera(self, available_squares, square):
         if square == available_squares[0] and self.is_blocked(available_squares[3]):
-            for defender in self.board.attackers(self.winner(), available_squares[0]):
+            for defender in self.context.attackers(available_squares[0]):
                 if str(self.board.piece_at(defender)) == 'B':
-                    print('Opera mate')
+                    self.result.add('Opera mate')
         elif square == available_squares[4] and self.is_blocked(available_squares[1]):
-            for defender in self.board.attackers(self.winner(), available_squares[4]):
+            for defender in self.context.attackers(available_squares[4]):
                 if str(self.board.piece_at(defender)) == 'B':
-                    print('Opera mate')
+                    self.result.add('Opera mate')
 
     def mayets(self, available_squares, square):
         if square == available_squares[0] and (self.is_blocked(available_squares[1]) or self.is_blocked(available_squares[2])):
-            for defender in self.board.attackers(self.winner(), available_squares[0]):
+            for defender in self.context.attackers(available_squares[0]):
                 if str(self.board.piece_at(defender)) == 'B':
-                    print("Mayet's mate")
+                    self.result.add("Mayet's mate")
         elif square == available_squares[4] and (self.is_blocked(available_squares[2]) or self.is_blocked(available_squares[3])):
-            for defender in self.board.attackers(self.winner(), available_squares[0]):
+            for defender in self.context.attackers(available_squares[0]):
                 if str(self.board.piece_at(defender)) == 'B':
-                    print("Mayet's mate")
+                    self.result.add("Mayet's mate")
 
     def mayets_corner(self, available_squares, square):
         if square == available_squares[0] and (self.is_blocked(available_squares[2]) or self.is_blocked(available_squares[1])):
-            for defender in self.board.attackers(self.winner(), available_squares[0]):
+            for defender in self.context.attackers(available_squares[0]):
                 if str(self.board.piece_at(defender)) == 'B':
-                    print("Mayet's mate")
+                    self.result.add("Mayet's mate")
 
     def damianos_and_max_langes(self, available_squares, square):
         if square == available_squares[1] or square == available_squares[3]:
-            for defender in self.board.attackers(self.winner(), square):
-                if (available_squares[1] or available_squares[3] in self.board.attacks(defender)):
+            for defender in self.context.attackers(square):
+                if (available_squares[1] or available_squares[3] in self.context.attacks(defender)):
                     if str(self.board.piece_at(defender)) == 'P':
-                        print("Damiano's mate")
+                        self.result.add("Damiano's mate")
                     elif str(self.board.piece_at(defender)) == 'B':
-                        print("Max Lange's mate")
+                        self.result.add("Max Lange's mate")
 
     def damianos_bishop_and_lollis(self, available_squares, square):
         if square == available_squares[2]:
-            for defender in self.board.attackers(self.winner(), available_squares[2]):
-                if chess.square_distance(self.board.king(not self.winner), defender) == 2:
+            for defender in self.context.attackers(available_squares[2]):
+                if chess.square_distance(self.context.black_king, defender) == 2:
                     if str(self.board.piece_at(defender)).upper() == 'B':
-                        print("Damiano's bishop mate")
+                        self.result.add("Damiano's bishop mate")
                     elif str(self.board.piece_at(defender)).upper() == 'P':
-                        print("Lolli's mate")
+                        self.result.add("Lolli's mate")
 
     def damianos_bishop_corner_and_lollis_corner(self, available_squares, square):
         possible_squares = [available_squares[0], available_squares[2]]
 
         for i in possible_squares:
             if square == i:
-                for defender in self.board.attackers(self.winner(), i):
-                    if chess.square_distance(self.board.king(not self.winner), defender) == 2:
+                for defender in self.context.attackers(i):
+                    if chess.square_distance(self.context.black_king, defender) == 2:
                         if str(self.board.piece_at(defender)).upper() == 'B':
-                            print("Damiano's bishop mate")
+                            self.result.add("Damiano's bishop mate")
                         elif str(self.board.piece_at(defender)).upper() == 'P':
-                            if ((chess.square_rank(square) == 6 and chess.square_rank(self.board.king(not self.winner())) == 7) or 
-                            (chess.square_rank(square) == 1 and chess.square_rank(self.board.king(not self.winner())) == 0)):
-                                print("Lolli's mate")
+                            if ((chess.square_rank(square) == 6 and chess.square_rank(self.context.losing_king) == 7) or 
+                            (chess.square_rank(square) == 1 and chess.square_rank(self.context.losing_king) == 0)):
+                                self.result.add("Lolli's mate")
     
     def box(self, available_squares):
-        if (available_squares[1] and available_squares[2] and available_squares[3]) in self.board.attacks(self.board.king(self.winner())):
-            print('Box mate')
+        if (available_squares[1] and available_squares[2] and available_squares[3]) in self.context.attacks(self.context.winner_king):
+            self.result.add('Box mate')
     
     def box_corner(self, available_squares, square):
         if chess.square_file(square) == 0 or chess.square_file(square) == 7:
-            if (available_squares[1] and available_squares[2]) in self.board.attacks(self.board.king(self.winner())):
-                print('Box mate')
+            if (available_squares[1] and available_squares[2]) in self.context.attacks(self.context.winner_king):
+                self.result.add('Box mate')
         elif chess.square_rank(square) == 0 or chess.square_rank(square) == 7:
-            if (available_squares[0] and available_squares[1]) in self.board.attacks(self.board.king(self.winner())):
-                print('Box mate')
+            if (available_squares[0] and available_squares[1]) in self.context.attacks(self.context.winner_king):
+                self.result.add('Box mate')
 
 
     def queen_and_king(self, available_squares, square):
-        if (square in self.surrounding_squares(self.board.king(self.winner()))) and (square in available_squares[1:3]):
-            print('Queen and king mate')
+        if (square in self.surrounding_squares(self.context.winner_king)) and (square in available_squares[1:3]):
+            self.result.add('Queen and king mate')
 
     def queen_and_king_corner(self, square):
-        if (square in self.surrounding_squares(self.board.king(self.winner()))):
-            print('Queen and king mate')
+        if (square in self.surrounding_squares(self.context.winner_king)):
+            self.result.add('Queen and king mate')
 
     def grecos(self, available_squares, square):
         if self.is_blocked(available_squares[1]):
             if chess.square_file(square) == 0 or chess.square_file(square) == 7:
-                for attacker in self.board.attackers(self.winner(), available_squares[0]):
+                for attacker in self.context.attackers(available_squares[0]):
                     if str(self.board.piece_at(attacker)) == 'B':
-                        print("Greco's mate")
+                        self.result.add("Greco's mate")
             elif chess.square_rank(square) == 0 or chess.square_rank(square) == 7:
-                for attacker in self.board.attackers(self.winner(), available_squares[2]):
+                for attacker in self.context.attackers(available_squares[2]):
                     if str(self.board.piece_at(attacker)) == 'B':
-                        print("Greco's mate")
+                        self.result.add("Greco's mate")
 
     def dovetail(self, available_squares, square):
         if ((self.is_blocked(available_squares[1]) and self.is_blocked(available_squares[3]) and square == available_squares[7]) or
         (self.is_blocked(available_squares[1]) and self.is_blocked(available_squares[4]) and square == available_squares[5]) or
         (self.is_blocked(available_squares[4]) and self.is_blocked(available_squares[6]) and square == available_squares[0]) or
         (self.is_blocked(available_squares[6]) and self.is_blocked(available_squares[3]) and square == available_squares[2])):
-            print('Dovetail mate')
+            self.result.add('Dovetail mate')
 
     def dovetail_bishop(self, available_squares, square):
         if square == available_squares[7]:
-            for attacker in self.board.attackers(self.winner(), available_squares[1]):
-                if available_squares[3] in self.board.attacks(attacker) and str(self.board.piece_at(attacker)) == 'B':
-                    print('Dovetail bishop mate')
+            for attacker in self.context.attackers(available_squares[1]):
+                if available_squares[3] in self.context.attacks(attacker) and str(self.board.piece_at(attacker)) == 'B':
+                    self.result.add('Dovetail bishop mate')
         elif square == available_squares[5]:
-            for attacker in self.board.attackers(self.winner(), available_squares[1]):
-                if available_squares[4] in self.board.attacks(attacker) and str(self.board.piece_at(attacker)) == 'B':
-                    print('Dovetail bishop mate')
+            for attacker in self.context.attackers(available_squares[1]):
+                if available_squares[4] in self.context.attacks(attacker) and str(self.board.piece_at(attacker)) == 'B':
+                    self.result.add('Dovetail bishop mate')
         elif square == available_squares[0]:
-            for attacker in self.board.attackers(self.winner(), available_squares[4]):
-                if available_squares[6] in self.board.attacks(attacker) and str(self.board.piece_at(attacker)) == 'B':
-                    print('Dovetail bishop mate')
+            for attacker in self.context.attackers(available_squares[4]):
+                if available_squares[6] in self.context.attacks(attacker) and str(self.board.piece_at(attacker)) == 'B':
+                    self.result.add('Dovetail bishop mate')
         elif square == available_squares[2]:
-            for attacker in self.board.attackers(self.winner(), available_squares[6]):
-                if available_squares[3] in self.board.attacks(attacker) and str(self.board.piece_at(attacker)) == 'B':
-                    print('Dovetail bishop mate')
+            for attacker in self.context.attackers(available_squares[6]):
+                if available_squares[3] in self.context.attacks(attacker) and str(self.board.piece_at(attacker)) == 'B':
+                    self.result.add('Dovetail bishop mate')
 
     def kill_box(self, available_squares, square):
         if square == available_squares[0]:  
-            for defender in self.board.attackers(self.winner(), square):
+            for defender in self.context.attackers(square):
                 if (str(self.board.piece_at(defender)).upper() == 'Q' and chess.square_distance(square, defender) == 2 and 
-                (available_squares[3] and available_squares[4] in self.board.attacks(defender))):
-                    print('Kill box mate')
+                (available_squares[3] and available_squares[4] in self.context.attacks(defender))):
+                    self.result.add('Kill box mate')
 
         elif square == available_squares[4]:
-            for defender in self.board.attackers(self.winner(), square):
+            for defender in self.context.attackers(square):
                 if (str(self.board.piece_at(defender)).upper() == 'Q' and chess.square_distance(square, defender) == 2 and 
-                (available_squares[0] and available_squares[1] in self.board.attacks(defender))):
-                    print('Kill box mate')
+                (available_squares[0] and available_squares[1] in self.context.attacks(defender))):
+                    self.result.add('Kill box mate')
     
     def triangle(self, available_squares, square):
         if square == available_squares[1]:
-            for defender in self.board.attackers(self.winner(), square):
+            for defender in self.context.attackers(square):
                 if (str(self.board.piece_at(defender)).upper() == 'R' and chess.square_distance(square, defender) == 2 and 
-                (available_squares[2] and available_squares[4] in self.board.attacks(defender))):
-                    print('Triangle mate')
+                (available_squares[2] and available_squares[4] in self.context.attacks(defender))):
+                    self.result.add('Triangle mate')
 
         elif square == available_squares[3]:
-            for defender in self.board.attackers(self.winner(), square):
+            for defender in self.context.attackers(square):
                 if (str(self.board.piece_at(defender)).upper() == 'R' and chess.square_distance(square, defender) == 2 and 
-                (available_squares[2] and available_squares[0] in self.board.attacks(defender))):
-                    print('Triangle mate')
+                (available_squares[2] and available_squares[0] in self.context.attacks(defender))):
+                    self.result.add('Triangle mate')
     
     def triangle_center(self, available_squares, square):
-        for defender in self.board.attackers(self.winner(), square):
+        for defender in self.context.attackers(square):
                 if str(self.board.piece_at(defender)).upper() == 'R' and chess.square_distance(square, defender) == 2 and (defender in available_squares):
                     if self.is_blocked(available_squares[1]) or self.is_blocked(available_squares[3]) or self.is_blocked(available_squares[4]) or self.is_blocked(available_squares[6]):
-                        print('Triangle mate')
+                        self.result.add('Triangle mate')
 
     def balestra(self, available_squares, square):
-        for attacker in self.board.attackers(self.winner(), available_squares[2]):
-            if (chess.square_distance(square, self.board.king(not self.winner)) == 2 and 
-            chess.square_distance(attacker, self.board.king(not self.winner)) == 2 and chess.square_distance(square, attacker) == 3):
-                print('Balestra mate')
+        for attacker in self.context.attackers(available_squares[2]):
+            if (chess.square_distance(square, self.context.black_king) == 2 and 
+            chess.square_distance(attacker, self.context.black_king) == 2 and chess.square_distance(square, attacker) == 3):
+                self.result.add('Balestra mate')
 
     def hook(self, available_squares, square):
-        for defender in self.board.attackers(self.winner(), square):
+        for defender in self.context.attackers(square):
             if str(self.board.piece_at(defender)).upper() == 'N':
                 if ((square == available_squares[1] and (defender == available_squares[5] or defender == available_squares[7])) or
                 (square == available_squares[3] and (defender == available_squares[2] or defender == available_squares[7])) or 
                 (square == available_squares[6] and (defender == available_squares[0] or defender == available_squares[2])) or
                 (square == available_squares[4] and (defender == available_squares[0] or defender == available_squares[5]))):
-                    print('Hook mate')
+                    self.result.add('Hook mate')
 
     def hook_side(self, available_squares, square):
         if square == available_squares[0]:
-            for defender in self.board.attackers(self.winner(), square):
+            for defender in self.context.attackers(square):
                 if str(self.board.piece_at(defender)).upper() == 'N' and defender == available_squares[3]:
-                    print('Hook mate')
+                    self.result.add('Hook mate')
         elif square == available_squares[4]:
-            for defender in self.board.attackers(self.winner(), square):
+            for defender in self.context.attackers(square):
                 if str(self.board.piece_at(defender)).upper() == 'N' and defender == available_squares[1]:
-                    print('Hook mate')
+                    self.result.add('Hook mate')
 
     def anderssens(self, available_squares, square):
-        if (str(self.board.piece_at(available_squares[2])).upper() == 'P' and self.board.color_at(available_squares[2]) == self.winner() and 
+        if (str(self.board.piece_at(available_squares[2])).upper() == 'P' and self.board.color_at(available_squares[2]) == self.context.winner and 
         (chess.square_rank(square) == 0 or chess.square_rank(square) == 7) and (square == available_squares[0] or square == available_squares[4])):
-            print("Anderssen's mate")
+            self.result.add("Anderssen's mate")
 
     def double_bishop(self, available_squares, square):
         pass
@@ -419,14 +529,14 @@ class CheckmatePattern:
         attacker_rank = 0
 
         for i in available_squares[1:4]:
-            for attacker in self.board.attackers(self.winner(), i):       
+            for attacker in self.context.attackers(i):       
                 if square != i and (str(self.board.piece_at(attacker)).upper() == 'Q' or str(self.board.piece_at(attacker)).upper() == 'R'):
                     # For some reason, it would print 'Ladder mate' 3 times. This just bypasses it.
                     attacker_file = chess.square_file(attacker)
                     attacker_rank = chess.square_rank(attacker)
                     ladder = True
 
-        if (available_squares[0] and available_squares[4]) in self.board.attacks(square):
+        if (available_squares[0] and available_squares[4]) in self.context.attacks(square):
             checkmater_file = chess.square_file(square)
             checkmater_rank = chess.square_rank(square)
             ladder = True
@@ -437,7 +547,7 @@ class CheckmatePattern:
         if (((checkmater_file == 0 and attacker_file == 1) or (checkmater_file == 7 and attacker_file == 6)) or 
         ((checkmater_rank == 0 and attacker_rank == 1) or (checkmater_rank == 7 and attacker_rank == 6))):
             if ladder:
-                print('Ladder mate')
+                self.result.add('Ladder mate')
     
     def ladder_corner(self, available_squares, square):
         # 8 plausible ways to get ladder mated on a corner
@@ -445,21 +555,21 @@ class CheckmatePattern:
 
         if chess.square_file(square) == 0 or chess.square_file(square) == 7:
             for i in available_squares[:2]:
-                for attacker in self.board.attackers(self.winner(), i):
+                for attacker in self.context.attackers(i):
                     if (square != i and (str(self.board.piece_at(attacker)).upper() == 'Q' or str(self.board.piece_at(attacker)).upper() == 'R') and 
                     (chess.square_file(attacker) == 1 or chess.square_file(attacker) == 6)):
                         ladder = True
 
         elif chess.square_rank(square) == 0 or chess.square_rank(square) == 7:
             for i in available_squares[1:]:
-                for attacker in self.board.attackers(self.winner(), i):
+                for attacker in self.context.attackers(i):
                     if (square != i and (str(self.board.piece_at(attacker)).upper() == 'Q' or str(self.board.piece_at(attacker)).upper() == 'R') and 
                     (chess.square_rank(attacker) == 1 or chess.square_rank(attacker) == 6)):
                         ladder = True
 
         # Prevents from printing it out multiple times
         if ladder:
-            print('Ladder mate')
+            self.result.add('Ladder mate')
 
     def bishop_and_knight(self, available_squares, square):
         if all(not self.is_blocked(i) for i in available_squares):
@@ -470,130 +580,65 @@ class CheckmatePattern:
             pass
     
     def find_checkmate_pattern(self):
-        losing_side = not self.winner()
-        opponent_king = self.board.king(losing_side)
+        result = self.classify()
+        self.show()
+        return result
+
+    def dispatch(self, king_square, piece, square, winner):
+        # Runs the rules in rules.py for the king's region and the checking piece, in order, leaving out the
+        # ones the prefilters rule out. Without both kings on the board some patterns fail in ways the
+        # prefilters don't know about, so then all of them run
+        board = self.board
+        if board.kings & board.occupied_co[chess.WHITE] and board.kings & board.occupied_co[chess.BLACK]:
+            rules = candidates(king_square.region, piece, chess.popcount(king_square.mask & board.occupied_co[not winner]),
+                               board_piece_types(board, winner), board_piece_types(board, chess.WHITE))
+        else:
+            rules = RULES_BY_BRANCH.get((king_square.region, piece), ())
+
+        available_squares = king_square.squares
+        for rule in rules:
+            method = getattr(self, rule.method)
+            if rule.args == BOTH:
+                method(available_squares, square)
+            else:
+                method(*[available_squares if arg == 'squares' else square for arg in rule.args])
+
+    def swallowed(self, error):
+        # Called with every TypeError classify() keeps going after. Does nothing here,
+        # instrument.Profile counts them
+        pass
+
+    def show(self):
+        # Prints the board and what classify() found
+        print(self.board)
+        if self.result.double_check:
+            print('Double checkmate')
+        elif self.result.piece == 'P':
+            print(self.get_full_name('P'), 'checkmate!')
+        elif self.result.piece:
+            print(self.get_full_name(self.result.piece), 'gave checkmate')
+        for name in self.result.names():
+            print(name)
+
+    def classify(self):
+        # Same as find_checkmate_pattern but nothing is printed, the matches end up in self.result
+        self.result = CheckmateResult()
+        context = self.context
 
         if self.board.is_checkmate:
-            print(self.board)
-            for square in self.board.checkers():
-                if len(self.board.checkers()) > 1:
-                    print('Double checkmate')
+            for square in context.checkers:
+                if len(context.checkers) > 1:
+                    self.result.double_check = True
                     break
                 try:
-                    if ((chess.square_file(opponent_king) == 0 or chess.square_file(opponent_king) == 7) and 
-                    (chess.square_rank(opponent_king) == 0 or chess.square_rank(opponent_king) == 7)): # Corner
-
-                        available_squares = self.king_on_corner(opponent_king)
-                        
-                        if str(self.board.piece_at(square)).upper() == 'Q':
-                            print(self.get_full_name('Q'), 'gave checkmate')
-
-                            self.back_rank_corner(available_squares, square)
-                            self.damianos_bishop_corner_and_lollis_corner(available_squares, square)
-                            self.queen_and_king_corner(square)
-                            self.box_corner(available_squares)
-                            self.grecos(available_squares, square)
-                            self.ladder_corner(available_squares, square)
-
-                        elif str(self.board.piece_at(square)).upper() == 'R':
-                            print(self.get_full_name('R'), 'gave checkmate')
-
-                            self.back_rank_corner(available_squares, square)
-                            self.anderssens(available_squares, square)
-                            self.anastasias_corner(available_squares)
-                            self.arabian(available_squares, square)
-                            self.mayets_corner(available_squares, square)
-                            self.box_corner(available_squares)
-                            self.grecos(available_squares, square)
-                            self.ladder_corner(available_squares, square)
-            
-                        elif str(self.board.piece_at(square)).upper() == 'B':
-                            print(self.get_full_name('B'), 'gave checkmate')
-
-                            self.corner_and_morphys(available_squares, square)
-
-                        elif str(self.board.piece_at(square)).upper() == 'N':
-                            print(self.get_full_name('N'), 'gave checkmate')
-
-                            self.smothered(available_squares)
-                            self.suffocation_corner(available_squares)
-                            self.corner_and_morphys(available_squares, square)
-                            
-                        elif str(self.board.piece_at(square)).upper() == 'P':
-                            print(self.get_full_name('P'), 'checkmate!')
-
-                    elif (chess.square_file(opponent_king) != 0 and chess.square_file(opponent_king) != 7 and 
-                    chess.square_rank(opponent_king) != 0 and chess.square_rank(opponent_king) != 7): # Center
-                        available_squares = self.surrounding_squares(opponent_king)
-
-                        if str(self.board.piece_at(square)).upper() == 'Q':
-                            print(self.get_full_name('Q'), 'gave checkmate')
-
-                            self.swallows_tail(available_squares, square)
-                            self.dovetail(available_squares, square)
-                            self.dovetail_bishop(available_squares, square)
-                            self.triangle_center(available_squares, square)
+                    king_square = KING_SQUARES[context.losing_king]
+                    self.result.region = king_square.region
+                    self.result.piece = str(self.board.piece_at(square)).upper()
 
-                        elif str(self.board.piece_at(square)).upper() == 'R':
-                            print(self.get_full_name('R'), 'gave checkmate')
+                    self.dispatch(king_square, self.result.piece, square, context.winner)
 
-                            self.hook(available_squares, square)
-                            self.blind_swine(available_squares)
-                            
-            
-                        elif str(self.board.piece_at(square)).upper() == 'B':
-                            print(self.get_full_name('B'), 'gave checkmate')
-
-                        elif str(self.board.piece_at(square)).upper() == 'N':
-                            print(self.get_full_name('N'), 'gave checkmate')
-
-                        elif str(self.board.piece_at(square)).upper() == 'P':
-                            print(self.get_full_name('P'), 'checkmate!')
-                    
-                    else: # Side
-                        available_squares = self.king_on_side(opponent_king)
-
-                        if str(self.board.piece_at(square)).upper() == 'Q':
-                            print(self.get_full_name('Q'), 'gave checkmate')
-
-                            self.scholars(available_squares, square)
-                            self.back_rank(available_squares, square)
-                            self.epaulette(available_squares, square)
-                            self.damianos_bishop_and_lollis(available_squares, square)
-                            self.damianos_and_max_langes(available_squares, square)
-                            self.queen_and_king(available_squares, square)
-                            self.box(available_squares)
-                            self.ladder(available_squares, square)
-
-                        elif str(self.board.piece_at(square)).upper() == 'R':
-                            print(self.get_full_name('R'), 'gave checkmate')
-
-                            self.ladder(available_squares, square)
-                            
-                            self.suffocation_and_pillsburys(available_squares, square)
-                            self.blind_swine(available_squares, square)
-                            self.back_rank(available_squares, square)
-                            self.anastasias(available_squares)
-                            self.opera(available_squares, square)
-                            self.kill_box(available_squares, square)   
-                            self.box(available_squares)
-                            self.anderssens(available_squares, square)
-                            self.hook_side(available_squares, square)
-            
-                        elif str(self.board.piece_at(square)).upper() == 'B':
-                            print(self.get_full_name('B'), 'gave checkmate')
-
-                            self.balestra(available_squares, square)
-
-                        elif str(self.board.piece_at(square)).upper() == 'N':
-                            print(self.get_full_name('N'), 'gave checkmate')
-
-                            self.smothered(available_squares)
-                            self.suffocation_and_pillsburys(available_squares)
-
-                        elif str(self.board.piece_at(square)).upper() == 'P':
-                            print(self.get_full_name('P'), 'checkmate!')
-
-                except TypeError:
+                except TypeError as error:
                     # 100% error proof
-                    pass
\ No newline at end of file
+                    self.swallowed(error)
+
+        return self.result
\ No newline at end of file
@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import chess
+import numpy as np
+from BitboardPattern import BitboardPattern
+from CheckmatePattern import PATTERN_NAMES, classify_position
+from vectorized import PositionBatch, classify_batch
+
+# BitboardPattern one position at a time against classify_batch (NumPy) on the same boards, split into
+# turning the boards into arrays and classifying the arrays.
+#
+# python3 benchmarks/bench_batch.py [FEN file] [repeats]
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'mates.fen')
+
+
+def best_of(repeats, function):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def scalar(boards):
+    matrix = np.zeros((len(boards), len(PATTERN_NAMES)), dtype=bool)
+    for i, board in enumerate(boards):
+        result = classify_position(board, BitboardPattern)
+        if result is not None:
+            matrix[i, result.patterns] = True
+    return matrix
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else CORPUS
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    with open(path) as f:
+        boards = [chess.Board(line.strip()) for line in f if line.strip()]
+
+    # Both have to find the same patterns
+    result = classify_batch(boards)
+    assert (scalar(boards) == result.patterns).all()
+
+    scalar_time = best_of(repeats, lambda: scalar(boards))
+    encode_time = best_of(repeats, lambda: PositionBatch(boards))
+    mated_encode_time = best_of(repeats, lambda: PositionBatch(boards, mated=True))
+    batch = PositionBatch(boards)
+    classify_time = best_of(repeats, lambda: classify_batch(batch))
+
+    print('positions:', len(boards), '(%d went through the scalar engine)' % result.scalar.sum())
+    print('BitboardPattern: %.0f positions/sec' % (len(boards) / scalar_time))
+    print('classify_batch: %.0f positions/sec (%.0f with mated=True), of which' % (
+        len(boards) / (encode_time + classify_time), len(boards) / (mated_encode_time + classify_time)))
+    print('    encoding: %.1f ms (%.1f ms with mated=True)' % (encode_time * 1000, mated_encode_time * 1000))
+    print('    classifying the arrays: %.1f ms, %.0f positions/sec' % (classify_time * 1000, len(boards) / classify_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import chess
+from CheckmatePattern import CheckmatePattern, classify_position
+from BitboardPattern import BitboardPattern
+from instrument import Profile
+
+# Classifier throughput on a fixed corpus of mated positions.
+#
+# python3 benchmarks/bench_classify.py                  report positions/sec, time per pattern and memory
+# python3 benchmarks/bench_classify.py --check          also fail (exit code 1) if an engine got slower than
+#                                                       the stored baseline by more than --threshold
+# python3 benchmarks/bench_classify.py --save-baseline  store this run as the new baseline
+#
+# Throughput depends on the machine, so the baseline should be saved on the machine that does the checking.
+# --check only catches an engine getting slower than the baseline, so a baseline from before a speedup lets
+# that speedup be lost again without failing. Save it again in the same commit as anything that makes an
+# engine faster.
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CORPUS = os.path.join(HERE, 'data', 'mates.fen')
+BASELINE = os.path.join(HERE, 'baseline.json')
+
+ENGINES = {
+    'CheckmatePattern': CheckmatePattern,
+    'BitboardPattern': BitboardPattern,
+}
+
+def load_corpus(path):
+    with open(path) as f:
+        return [chess.Board(line.strip()) for line in f if line.strip()]
+
+
+def classify_all(engine, boards):
+    for board in boards:
+        classify_position(board, engine)
+
+
+def throughput(engine, boards, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        classify_all(engine, boards)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(boards) / best
+
+
+def pattern_times(engine, boards):
+    profile = Profile()
+    classify_all(profile.instrument(engine), boards)
+    return profile.report()
+
+
+def peak_memory(engine, boards):
+    tracemalloc.start()
+    classify_all(engine, boards)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the checkmate classifiers on a fixed corpus')
+    parser.add_argument('--corpus', default=CORPUS)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--engine', choices=sorted(ENGINES), action='append',
+                        help='engine to benchmark (can be repeated, defaults to all of them)')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed drop in positions/sec against the baseline (0.2 = 20%%)')
+    parser.add_argument('--check', action='store_true', help='fail if throughput fell below the baseline')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--json', action='store_true', help='print the full report as JSON')
+    args = parser.parse_args()
+
+    boards = load_corpus(args.corpus)
+    report = {'positions': len(boards), 'engines': {}}
+
+    for name in args.engine or sorted(ENGINES):
+        engine = ENGINES[name]
+        report['engines'][name] = {
+            'positions_per_sec': round(throughput(engine, boards, args.repeats), 1),
+            'peak_memory_kb': round(peak_memory(engine, boards) / 1024, 1),
+            'profile': pattern_times(engine, boards),
+        }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print('positions:', report['positions'])
+        for name, result in report['engines'].items():
+            print('\n%s: %.0f positions/sec, peak memory %.0f KB' % (
+                name, result['positions_per_sec'], result['peak_memory_kb']))
+            profile = result['profile']
+            for pattern, times in profile['patterns'].items():
+                print('    %-42s %7d calls %7d matches %10.2f ms' % (
+                    pattern, times['calls'], times['matches'], times['seconds'] * 1000))
+            print('  by branch:')
+            for branch, times in profile['branches'].items():
+                print('    %-42s %7d positions %10.2f ms' % (branch, times['positions'], times['seconds'] * 1000))
+            for where, count in profile['swallowed'].items():
+                print('  swallowed %s: %d' % (where, count))
+            for error, count in profile['raised'].items():
+                print('  raised %s: %d' % (error, count))
+
+    failed = False
+    if args.check:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for name, result in report['engines'].items():
+            if name not in baseline:
+                continue
+            floor = baseline[name] * (1 - args.threshold)
+            if result['positions_per_sec'] < floor:
+                print('\nREGRESSION: %s ran %.0f positions/sec, the baseline is %.0f (floor %.0f)' % (
+                    name, result['positions_per_sec'], baseline[name], floor))
+                failed = True
+        if not failed:
+            print('\nThroughput is within %d%% of the baseline' % (args.threshold * 100))
+
+    if args.save_baseline:
+        baseline = {name: result['positions_per_sec'] for name, result in report['engines'].items()}
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2)
+            f.write('\n')
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from BitboardPattern import BitboardPattern
+from fetch import GameFetcher
+from lichess import MATE_EXPORT, STANDARD_PERFS, classify_games, classify_mate, mate_gave
+from lichess_server import NEWEST, fixture_games, games_by_player, serve
+from store import GameStore
+
+# How much of an export the classifier actually needs. Every player's games are downloaded from the stand-in
+# server (lichess_server.py, with games that didn't end in mate mixed in) once with everything a full export
+# can have, once with the API's defaults and once with MATE_EXPORT, and the labels of all three are checked
+# against classifying the fixture's moves. Then GameStore.update_many is run twice to check that the second
+# run only downloads the games played in between.
+#
+# python3 benchmarks/bench_export.py --others 9 --bytes-per-second 2000000
+
+EXPORTS = [
+    ('everything', {'clocks': True, 'opening': True, 'pgnInJson': True}),
+    ('defaults', {}),
+    ('MATE_EXPORT', MATE_EXPORT),
+]
+
+
+async def fetch_all(base_url, players, params, concurrency):
+    labels = {}
+    async with GameFetcher(base_url=base_url, concurrency=concurrency) as fetcher:
+        async for player, game in fetcher.export_many(players, **params):
+            gave = mate_gave(game, player)
+            if gave is not None:
+                labels[player, game['id']] = (gave, classify_mate(game, BitboardPattern).result)
+    return labels, fetcher
+
+
+def expected_labels(games, players):
+    labels = {}
+    for player, player_games in games_by_player(games).items():
+        if player in players:
+            for game, gave, pattern in classify_games(player_games, player, engine=BitboardPattern):
+                # Whoever won gave the mate, with black as well as with white
+                assert gave == (game['players'][game['winner']]['user']['id'] == player)
+                labels[player, game['id']] = (gave, pattern.result)
+    assert any(gave and game_id in black_wins(games) for (_, game_id), (gave, _) in labels.items())
+    return labels
+
+
+def black_wins(games):
+    return {game['id'] for game in games if game.get('winner') == 'black'}
+
+
+async def update_store(store, base_url, players, concurrency):
+    async with GameFetcher(base_url=base_url, concurrency=concurrency) as fetcher:
+        mates = [mate async for mate in store.update_many(fetcher, players, engine=BitboardPattern)]
+    return mates, fetcher
+
+
+def check_resume(server, games, players, concurrency):
+    # The first run sees the games up to a day before the newest one, the second run everything
+    base_url = 'http://%s:%d' % server.server_address
+    cutoff = NEWEST - 24 * 3600 * 1000
+    with tempfile.TemporaryDirectory() as directory:
+        store = GameStore(os.path.join(directory, 'games.sqlite'))
+        server.players = games_by_player([game for game in games if game['createdAt'] <= cutoff])
+        first, _ = asyncio.run(update_store(store, base_url, players, concurrency))
+        server.players = games_by_player(games)
+        second, fetcher = asyncio.run(update_store(store, base_url, players, concurrency))
+        stored = sum(1 for player in players for _ in store.games(player))
+        # The stats count mates given with black as given too
+        for player in players:
+            given = sum(1 for game in games_by_player(games)[player] if game.get('status') == 'mate' and
+                        game['perf'] in STANDARD_PERFS.split(',') and
+                        game['players'][game['winner']]['user']['id'] == player)
+            assert store.frequencies(player, 'given')[1] == given
+        store.close()
+
+    # update_many leaves the variant games on the server
+    new_games = sum(1 for player, player_games in games_by_player(games).items() if player in players
+                    for game in player_games
+                    if game['createdAt'] > cutoff and game['perf'] in STANDARD_PERFS.split(','))
+    assert fetcher.games == new_games, 'the second run downloaded games it already had'
+    assert stored == len(first) + len(second)
+    print('resuming: first run stored %d mates, the second downloaded %d new games (%d mates)' % (
+        len(first), fetcher.games, len(second)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bytes and time for full and trimmed exports')
+    parser.add_argument('--others', type=int, default=9, help='games that ended some other way per mate')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--delay', type=float, default=0.2, help='seconds before each response')
+    parser.add_argument('--bytes-per-second', type=float, default=2e6, help='per export, 0 = no limit')
+    args = parser.parse_args()
+
+    games = fixture_games(others=args.others)
+    server = serve(games, delay=args.delay, bytes_per_second=args.bytes_per_second)
+    base_url = 'http://%s:%d' % server.server_address
+    players = sorted(server.players)
+    expected = expected_labels(games, players)
+    print('players: %d, games: %d, mates to classify: %d' % (len(players), len(games), len(expected)))
+
+    for name, params in EXPORTS:
+        start = time.perf_counter()
+        labels, fetcher = asyncio.run(fetch_all(base_url, players, params, args.concurrency))
+        elapsed = time.perf_counter() - start
+        assert labels == expected, '%s: labels differ from classifying the moves' % name
+        print('%-12s %7.1f MB, %6d games, %6.2f s' % (name, fetcher.bytes / 1e6, fetcher.games, elapsed))
+
+    check_resume(server, games, players, args.concurrency)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from BitboardPattern import BitboardPattern
+from fetch import GameFetcher
+from lichess import classify_games
+from lichess_server import fixture_games, games_by_player, serve
+
+# Downloads and classifies every player's games from the stand-in server (lichess_server.py) with
+# GameFetcher, one export at a time and then several at once, and checks the labels against classifying
+# the same games the synchronous way.
+#
+# python3 benchmarks/bench_fetch.py --delay 0.2 --games-per-second 200 --concurrency 4
+
+
+async def fetch_all(base_url, players, concurrency, retry_wait):
+    labels = {}
+    async with GameFetcher(base_url=base_url, concurrency=concurrency, rate_limit_wait=retry_wait) as fetcher:
+        async for player, game, gave, pattern in fetcher.classify(players, engine=BitboardPattern):
+            labels[player, game['id']] = (gave, pattern.result)
+    return labels, fetcher
+
+
+def expected_labels(games, players):
+    labels = {}
+    for player, player_games in games_by_player(games).items():
+        if player in players:
+            for game, gave, pattern in classify_games(player_games, player, engine=BitboardPattern):
+                labels[player, game['id']] = (gave, pattern.result)
+    return labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time GameFetcher against a local stand-in for Lichess')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--delay', type=float, default=0.2, help='seconds before each response')
+    parser.add_argument('--games-per-second', type=float, default=200, help='per export, 0 = no limit')
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='answer every Nth request with 429')
+    args = parser.parse_args()
+
+    games = fixture_games()
+    server = serve(games, delay=args.delay, games_per_second=args.games_per_second,
+                   rate_limit_every=args.rate_limit_every, retry_after=1)
+    base_url = 'http://%s:%d' % server.server_address
+    players = sorted(server.players)
+    expected = expected_labels(games, players)
+
+    print('players: %d, games: %d, mates to classify: %d' % (len(players), len(games), len(expected)))
+    for concurrency in sorted({1, args.concurrency}):
+        start = time.perf_counter()
+        labels, fetcher = asyncio.run(fetch_all(base_url, players, concurrency, retry_wait=1))
+        elapsed = time.perf_counter() - start
+        assert labels == expected, 'labels differ from classifying the same games synchronously'
+        print('concurrency %d: %.2f s, %.0f games/sec, %d requests, %d rate limited, %.1f MB' % (
+            concurrency, elapsed, fetcher.games / elapsed, fetcher.requests, fetcher.rate_limited,
+            fetcher.bytes / 1e6))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import chess
+import index
+from BitboardPattern import BitboardPattern
+from CheckmatePattern import PATTERN_IDS, classify_position
+from index import GameIndex, IndexWriter, mated_king, merge_indexes, pattern_term, rating_terms
+
+# Builds a game index over made up games (the positions in benchmarks/data/mates.fen handed out at random with
+# speeds, rated or not and ratings), in one go and in parts that get merged, and times some queries with numpy
+# and without against going through the games. Every query's games are checked against that scan.
+#
+# python3 benchmarks/bench_index.py [--games 2000000] [--parts 4]
+
+MATES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'mates.fen')
+SPEEDS = ['bullet', 'blitz', 'rapid', 'classical']
+
+QUERIES = [
+    ("Anastasia's mates, rated blitz, 2000+", [pattern_term("Anastasia's mate"), 'speed:blitz', 'rated',
+                                              rating_terms(2000)]),
+    ('smothered mates, king on h8', [pattern_term('Smothered mate'), 'king:h8']),
+    ('back-rank mates by a rook', [pattern_term('Back-rank mate'), 'piece:R']),
+    ('corner mates, bullet or blitz', ['region:corner', ['speed:bullet', 'speed:blitz']]),
+]
+
+
+def made_up_games(count):
+    with open(MATES) as f:
+        fens = [line.strip() for line in f if line.strip()]
+    positions = [(fen, classify_position(chess.Board(fen), BitboardPattern), mated_king(fen)) for fen in fens]
+    random.seed(1)
+    games = []
+    for i in range(count):
+        fen, result, king = random.choice(positions)
+        games.append(('g%08d' % i, result, fen, king, random.choice(SPEEDS), random.random() < 0.8,
+                      int(random.gauss(1700, 300))))
+    return games
+
+
+def matches(game, terms):
+    # What a game would have to have for the query, without an index
+    _, result, _, king, speed, rated, rating = game
+    have = set(index.game_terms(result, king, speed, rated, rating))
+    return all(have.intersection([term] if isinstance(term, str) else term) for term in terms)
+
+
+def timed(function, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = function()
+        times.append(time.perf_counter() - start)
+    return value, statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Building and querying a game index')
+    parser.add_argument('--games', type=int, default=2000000)
+    parser.add_argument('--parts', type=int, default=4)
+    args = parser.parse_args()
+
+    games = made_up_games(args.games)
+    numpy = index.numpy
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'games.idx')
+        start = time.perf_counter()
+        writer = IndexWriter()
+        for game_id, result, fen, _, speed, rated, rating in games:
+            writer.add(game_id, result, fen, speed, rated, rating)
+        writer.write(path)
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(path)
+        print('%d games indexed in %.2f s (%.0f games/sec), %.1f MB, %.1f bytes a game, %d terms' % (
+            len(games), elapsed, len(games) / elapsed, size / 1e6, size / len(games), len(writer.postings)))
+        del writer
+
+        size = -(-len(games) // args.parts)
+        parts = []
+        for i in range(0, len(games), size):
+            writer = IndexWriter()
+            for game_id, result, fen, _, speed, rated, rating in games[i:i + size]:
+                writer.add(game_id, result, fen, speed, rated, rating)
+            parts.append(os.path.join(directory, 'part%d.idx' % len(parts)))
+            writer.write(parts[-1])
+        merged = os.path.join(directory, 'merged.idx')
+        start = time.perf_counter()
+        merge_indexes(parts, merged)
+        print('%d parts merged in %.2f s' % (len(parts), time.perf_counter() - start))
+        with open(path, 'rb') as one, open(merged, 'rb') as other:
+            assert one.read() == other.read()
+
+        start = time.perf_counter()
+        game_index = GameIndex(path)
+        print('opened in %.3f ms' % ((time.perf_counter() - start) * 1000))
+        for name, terms in QUERIES:
+            expected = [game[0] for game in games if matches(game, terms)]
+            line = '%-40s %7d games' % (name, len(expected))
+            for engine in ([numpy] if numpy else []) + [None]:
+                index.numpy = engine
+                docs, milliseconds = timed(lambda: game_index.search(*terms))
+                assert game_index.game_ids(docs) == expected
+                line += ', %s %8.2f ms' % ('numpy' if engine else 'python', milliseconds)
+            index.numpy = numpy
+            _, milliseconds = timed(lambda: [game for game in games if matches(game, terms)], 1)
+            print(line + ', scanning the games %.0f ms' % milliseconds)
+        game_index.close()
+
+
+if __name__ == '__main__':
+    main()
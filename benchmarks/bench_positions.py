@@ -0,0 +1,77 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import chess
+from BitboardPattern import BitboardPattern
+from CheckmatePattern import classify_position
+from positions import PositionStore, PositionWriter
+from records import encode
+
+# Classifying an archive again from a position store against from the FENs of the same positions, with the
+# positions in benchmarks/data/mates.fen repeated up to --positions. Reports how long reading the boards back
+# takes with and without classifying them, and relabel() with one worker and several. Every way has to come to
+# the same labels.
+#
+# python3 benchmarks/bench_positions.py [--positions 200000] [--workers 4]
+
+MATES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'mates.fen')
+
+
+def report(name, count, seconds):
+    print('%-34s %6.2f s, %8.0f positions/sec, %6.1f us each' % (name, seconds, count / seconds,
+                                                                 seconds / count * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Classifying again from a position store and from FENs')
+    parser.add_argument('--positions', type=int, default=200000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with open(MATES) as f:
+        mates = [line.strip() for line in f if line.strip()]
+    fens = [mates[i % len(mates)] for i in range(args.positions)]
+    count = len(fens)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'archive.pos')
+        start = time.perf_counter()
+        with PositionWriter(path) as writer:
+            for i, fen in enumerate(fens):
+                writer.add('g%08d' % i, fen)
+        report('written from FENs', count, time.perf_counter() - start)
+        print('%.0f bytes a position, the FENs take %.0f' % (
+            os.path.getsize(path) / count, sum(len(fen) + 1 for fen in fens) / count))
+
+        start = time.perf_counter()
+        from_fens = [encode(classify_position(chess.Board(fen), BitboardPattern)) for fen in fens]
+        report('FEN -> Board -> classify', count, time.perf_counter() - start)
+
+        with PositionStore(path) as store:
+            start = time.perf_counter()
+            for _ in store:
+                pass
+            report('store -> Board', count, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            from_store = [encode(classify_position(board, BitboardPattern)) for _, board in store]
+            report('store -> Board -> classify', count, time.perf_counter() - start)
+            assert from_store == from_fens
+
+        for workers in sorted({1, args.workers}):
+            with PositionStore(path, writable=True) as store:
+                start = time.perf_counter()
+                classified, _ = store.relabel(workers=workers, everything=True)
+                report('relabel(), %d worker%s' % (workers, 's' if workers > 1 else ''), classified,
+                       time.perf_counter() - start)
+                assert [(fields[11], fields[9]) for fields in store.records_unpacked()] == from_fens
+                assert not store.stale()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import chess
+from BitboardPattern import BitboardPattern
+from CheckmatePattern import CheckmateResult, classify_pattern
+from records import MateRecord, ResultBatch
+
+# Memory per classified game for the ways of holding on to results: the classifier objects themselves,
+# CheckmateResults with a list of names, a list of MateRecords and a ResultBatch. Then counting every pattern
+# over a million games from a list of names against ResultBatch.counts().
+#
+# python3 benchmarks/bench_records.py [FEN file]
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'mates.fen')
+
+
+def classify(fen):
+    pattern = BitboardPattern(chess.Board(fen))
+    classify_pattern(pattern)
+    return pattern
+
+
+def allocated(build):
+    # Bytes still allocated by what build() returns
+    gc.collect()
+    tracemalloc.start()
+    kept = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return kept, size
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else CORPUS
+    with open(path) as f:
+        fens = [line.strip() for line in f if line.strip()]
+    ids = ['%08x' % i for i in range(len(fens))]
+    patterns = [classify(fen) for fen in fens]
+    results = [pattern.result for pattern in patterns]
+    records = [MateRecord.from_result(game_id, pattern.board, pattern.result)
+               for game_id, pattern in zip(ids, patterns)]
+    # The records give back the same results, with each pattern once and in ID order
+    for record, result in zip(records, results):
+        if result is not None:
+            result = CheckmateResult(result.piece, result.region, sorted(set(result.patterns)), result.double_check)
+        assert record.result() == result
+
+    ways = [
+        ('CheckmatePattern objects', lambda: [(game_id, classify(fen)) for game_id, fen in zip(ids, fens)]),
+        ('CheckmateResult + names', lambda: [(game_id, fen, result and result.copy(), result and result.names())
+                                             for game_id, fen, result in zip(ids, fens, results)]),
+        ('MateRecord list', lambda: [MateRecord.from_result(game_id, fen, result)
+                                     for game_id, fen, result in zip(ids, fens, results)]),
+        ('ResultBatch', lambda: ResultBatch.from_records(records)),
+    ]
+    print('games:', len(fens))
+    for name, build in ways:
+        kept, size = allocated(build)
+        print('%-26s %7.0f bytes/game' % (name, size / len(fens)))
+
+    # A million games, the same results over and over
+    batch = ResultBatch.from_records(records)
+    repeats = 1000000 // len(batch) + 1
+    big = ResultBatch()
+    big.keys = batch.keys * repeats
+    big.codes = batch.codes * repeats
+    big.patterns = batch.patterns * repeats
+    names = [result.names() if result else [] for result in results] * repeats
+
+    start = time.perf_counter()
+    counts = Counter()
+    for game_names in names:
+        counts.update(set(game_names))
+    list_time = time.perf_counter() - start
+    start = time.perf_counter()
+    batch_counts = big.counts()
+    batch_time = time.perf_counter() - start
+    assert counts == batch_counts
+    print('counting %d games: names %.3f s, bitsets %.3f s' % (len(big), list_time, batch_time))
+
+
+if __name__ == '__main__':
+    main()
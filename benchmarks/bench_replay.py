@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from CheckmatePattern import CheckmatePattern
+from corpus import final_fen, final_board
+
+# How long it takes to get from a game's move list to a CheckmatePattern ready to classify,
+# the old way (PGN game tree, then a FEN that CheckmatePattern parses again) and the fast path
+# (moves pushed straight onto one board that is handed over as it is).
+#
+# python3 benchmarks/bench_replay.py [games file] [repeats]
+#
+# The games file has one game per line as space separated SAN moves, like the 'moves' field of a Lichess export.
+
+GAMES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'games.txt')
+
+
+def old_way(moves):
+    return CheckmatePattern(final_fen(moves))
+
+
+def fast_path(moves):
+    return CheckmatePattern(final_board(moves))
+
+
+def time_per_game(function, games, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for moves in games:
+            function(moves)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(games)
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else GAMES
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    with open(path) as f:
+        games = [line.strip() for line in f if line.strip()]
+
+    # Both ways have to end up on the same position
+    for moves in games:
+        assert old_way(moves).board.board_fen() == fast_path(moves).board.board_fen()
+
+    before = time_per_game(old_way, games, repeats)
+    after = time_per_game(fast_path, games, repeats)
+
+    print('games:', len(games))
+    print('before (PGN game tree + FEN): %.1f us per game' % (before * 1e6))
+    print('after (moves pushed on one board): %.1f us per game' % (after * 1e6))
+    print('speedup: %.2fx' % (before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import argparse
+import csv
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import chess
+from BitboardPattern import BitboardPattern
+from CheckmatePattern import classify_position
+from search import PUZZLE_COLUMNS, puzzle_board, read_puzzles, solve_puzzles
+
+# Mate searches over a puzzle CSV in the Lichess format, made from the last moves of the games in
+# benchmarks/data/games.txt: the position 2N plies before the mate, with the opponent's move and the N moves
+# that were played as Moves and mateInN as the theme. The games are random play, so the played line isn't always
+# forced and some puzzles have no mate in N (or a shorter one). Every line that is found gets played out and has
+# to end in the mate its labels came from. Reports positions/sec and nodes/sec with one worker and several, and
+# with --checks-only.
+#
+# python3 benchmarks/bench_search.py [--puzzles 600] [--max-moves 3] [--workers 4]
+
+GAMES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'games.txt')
+
+
+def write_puzzles(path, count, max_moves):
+    with open(GAMES) as f:
+        games = [line.split() for line in f if line.strip()][:count]
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(PUZZLE_COLUMNS)
+        for i, moves in enumerate(games):
+            n = i % max_moves + 1
+            start = max(0, len(moves) - 2 * n)
+            board = chess.Board()
+            for san in moves[:start]:
+                board.push_san(san)
+            fen = board.fen()
+            solution = [board.push_san(san).uci() for san in moves[start:]]
+            writer.writerow(['p%05d' % i, fen, ' '.join(solution), 1500, 75, 90, 100, 'mate mateIn%d' % n,
+                             'https://lichess.org/g%07d' % i, ''])
+
+
+def run(path, max_moves, workers, checks_only):
+    start = time.perf_counter()
+    solutions = list(solve_puzzles(read_puzzles(path), max_moves, workers, checks_only))
+    elapsed = time.perf_counter() - start
+    nodes = sum(searched for _, _, searched, _ in solutions)
+    found = Counter(solution.mate_in for _, solution, _, _ in solutions if solution)
+    print('workers %d%s: %.2f s, %.1f positions/sec, %.0f nodes/sec, mates found %s, none in %d' % (
+        workers, ' checks only' if checks_only else '', elapsed, len(solutions) / elapsed, nodes / elapsed,
+        dict(sorted(found.items())), len(solutions) - sum(found.values())))
+    return {puzzle_id: solution for puzzle_id, solution, _, _ in solutions}
+
+
+def check_lines(path, solutions):
+    for row in read_puzzles(path):
+        solution = solutions[row['PuzzleId']]
+        if row['Themes'].endswith('mateIn1'):
+            # The game's last move mated, so there has to be a mate in 1
+            assert solution is not None and solution.mate_in == 1
+        if solution is None:
+            continue
+        board = puzzle_board(row)
+        for move in solution.line:
+            board.push_uci(move)
+        assert board.is_checkmate() and len(solution.line) == 2 * solution.mate_in - 1
+        assert classify_position(board, BitboardPattern) == solution.result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput of the mate search over a puzzle CSV')
+    parser.add_argument('--puzzles', type=int, default=600)
+    parser.add_argument('--max-moves', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'puzzles.csv')
+        write_puzzles(path, args.puzzles, args.max_moves)
+        print('puzzles:', args.puzzles)
+        solutions = run(path, args.max_moves, 1, False)
+        check_lines(path, solutions)
+        if args.workers > 1:
+            assert run(path, args.max_moves, args.workers, False) == solutions
+        checks_only = run(path, args.max_moves, 1, True)
+        check_lines(path, checks_only)
+        patterns = Counter()
+        for solution in solutions.values():
+            if solution:
+                patterns.update(solution.result.names() if solution.result else [])
+        print('patterns at the end of the main lines:', ', '.join('%s %d' % item for item in patterns.most_common(5)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+# What a short lived process pays before its first label: starting Python, importing a module of this repo and
+# classifying one position, each measured in a fresh interpreter and reported as the median of --runs. Also
+# says which of the heavy modules (berserk, aiohttp, asyncio, chess.pgn, numpy) each import drags in, and how
+# long a pool of workers takes to hand back its first result when they are forked and when they are spawned.
+#
+# python3 benchmarks/bench_startup.py --runs 10
+
+MODULES = ['CheckmatePattern', 'BitboardPattern', 'corpus', 'lichess', 'store', 'cli', 'main']
+HEAVY = ['berserk', 'aiohttp', 'asyncio', 'chess.pgn', 'numpy']
+FEN = '6rk/6pp/8/8/8/8/8/K5NR b - - 0 1'
+
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+from {engine} import {engine}
+{engine}({fen!r}).classify()
+first = time.perf_counter()
+{engine}({fen!r}).classify()
+second = time.perf_counter()
+print(json.dumps({{'import': imported - start, 'first': first - imported, 'second': second - first,
+                  'heavy': [name for name in {heavy!r} if name in sys.modules]}}))
+'''
+
+
+def run_child(module, engine):
+    code = CHILD.format(module=module, engine=engine, fen=FEN, heavy=HEAVY)
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    times = json.loads(output)
+    times['total'] = time.perf_counter() - start
+    return times
+
+
+def first_pool_result(method, workers):
+    # Seconds from asking for a pool to its first classified chunk
+    code = '''
+import multiprocessing, sys, time
+from corpus import classify_chunk, worker_pool
+from CheckmatePattern import CheckmatePattern
+if __name__ == '__main__':
+    start = time.perf_counter()
+    pool = worker_pool({workers}) if {method!r} == 'fork' else multiprocessing.get_context({method!r}).Pool({workers})
+    with pool:
+        pool.apply(classify_chunk, ([{fen!r}], CheckmatePattern, 0))
+    print(time.perf_counter() - start)
+'''.format(method=method, workers=workers, fen=FEN)
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return float(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import time and first-classification latency')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+
+    print('%-18s %9s %9s %9s %9s   %s' % ('module', 'process', 'import', 'first', 'second', 'heavy modules loaded'))
+    for module in MODULES:
+        runs = [run_child(module, 'BitboardPattern') for _ in range(args.runs)]
+
+        def median(key):
+            return statistics.median(run[key] for run in runs) * 1000
+
+        print('%-18s %7.1fms %7.1fms %7.2fms %7.2fms   %s' % (
+            module, median('total'), median('import'), median('first'), median('second'),
+            ', '.join(runs[0]['heavy']) or '-'))
+
+    for method in ('fork', 'spawn'):
+        seconds = statistics.median(first_pool_result(method, args.workers) for _ in range(args.runs))
+        print('%d workers, %-5s first result after %.1f ms' % (args.workers, method, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from BitboardPattern import BitboardPattern
+from CheckmatePattern import PATTERN_NAMES, classify_position
+from stats import ALL, SCHEMA, PatternStats, load_stats, save_stats, top_patterns
+from store import GameStore
+import chess
+
+# Pattern stats over made up games: the positions in benchmarks/data/mates.fen handed out at random to players
+# (who play two speeds each), months and directions. Reports how fast games get counted, checks that stats
+# counted in parts and merged (like workers or days would) and stats saved to SQLite a part at a time both come
+# out the same as counting everything at once, and times "top patterns for player X" from the rollups against
+# going through the games for it.
+#
+# python3 benchmarks/bench_stats.py [--games 1000000] [--players 2000] [--parts 8]
+
+MATES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'mates.fen')
+SPEEDS = ['ultraBullet', 'bullet', 'blitz', 'rapid', 'classical', 'correspondence']
+# 2020-01-01 and about 30 days, in milliseconds
+START = 1577836800000
+MONTH = 30 * 24 * 3600 * 1000
+MONTHS = 24
+
+
+def made_up_games(count, players):
+    with open(MATES) as f:
+        results = [classify_position(chess.Board(line.strip()), BitboardPattern) for line in f if line.strip()]
+    random.seed(1)
+    speeds = {'player%04d' % i: random.sample(SPEEDS, 2) for i in range(players)}
+    names = list(speeds)
+    games = []
+    for _ in range(count):
+        player = random.choice(names)
+        games.append((player, START + random.randrange(MONTHS * MONTH), random.choice(speeds[player]),
+                      random.random() < 0.5, random.choice(results)))
+    return games
+
+
+def count(games):
+    stats = PatternStats()
+    for game in games:
+        stats.add(*game)
+    return stats
+
+
+def milliseconds(function, args):
+    times = []
+    for arg in args:
+        start = time.perf_counter()
+        function(arg)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def scan_top(games, player):
+    # What answering the query without rollups takes: every game gets looked at
+    counts = Counter()
+    for name, _, _, gave, result in games:
+        if name == player and gave and result is not None:
+            counts.update(set(result.patterns))
+    # Ties go to the lower pattern ID, like in the stats
+    return [(PATTERN_NAMES[i], n) for i, n in sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:5]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Counting, merging and querying pattern stats')
+    parser.add_argument('--games', type=int, default=1000000)
+    parser.add_argument('--players', type=int, default=2000)
+    parser.add_argument('--parts', type=int, default=8)
+    args = parser.parse_args()
+
+    games = made_up_games(args.games, args.players)
+    start = time.perf_counter()
+    stats = count(games).roll_up()
+    elapsed = time.perf_counter() - start
+    print('%d games counted in %.2f s, %.0f games/sec, %d cells and rollups' % (
+        len(games), elapsed, len(games) / elapsed, len(stats)))
+
+    size = -(-len(games) // args.parts)
+    # Workers would send theirs rolled up already
+    parts = [count(games[i:i + size]).roll_up() for i in range(0, len(games), size)]
+    start = time.perf_counter()
+    merged = PatternStats()
+    for part in parts:
+        merged += part
+    print('%d parts merged in %.3f s' % (len(parts), time.perf_counter() - start))
+    assert merged == stats
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = sqlite3.connect(os.path.join(directory, 'stats.sqlite'))
+        db.executescript(SCHEMA)
+        saves = []
+        for part in parts:
+            start = time.perf_counter()
+            save_stats(db, part)
+            db.commit()
+            saves.append(time.perf_counter() - start)
+        print('saved a part at a time: %.3f s a part, %d rows' % (
+            statistics.mean(saves), db.execute('SELECT COUNT(*) FROM pattern_stats').fetchone()[0]))
+        assert load_stats(db) == stats
+
+        players = random.sample(sorted({game[0] for game in games}), 50)
+        for player in players[:5]:
+            expected = scan_top(games, player)
+            assert stats.top(player, direction='given') == expected
+            assert top_patterns(db, player, direction='given') == expected
+        print('top patterns given, median of %d players:' % len(players))
+        print('    rollups in memory   %8.4f ms' % milliseconds(lambda p: stats.top(p, direction='given'), players))
+        print('    rollups in SQLite   %8.4f ms' % milliseconds(lambda p: top_patterns(db, p, direction='given'),
+                                                               players))
+        print('    going through games %8.1f ms' % milliseconds(lambda p: scan_top(games, p), players[:5]))
+        db.close()
+
+        # GameStore keeps the same table up to date game by game
+        store = GameStore(os.path.join(directory, 'games.sqlite'))
+        some = games[:20000]
+        for i, (player, created_at, speed, gave, result) in enumerate(some):
+            store.add('g%d' % i, player, created_at, gave, '', result, speed)
+        store.commit()
+        assert store.frequencies()[0] == count(some).frequencies()[0]
+        assert store.top_patterns(players[0], 'given') == count(some).top(players[0], direction='given')
+        store.close()
+
+    print('most common over all games:', ', '.join('%s %d' % item for item in stats.top(ALL, n=5)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from BitboardPattern import BitboardPattern
+from CheckmatePattern import CLASSIFIER_VERSION
+from lichess import STANDARD_PERFS, classify_games
+from lichess_server import NEWEST, fixture_games, games_by_player
+from store import GameStore
+
+# GameStore.update (the berserk path main.py takes) without the network: a stand-in client hands out the games
+# from lichess_server.py's fixture the way berserk.Client.games.export_by_player does, newest first and with
+# createdAt as a datetime. Checks that the stored mates have the labels of classifying the fixture's moves,
+# that a second run only gets the games played in between, that a game two of the players played is kept for
+# both of them, that reclassify_stale() gives every outdated game the same labels back a batch at a time, and
+# that a file with the games keyed by ID alone is rebuilt without losing any of them. Reports games/sec for
+# update and reclassify_stale.
+#
+# python3 benchmarks/bench_store.py --others 9 --batch-size 100
+
+
+class StubGames:
+
+    def __init__(self, games):
+        self.players = games_by_player(games)
+        # Games handed out by the last export
+        self.handed_out = 0
+
+    def export_by_player(self, player, since=None, perf_type=None, **params):
+        # Like berserk, only the filters this knows about do anything and the rest are accepted and ignored
+        self.handed_out = 0
+        perfs = perf_type.split(',') if perf_type else None
+        for game in self.players.get(player, []):
+            if since is not None and game['createdAt'] < since:
+                continue
+            if perfs is not None and game['perf'] not in perfs:
+                continue
+            self.handed_out += 1
+            yield dict(game, createdAt=datetime.fromtimestamp(game['createdAt'] / 1000, timezone.utc))
+
+
+class StubClient:
+
+    def __init__(self, games):
+        self.games = StubGames(games)
+
+
+def expected_labels(games, players):
+    # (player, game ID) -> (gave, result) from the fixture's moves
+    labels = {}
+    for player, player_games in games_by_player(games).items():
+        if player in players:
+            standard = [game for game in player_games if game['perf'] in STANDARD_PERFS.split(',')]
+            for game, gave, pattern in classify_games(standard, player, engine=BitboardPattern):
+                labels[player, game['id']] = (gave, pattern.result)
+    return labels
+
+
+def stored_labels(store, players):
+    return {(player, game_id): (gave, result) for player in players
+            for game_id, gave, fen, result in store.games(player)}
+
+
+def check_update(store, games, players, cutoff):
+    # The first run sees the games up to cutoff, the second run everything
+    client = StubClient([game for game in games if game['createdAt'] <= cutoff])
+    first = []
+    handed_out = 0
+    start = time.perf_counter()
+    for player in players:
+        first += store.update(client, player, engine=BitboardPattern, perf_type=STANDARD_PERFS)
+        handed_out += client.games.handed_out
+    elapsed = time.perf_counter() - start
+
+    client = StubClient(games)
+    second = []
+    new_games = 0
+    for player in players:
+        second += store.update(client, player, engine=BitboardPattern, perf_type=STANDARD_PERFS)
+        new_games += client.games.handed_out
+    expected_new = sum(1 for player in players for game in games_by_player(games)[player]
+                       if game['createdAt'] > cutoff and game['perf'] in STANDARD_PERFS.split(','))
+    assert new_games == expected_new, 'the second run got games it already had'
+
+    expected = expected_labels(games, players)
+    assert stored_labels(store, players) == expected, 'stored labels differ from classifying the moves'
+    assert len(first) + len(second) == len(expected)
+    for player in players:
+        given = sum(1 for (name, _), (gave, _) in expected.items() if name == player and gave)
+        assert store.frequencies(player, 'given')[1] == given
+    both = store.db.execute('SELECT COUNT(*) FROM (SELECT id FROM games GROUP BY id HAVING COUNT(*) = 2)').fetchone()[0]
+    assert both, 'no game was kept for both of its players'
+    print('update: %d games handed out, %d mates stored, %.0f games/sec, second run got %d new games (%d mates)' % (
+        handed_out, len(first), handed_out / elapsed, new_games, len(second)))
+    print('games kept for both players: %d' % both)
+    return expected
+
+
+def check_reclassify(store, players, expected, batch_size):
+    # Marks every game as classified by an older version, so they all get their labels back from the FENs
+    before = {player: store.frequencies(player, 'given') for player in players}
+    store.db.execute('UPDATE games SET version = ?', (CLASSIFIER_VERSION - 1,))
+    store.db.commit()
+    start = time.perf_counter()
+    updated = store.reclassify_stale(BitboardPattern, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+    assert updated == len(expected)
+    assert stored_labels(store, players) == expected
+    assert {player: store.frequencies(player, 'given') for player in players} == before
+    assert store.reclassify_stale(BitboardPattern, batch_size=batch_size) == 0
+    print('reclassify_stale: %d games in batches of %d, %.0f games/sec' % (updated, batch_size, updated / elapsed))
+
+
+def check_rekey(directory):
+    # A file from before games were kept for each player, with the game ID as the primary key
+    path = os.path.join(directory, 'old.sqlite')
+    db = sqlite3.connect(path)
+    db.execute('CREATE TABLE games (id TEXT PRIMARY KEY, player TEXT NOT NULL, created_at INTEGER NOT NULL, '
+               'gave INTEGER NOT NULL, fen TEXT NOT NULL, piece TEXT, region TEXT, patterns TEXT, '
+               'double_check INTEGER, version INTEGER)')
+    db.execute("INSERT INTO games VALUES ('g0000001', 'alice', 1, 1, '8/8/8/8/8/8/8/8 w - - 0 1', 'Q', 'side', "
+               "'3', 0, ?)", (CLASSIFIER_VERSION,))
+    db.commit()
+    db.close()
+
+    store = GameStore(path)
+    store.add('g0000001', 'bob', 1, False, '8/8/8/8/8/8/8/8 w - - 0 1', None)
+    store.commit()
+    rows = store.db.execute('SELECT player, gave FROM games WHERE id = ? ORDER BY player', ('g0000001',)).fetchall()
+    store.close()
+    assert rows == [('alice', 1), ('bob', 0)], rows
+    print('old file rebuilt with the (id, player) key')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check GameStore.update and reclassify_stale offline')
+    parser.add_argument('--others', type=int, default=9, help='games that ended some other way per mate')
+    parser.add_argument('--batch-size', type=int, default=100, help='rows reclassify_stale reads at a time')
+    args = parser.parse_args()
+
+    games = fixture_games(others=args.others)
+    players = sorted(games_by_player(games))
+    cutoff = NEWEST - 24 * 3600 * 1000
+    with tempfile.TemporaryDirectory() as directory:
+        store = GameStore(os.path.join(directory, 'games.sqlite'))
+        expected = check_update(store, games, players, cutoff)
+        check_reclassify(store, players, expected, args.batch_size)
+        store.close()
+        check_rekey(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+from urllib.request import urlopen
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import chess
+from BitboardPattern import BitboardPattern
+from CheckmatePattern import classify_position
+from lichess_server import GAMES, fixture_games, serve
+from watch import GameWatcher
+
+# Plays the games in benchmarks/data/games.txt through a GameWatcher one UCI move at a time and reports how
+# long each move and each mate took, with and without mate threats, checking the labels against classifying
+# the final positions. Then follows a few games live from the stand-in server's game stream.
+#
+# python3 benchmarks/bench_watch.py [--games 3000] [--stream 8] [--move-delay 0.01]
+
+
+def uci_games(path, count):
+    # The games as UCI moves, like a game stream sends them, along with their final boards
+    games = []
+    with open(path) as f:
+        for line in f:
+            if line.strip() and len(games) < count:
+                board = chess.Board()
+                moves = [board.push_san(san).uci() for san in line.split()]
+                games.append((moves, board))
+    return games
+
+
+def percentiles(seconds):
+    seconds = sorted(seconds)
+    return 'median %.3f ms, p99 %.3f ms, max %.3f ms' % (
+        statistics.median(seconds) * 1000, seconds[int(len(seconds) * 0.99)] * 1000, seconds[-1] * 1000)
+
+
+def replay(games, threats):
+    move_times = []
+    mates = []
+    threat_count = 0
+    for moves, final in games:
+        watcher = GameWatcher(threats=threats)
+        for move in moves:
+            threats_before = watcher.mate_threats
+            start = time.perf_counter()
+            mate = watcher.push(move)
+            move_times.append(time.perf_counter() - start)
+            threat_count += len(watcher.mate_threats)
+        assert mate is not None and watcher.board.board_fen() == final.board_fen()
+        assert mate.result == classify_position(final, BitboardPattern)
+        if threats:
+            # The mate was one of the threats the move before, with the same labels
+            assert (mate.move, mate.result) in threats_before
+        mates.append(mate.seconds)
+    print('threats %-5s %7d moves, %.0f moves/sec, %d mate threats seen' % (
+        threats, len(move_times), len(move_times) / sum(move_times), threat_count))
+    print('    per move: ' + percentiles(move_times))
+    print('    mate to labels: ' + percentiles(mates))
+
+
+def follow_stream(base_url, games):
+    for game in games:
+        watcher = GameWatcher()
+        with urlopen('%s/api/stream/game/%s' % (base_url, game['id'])) as response:
+            mates = [mate for mate in watcher.follow(response) if mate]
+        expected = classify_position(chess.Board(game['lastFen'] + (' b' if game['winner'] == 'white' else ' w')),
+                                  BitboardPattern)
+        assert len(mates) == 1 and mates[0].result == expected
+        print('    %s: mate on ply %d, %s, labelled in %.3f ms' % (
+            game['id'], mates[0].ply, ', '.join(mates[0].result.names()) or 'no pattern', mates[0].seconds * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Move and mate latency of GameWatcher')
+    parser.add_argument('--games', type=int, default=3000)
+    parser.add_argument('--stream', type=int, default=8, help='games to follow from the stand-in game stream')
+    parser.add_argument('--move-delay', type=float, default=0.01)
+    args = parser.parse_args()
+
+    games = uci_games(GAMES, args.games)
+    for threats in (False, True):
+        replay(games, threats)
+
+    if args.stream:
+        fixture = fixture_games()[:args.stream]
+        server = serve(fixture, move_delay=args.move_delay)
+        print('following %d games from the game stream, %.0f ms between moves:' % (len(fixture), args.move_delay * 1000))
+        follow_stream('http://%s:%d' % server.server_address, fixture)
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import chess
+
+# A stand-in for the Lichess game export API (GET /api/games/user/<name>, NDJSON), so fetch.py can be run
+# and timed without network access or an account. The games come from benchmarks/data/games.txt, shared
+# out between a few made up players.
+#
+# python3 benchmarks/lichess_server.py --port 8080     then GameFetcher(base_url='http://localhost:8080')
+#
+# --delay adds a pause before each response (a round trip to the real server), --games-per-second slows the
+# stream down like Lichess does, --bytes-per-second makes each export a slow download and --rate-limit-every N
+# answers every Nth request with 429.
+#
+# GET /api/stream/game/<id> plays one of the games out move by move like Lichess streams a game in progress,
+# --move-delay seconds apart.
+#
+# --others N adds N games per mate that ended some other way (resignations, flags, draws, the odd variant game)
+# so exports look more like a real account's. The fields and filters the real endpoint has for trimming an
+# export are understood too: moves, lastFen, clocks, opening, pgnInJson, tags, rated and perfType.
+
+GAMES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'games.txt')
+PLAYERS = ['alice', 'bob', 'carol', 'dave', 'erin', 'frank', 'grace', 'heidi']
+# 2021-01-01, the newest game is played a bit after this and the rest go back in time from there
+NEWEST = 1609459200000
+# How the games that weren't mates ended, 'variant' is a mate in a chess960 game
+ENDINGS = ['resign', 'outoftime', 'draw', 'resign', 'variant']
+OPENINGS = [('C20', "King's Pawn Game"), ('B01', 'Scandinavian Defense'), ('A00', 'Van Geet Opening'),
+            ('D00', "Queen's Pawn Game"), ('C44', "King's Knight Opening")]
+
+
+def fixture_games(path=GAMES, players=PLAYERS, others=0):
+    # Export records for the games in path, newest first, with the fields the Lichess API sends. Each game
+    # ends in mate, others > 0 puts that many games that ended some other way in front of each of them
+    with open(path) as f:
+        lines = [line.split() for line in f if line.strip()]
+    games = []
+    for moves in lines:
+        # Games that were cut short a few moves before the mate, then the mate itself
+        ends = [max(2, len(moves) - 1 - (len(games) + j) % 6) for j in range(others)] + [len(moves)]
+        # One pass over the moves for all their final positions
+        board = chess.Board()
+        fens = {}
+        for ply, san in enumerate(moves, 1):
+            board.push_san(san)
+            if ply in ends:
+                fens[ply] = board.board_fen()
+        for j, end in enumerate(ends):
+            ending = ENDINGS[(len(games) + j) % len(ENDINGS)] if j < others else 'mate'
+            games.append(fixture_game(len(games), players, moves[:end], fens[end], ending))
+    return games
+
+
+def fixture_game(i, players, moves, last_fen, ending):
+    white = players[i % len(players)]
+    black = players[(i * 3 + 1) % len(players)]
+    if black == white:
+        black = players[(i + 1) % len(players)]
+    created_at = NEWEST - i * 600000
+    perf = 'chess960' if ending == 'variant' else ['bullet', 'blitz', 'rapid'][i % 3]
+    game = {
+        'id': 'g%07d' % i,
+        'rated': i % 5 != 0,
+        'variant': 'chess960' if ending == 'variant' else 'standard',
+        'speed': perf if perf != 'chess960' else 'blitz',
+        'perf': perf,
+        'createdAt': created_at,
+        'lastMoveAt': created_at + 300000,
+        'status': 'mate' if ending in ('mate', 'variant') else ending,
+        'players': {
+            'white': {'user': {'name': white, 'id': white}, 'rating': 1500 + i % 300,
+                      'ratingDiff': 6 if len(moves) % 2 else -6},
+            'black': {'user': {'name': black, 'id': black}, 'rating': 1500 + i * 7 % 300,
+                      'ratingDiff': -6 if len(moves) % 2 else 6},
+        },
+        'moves': ' '.join(moves),
+        'lastFen': last_fen,
+        'clocks': [18003 - 211 * ply - ply * ply % 97 for ply in range(len(moves))],
+        'opening': {'eco': OPENINGS[i % len(OPENINGS)][0], 'name': OPENINGS[i % len(OPENINGS)][1], 'ply': 2},
+        'clock': {'initial': 180, 'increment': 0, 'totalTime': 180},
+    }
+    if ending != 'draw':
+        # Whoever made the last move gave the mate, or in a resignation or a flag was the one still standing
+        game['winner'] = 'white' if len(moves) % 2 else 'black'
+    return game
+
+
+def export_record(game, params):
+    # The fields of game that an export with these params sends, in the API's defaults when params don't say
+    def wanted(name, default):
+        return params.get(name, default) == 'true'
+
+    record = {key: value for key, value in game.items() if key not in ('moves', 'lastFen', 'clocks', 'opening')}
+    if wanted('moves', 'true'):
+        record['moves'] = game['moves']
+        if wanted('clocks', 'false'):
+            record['clocks'] = game['clocks']
+    if wanted('opening', 'false'):
+        record['opening'] = game['opening']
+    if wanted('lastFen', 'false'):
+        record['lastFen'] = game['lastFen']
+    if wanted('pgnInJson', 'false'):
+        tags = [('Event', ('Rated ' if game['rated'] else 'Casual ') + game['speed'] + ' game'),
+                ('Site', 'https://lichess.org/' + game['id']),
+                ('White', game['players']['white']['user']['name']),
+                ('Black', game['players']['black']['user']['name']),
+                ('Result', {'white': '1-0', 'black': '0-1'}.get(game.get('winner'), '1/2-1/2'))]
+        if wanted('tags', 'true'):
+            record['pgn'] = ''.join('[%s "%s"]\n' % tag for tag in tags) + '\n' + game['moves'] + '\n'
+        else:
+            record['pgn'] = game['moves'] + '\n'
+    return record
+
+
+def games_by_player(games):
+    players = {}
+    for game in games:
+        for color in ('white', 'black'):
+            players.setdefault(game['players'][color]['user']['id'], []).append(game)
+    return players
+
+
+class ExportHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def write_line(self, record):
+        line = json.dumps(record).encode() + b'\n'
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(line), line))
+        self.wfile.flush()
+        return len(line)
+
+    def start_stream(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        match = re.match(r'^/api/games/user/([^/]+)$', url.path)
+        if match:
+            self.export(match.group(1), url)
+            return
+        match = re.match(r'^/api/stream/game/([^/]+)$', url.path)
+        if match:
+            self.stream_game(match.group(1))
+            return
+        self.send_error(404)
+
+    def stream_game(self, game_id):
+        # The game played out move by move like /api/stream/game/<id> does for a game in progress: a message
+        # about the game, one with the FEN and last move ('lm') after every move, then the game again once over
+        server = self.server
+        game = server.games.get(game_id)
+        if game is None:
+            self.send_error(404)
+            return
+        board = chess.Board()
+        about = {key: game[key] for key in ('id', 'rated', 'speed', 'perf', 'createdAt', 'players')}
+        self.start_stream()
+        self.write_line(dict(about, initialFen='startpos', fen=board.board_fen(), turns=0,
+                             status={'id': 20, 'name': 'started'}))
+        for ply, san in enumerate(game['moves'].split()):
+            if server.move_delay:
+                time.sleep(server.move_delay)
+            move = board.push_san(san)
+            self.write_line({'fen': board.board_fen(), 'lm': move.uci(), 'wc': game['clocks'][ply] // 100,
+                             'bc': game['clocks'][ply] // 100})
+        self.write_line(dict(about, fen=board.board_fen(), turns=board.ply(), lastMove=board.peek().uci(),
+                             status={'id': 30, 'name': game['status']}, winner=game.get('winner')))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def export(self, player, url):
+        server = self.server
+
+        with server.lock:
+            server.requests += 1
+            limited = server.rate_limit_every and server.requests % server.rate_limit_every == 0
+        if limited:
+            self.send_response(429)
+            self.send_header('Retry-After', str(server.retry_after))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if server.delay:
+            time.sleep(server.delay)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        games = server.players.get(player.lower(), [])
+        if 'since' in params:
+            games = [game for game in games if game['createdAt'] >= int(params['since'])]
+        if 'until' in params:
+            games = [game for game in games if game['createdAt'] <= int(params['until'])]
+        if 'rated' in params:
+            games = [game for game in games if game['rated'] == (params['rated'] == 'true')]
+        if 'perfType' in params:
+            perfs = params['perfType'].split(',')
+            games = [game for game in games if game['perf'] in perfs]
+        if 'max' in params:
+            games = games[:int(params['max'])]
+
+        self.start_stream()
+        for game in games:
+            size = self.write_line(export_record(game, params))
+            with server.lock:
+                server.bytes += size
+            if server.games_per_second:
+                time.sleep(1 / server.games_per_second)
+            if server.bytes_per_second:
+                time.sleep(size / server.bytes_per_second)
+        self.wfile.write(b'0\r\n\r\n')
+
+
+def serve(games=None, port=0, delay=0, games_per_second=0, bytes_per_second=0, rate_limit_every=0, retry_after=1,
+          move_delay=0):
+    # Starts the server on a background thread and returns it, server.server_address says where it is.
+    # server.shutdown() stops it
+    server = ThreadingHTTPServer(('127.0.0.1', port), ExportHandler)
+    server.daemon_threads = True
+    games = fixture_games() if games is None else games
+    server.players = games_by_player(games)
+    server.games = {game['id']: game for game in games}
+    server.move_delay = move_delay
+    server.delay = delay
+    server.games_per_second = games_per_second
+    server.bytes_per_second = bytes_per_second
+    server.rate_limit_every = rate_limit_every
+    server.retry_after = retry_after
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.bytes = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve made up Lichess game exports')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--delay', type=float, default=0, help='seconds before each response')
+    parser.add_argument('--games-per-second', type=float, default=0, help='0 = as fast as possible')
+    parser.add_argument('--bytes-per-second', type=float, default=0, help='per export, 0 = no limit')
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='answer every Nth request with 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--move-delay', type=float, default=0, help='seconds between moves in game streams')
+    parser.add_argument('--others', type=int, default=0, help='games that ended some other way per mate')
+    args = parser.parse_args()
+
+    server = serve(fixture_games(others=args.others), port=args.port, delay=args.delay,
+                   games_per_second=args.games_per_second, bytes_per_second=args.bytes_per_second,
+                   rate_limit_every=args.rate_limit_every, retry_after=args.retry_after, move_delay=args.move_delay)
+    print('Serving exports for', ', '.join(sorted(server.players)), 'on http://%s:%d' % server.server_address)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+from collections import OrderedDict
+
+import chess, chess.polyglot
+from CheckmatePattern import CheckmatePattern, classify_position
+
+# The same mating positions come up again and again (Scholar's mate, Fool's mate, the usual back-rank
+# finishes), so ResultCache remembers what the classifier said about the last `size` positions it saw.
+# Positions are keyed by their Zobrist hash, which covers the pieces and the side to move, the only
+# things the patterns look at. hits and misses say how well a size works for a corpus.
+
+
+class ResultCache:
+
+    def __init__(self, size=65536, engine=CheckmatePattern):
+        self.size = size
+        self.engine = engine
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.results)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def classify(self, position):
+        # Same as classify_position(position, engine), but repeated positions are looked up instead.
+        # Every caller gets its own copy of the result
+        board = position if isinstance(position, chess.Board) else chess.Board(position)
+        key = chess.polyglot.zobrist_hash(board)
+
+        if key in self.results:
+            self.hits += 1
+            self.results.move_to_end(key)
+            result = self.results[key]
+        else:
+            self.misses += 1
+            # None for a position the classifier gives up on is remembered like any other result
+            result = self.results[key] = classify_position(board, self.engine)
+            if len(self.results) > self.size:
+                self.results.popitem(last=False)
+
+        return result.copy() if result is not None else None
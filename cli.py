@@ -0,0 +1,365 @@
+import argparse
+import csv
+import importlib.util
+import io
+import itertools
+import json
+import os
+import re
+import sys
+from collections import Counter
+from functools import partial
+
+from BitboardPattern import BitboardPattern
+from CheckmatePattern import CheckmatePattern, classify_position
+from corpus import final_position, frequency_table, worker_pool
+from lichess import MATE_EXPORT, STANDARD_PERFS, game_board, mate_gave, side_gave, standard_mate
+
+# Classifies checkmates without any prompts, from files or straight from Lichess, and writes one row per mate:
+#
+#     python3 cli.py mates.fen games.pgn export.ndjson --player alice --given -o labels.csv
+#     python3 cli.py --users alice bob --format jsonl --frequencies > labels.jsonl
+#
+# FEN files have one position per line (a FEN or a game's SAN moves, like corpus.final_position takes),
+# .pgn files hold any number of games (only those that end in mate are kept) and .ndjson/.jsonl files are
+# Lichess exports. --player says whose side of the PGN and export games --given/--received are about, and
+# leaves out the games they didn't play. Downloaded games are always about the user they were downloaded for.
+# Games go through the worker pool as they are read or downloaded, nothing keeps a list of them.
+#
+# Parquet output needs pyarrow and downloading games needs aiohttp (fetch.py). They, asyncio and chess.pgn are
+# only imported when they are used, so classifying a FEN file starts about as fast as importing the classifier.
+#
+# --index games.idx also writes an index of the mates by pattern, king square, mating piece and region, and by
+# speed, rated and rating for the games that have them, to search with index.py. --positions archive.pos adds
+# the mated positions and their labels to a position store, to classify again after a rule change with
+# positions.py.
+
+ENGINES = {'checkmate': CheckmatePattern, 'bitboard': BitboardPattern}
+COLUMNS = ['source', 'game_id', 'player', 'gave', 'fen', 'piece', 'region', 'double_check', 'patterns']
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+# Lichess speeds by the lower case names PGN events have them in
+SPEEDS = {speed.lower(): speed for speed in STANDARD_PERFS.split(',')}
+
+
+def fen_file(path):
+    # (game, info) for every line, game being a FEN or the moves of a game
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if line:
+                yield line, {'source': path, 'game_id': str(number), 'player': None, 'gave': None}
+
+
+def ends_in_mate(movetext):
+    # True if the last move of a game's PGN movetext gives mate, ignoring comments and the result
+    tokens = [token for token in re.sub(r'\{[^}]*\}', ' ', movetext).split() if token not in RESULTS]
+    return bool(tokens) and tokens[-1].endswith('#')
+
+
+def pgn_gave(headers, player):
+    return side_gave(headers.get('White'), headers.get('Black'),
+                     {'1-0': 'white', '0-1': 'black'}.get(headers.get('Result')), player)
+
+
+def pgn_tags(headers):
+    # Speed, rated and the rating of the side that gave mate from a Lichess PGN's headers, for the index.
+    # The Event is like 'Rated Blitz game'
+    event = headers.get('Event', '').split()
+    result = headers.get('Result')
+    elo = headers.get('WhiteElo' if result == '1-0' else 'BlackElo', '') if result in ('1-0', '0-1') else ''
+    known = len(event) >= 2 and event[0] in ('Rated', 'Casual')
+    return {'speed': SPEEDS.get(event[1].lower()) if known else None, 'rated': event[0] == 'Rated' if known else None,
+            'rating': int(elo) if elo.isdigit() else None}
+
+
+def pgn_file(path, player):
+    # (game, info) for every game in the file that ends in mate (and is one of player's, with a player), as the
+    # games are found. Only the headers are parsed here, the moves are replayed by whichever worker gets the game
+    import chess.pgn
+    with open(path) as f:
+        text = f.read()
+    handle = io.StringIO(text)
+    number = 0
+    start = 0
+    # read_headers skips the rest of the game, so it leaves the handle where the next game starts
+    game_headers = chess.pgn.read_headers(handle)
+    while game_headers is not None:
+        number += 1
+        end = handle.tell()
+        game = text[start:end]
+        start = end
+        headers, game_headers = game_headers, chess.pgn.read_headers(handle)
+        if not ends_in_mate(re.sub(r'^\[.*\]$', '', game, flags=re.MULTILINE)):
+            continue
+        gave = pgn_gave(headers, player)
+        if player is not None and gave is None:
+            # Not one of player's games
+            continue
+        game_id = headers.get('Site', '').rsplit('/', 1)[-1] or str(number)
+        yield game, dict({'source': path, 'game_id': game_id, 'player': player, 'gave': gave}, **pgn_tags(headers))
+
+
+def export_game(game, player, source):
+    # (game, info) for a game from a Lichess export if it is a standard game that ended in mate (and one of
+    # player's, with a player), else None
+    if not standard_mate(game):
+        return None
+    gave = None
+    if player is not None:
+        gave = mate_gave(game, player)
+        if gave is None:
+            return None
+    position = game_board(game).fen() if 'lastFen' in game else game['moves']
+    winner = game['players'].get(game.get('winner'), {})
+    return position, {'source': source, 'game_id': game['id'], 'player': player,
+                      'gave': gave,
+                      'speed': game.get('speed'), 'rated': game.get('rated'), 'rating': winner.get('rating')}
+
+
+def ndjson_file(path, player):
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                game = export_game(json.loads(line), player, path)
+                if game is not None:
+                    yield game
+
+
+async def download(users, token, concurrency, base_url, put):
+    # Hands put() every mate in the users' games as (game, info), as soon as it arrives
+    from fetch import GameFetcher
+    async with GameFetcher(token, concurrency=concurrency, base_url=base_url) as fetcher:
+        async for player, game in fetcher.export_many(users, **MATE_EXPORT):
+            game = export_game(game, player, 'lichess')
+            if game is not None:
+                put(game)
+    for player, error in fetcher.errors.items():
+        print('Could not download the games of', player + ':', error, file=sys.stderr)
+
+
+def downloaded(args, queue_size=1000):
+    # Starts downloading the games of --users straight away, on a thread with its own event loop, and returns
+    # a generator of the games as they arrive. The queue between the two is bounded, so when classifying falls
+    # behind the download waits instead of piling games up in memory
+    import asyncio
+    import queue
+    import threading
+    games = queue.Queue(maxsize=queue_size)
+    done = object()
+    failure = []
+
+    def run():
+        try:
+            asyncio.run(download(args.users, read_token(args.token), args.concurrency, args.base_url, games.put))
+        except BaseException as error:
+            failure.append(error)
+        finally:
+            games.put(done)
+
+    threading.Thread(target=run, name='download', daemon=True).start()
+
+    def arrived():
+        while True:
+            game = games.get()
+            if game is done:
+                break
+            yield game
+        if failure:
+            raise failure[0]
+
+    return arrived()
+
+
+def read_token(token):
+    # --token, then LICHESS_TOKEN, then token.json like main.py uses. The export works without one, only slower
+    if token:
+        return token
+    if os.environ.get('LICHESS_TOKEN'):
+        return os.environ['LICHESS_TOKEN']
+    if os.path.exists('token.json'):
+        with open('token.json') as f:
+            return json.load(f)['token']
+    return None
+
+
+def input_kind(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.pgn':
+        return 'pgn'
+    if extension in ('.ndjson', '.jsonl', '.json'):
+        return 'export'
+    return 'fen'
+
+
+def read_inputs(paths, player):
+    for path in paths:
+        kind = input_kind(path)
+        if kind == 'pgn':
+            yield from pgn_file(path, player)
+        elif kind == 'export':
+            yield from ndjson_file(path, player)
+        else:
+            yield from fen_file(path)
+
+
+def label(item, engine):
+    # Runs in a worker. item is (game, info), gives back the info, the final FEN of the game and what the
+    # classifier found there (None if it gave up)
+    game, info = item
+    position = final_position(game)
+    fen = position if isinstance(position, str) else position.fen()
+    return info, fen, classify_position(position, engine)
+
+
+def label_all(games, engine, workers, chunk_size=256):
+    # (info, fen, result) for each (game, info) in order, on a pool of worker processes unless workers is 1.
+    # games can be a generator, the games go to the workers as they are read
+    if workers == 1:
+        yield from (label(game, engine) for game in games)
+        return
+    with worker_pool(workers) as pool:
+        yield from pool.imap(partial(label, engine=engine), games, chunksize=chunk_size)
+
+
+def rows(games, engine, workers):
+    for info, fen, result in label_all(games, engine, workers):
+        row = dict(info, fen=fen, piece=None, region=None, double_check=None, patterns=None, result=result)
+        if result is not None:
+            row.update(piece=result.piece, region=result.region, double_check=result.double_check,
+                       patterns=result.names())
+        yield row
+
+
+def write_csv(rows, out):
+    writer = csv.DictWriter(out, COLUMNS, extrasaction='ignore')
+    writer.writeheader()
+    for row in rows:
+        if row['patterns'] is not None:
+            row = dict(row, patterns=';'.join(row['patterns']))
+        writer.writerow(row)
+
+
+def write_jsonl(rows, out):
+    for row in rows:
+        out.write(json.dumps({name: row[name] for name in COLUMNS}) + '\n')
+
+
+def write_parquet(rows, path):
+    import pyarrow, pyarrow.parquet
+    columns = {name: [] for name in COLUMNS}
+    for row in rows:
+        for name in COLUMNS:
+            columns[name].append(row[name])
+    pyarrow.parquet.write_table(pyarrow.table(columns), path)
+
+
+def counted(rows, counts):
+    # Passes the rows on, counting the patterns of every mate in counts ('' counts the mates)
+    for row in rows:
+        counts[''] += 1
+        if row['patterns']:
+            counts.update(set(row['patterns']))
+        yield row
+
+
+def indexed(rows, index):
+    # Passes the rows on, adding every mate to an index.IndexWriter
+    for row in rows:
+        index.add(row['game_id'], row['result'], row['fen'], row.get('speed'), row.get('rated'), row.get('rating'))
+        yield row
+
+
+def stored(rows, writer):
+    # Passes the rows on, adding every mated position to a positions.PositionWriter
+    for row in rows:
+        writer.add(row['game_id'], row['fen'], row['result'])
+        yield row
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Find the checkmate patterns in positions, games and Lichess exports')
+    parser.add_argument('inputs', nargs='*', help='FEN files, .pgn files or .ndjson Lichess exports')
+    parser.add_argument('--users', nargs='+', default=[], help='Lichess accounts to download the games of')
+    parser.add_argument('--player', help='whose side the games in the input files are looked at from')
+    side = parser.add_mutually_exclusive_group()
+    side.add_argument('--given', action='store_true', help='only the mates the player gave')
+    side.add_argument('--received', action='store_true', help='only the mates the player got')
+    parser.add_argument('-o', '--output', default='-', help='file to write to, - for stdout (the default)')
+    parser.add_argument('--format', choices=['csv', 'jsonl', 'parquet'],
+                        help='defaults to the extension of --output, csv otherwise')
+    parser.add_argument('--workers', type=int, default=None, help='processes to classify with, default one per CPU')
+    parser.add_argument('--engine', choices=sorted(ENGINES), default='bitboard')
+    parser.add_argument('--frequencies', action='store_true', help='print how often each pattern was found to stderr')
+    parser.add_argument('--index', help='also write an index of the mates to this file, see index.py')
+    parser.add_argument('--positions', help='also add the mated positions to this position store, see positions.py')
+    parser.add_argument('--token', help='Lichess API token, else LICHESS_TOKEN or token.json')
+    parser.add_argument('--concurrency', type=int, default=4, help='exports to download at once for --users')
+    parser.add_argument('--base-url', default='https://lichess.org',
+                        help='where to download from, e.g. benchmarks/lichess_server.py')
+    args = parser.parse_args(argv)
+
+    if not args.inputs and not args.users:
+        parser.error('nothing to classify, give some files or --users')
+    if args.given or args.received:
+        # Without a side every game would be left out
+        if args.inputs and args.player is None:
+            parser.error('--given and --received need --player to know whose side the input files are about')
+        positions = [path for path in args.inputs if input_kind(path) == 'fen']
+        if positions:
+            parser.error('--given and --received can\'t be used with FEN files, they have no sides: ' +
+                         ', '.join(positions))
+    if args.format is None:
+        extension = os.path.splitext(args.output)[1].lstrip('.').lower()
+        args.format = extension if extension in ('csv', 'jsonl', 'parquet') else 'csv'
+    if args.format == 'parquet':
+        if importlib.util.find_spec('pyarrow') is None:
+            parser.error('parquet output needs pyarrow (pip install pyarrow)')
+        if args.output == '-':
+            parser.error('parquet output needs a file, use -o')
+    if args.users and importlib.util.find_spec('aiohttp') is None:
+        parser.error('downloading games needs aiohttp (pip install aiohttp)')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    games = read_inputs(args.inputs, args.player)
+    if args.users:
+        # The download starts here, alongside reading the files
+        games = itertools.chain(games, downloaded(args))
+    if args.given or args.received:
+        games = (game for game in games if game[1]['gave'] == args.given)
+
+    counts = Counter()
+    results = counted(rows(games, ENGINES[args.engine], args.workers), counts)
+    if args.index:
+        from index import IndexWriter
+        index = IndexWriter()
+        results = indexed(results, index)
+    if args.positions:
+        from positions import PositionWriter
+        writer = PositionWriter(args.positions)
+        results = stored(results, writer)
+    if args.format == 'parquet':
+        write_parquet(results, args.output)
+    else:
+        write = write_csv if args.format == 'csv' else write_jsonl
+        if args.output == '-':
+            write(results, sys.stdout)
+        else:
+            with open(args.output, 'w', newline='') as out:
+                write(results, out)
+
+    if args.index:
+        index.write(args.index)
+    if args.positions:
+        writer.close()
+
+    if args.frequencies:
+        mates = counts.pop('', 0)
+        for line in frequency_table(counts, mates):
+            print(line, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
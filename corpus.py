@@ -0,0 +1,116 @@
+import gc
+import io
+import multiprocessing
+from collections import Counter
+from functools import partial
+
+import chess
+from CheckmatePattern import CheckmatePattern, PATTERN_IDS, classify_position
+from cache import ResultCache
+
+
+def final_fen(moves):
+    # Replays a game's moves (or a whole PGN) and returns the FEN of the last position.
+    # chess.pgn takes longer to import than the rest of python-chess, so it is only imported for real PGNs
+    import chess.pgn
+    return chess.pgn.read_game(io.StringIO(moves)).end().board().fen()
+
+
+def final_board(moves):
+    # Fast path for a plain space separated list of SAN moves, like the 'moves' field in Lichess exports.
+    # The moves go straight onto one board, without building a PGN game tree or going through a FEN
+    board = chess.Board()
+    for san in moves.split():
+        board.push_san(san)
+    return board
+
+
+def final_position(game):
+    # A game can be a FEN, a list of SAN moves or a whole PGN (with headers or move numbers)
+    if '[' in game or '.' in game:
+        return final_fen(game)
+    if '/' in game:
+        return game
+    return final_board(game)
+
+
+def classify_game(game, engine=CheckmatePattern, cache=None):
+    # A game is a FEN, the moves of the game or a PGN. Returns None if the classifier gives up on the position.
+    # With a cache (cache.ResultCache) the cache's engine is used and repeated positions are looked up
+    position = final_position(game)
+    if cache is not None:
+        return cache.classify(position)
+    return classify_position(position, engine)
+
+
+# Each worker process keeps its own cache between chunks
+_worker_cache = None
+
+
+def worker_pool(workers):
+    # A multiprocessing pool whose workers are forked from this process where that is possible, so they start
+    # with the classifier, the geometry tables and the rule tables already imported instead of importing
+    # everything again (which spawn and forkserver do). gc.freeze() keeps the collector in the workers from
+    # writing to those objects, so the pages they are on stay shared with this process. The workers are forked
+    # when the pool is made, so this process can unfreeze straight after
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.Pool(workers)
+    gc.freeze()
+    try:
+        return multiprocessing.get_context('fork').Pool(workers)
+    finally:
+        gc.unfreeze()
+
+
+def classify_chunk(chunk, engine, cache_size):
+    # Runs in a worker. Returns the labels for a chunk of games and the cache hits and misses it took
+    global _worker_cache
+    if not cache_size:
+        return [classify_game(game, engine) for game in chunk], 0, 0
+
+    if _worker_cache is None:
+        _worker_cache = ResultCache(cache_size, engine)
+    hits, misses = _worker_cache.hits, _worker_cache.misses
+    labels = [classify_game(game, cache=_worker_cache) for game in chunk]
+    return labels, _worker_cache.hits - hits, _worker_cache.misses - misses
+
+
+def classify_corpus(games, workers=None, chunk_size=256, engine=CheckmatePattern, cache=None):
+    # Classifies a list of games (FENs or moves, see classify_game) on a pool of worker processes.
+    # Returns (counts, labels): counts is how many games each pattern was found in and labels has one
+    # CheckmateResult (or None) per game, in the same order as games. Both come out the same for any
+    # number of workers since imap hands the chunks back in order.
+    # workers defaults to the number of CPUs, chunk_size is how many games a worker gets at a time.
+    # cache is an optional cache.ResultCache. With workers=1 it is used as it is, otherwise every worker gets
+    # a cache of the same size and their hits and misses are added to it
+    if workers == 1:
+        labels = [classify_game(game, engine, cache) for game in games]
+    else:
+        if cache is not None:
+            engine = cache.engine
+        chunks = [games[i:i + chunk_size] for i in range(0, len(games), chunk_size)]
+        classify = partial(classify_chunk, engine=engine, cache_size=cache.size if cache is not None else 0)
+        labels = []
+        with worker_pool(workers) as pool:
+            for chunk_labels, hits, misses in pool.imap(classify, chunks):
+                labels.extend(chunk_labels)
+                if cache is not None:
+                    cache.hits += hits
+                    cache.misses += misses
+
+    counts = Counter()
+    for result in labels:
+        if result is not None:
+            counts.update(set(result.names()))
+
+    return counts, labels
+
+
+def frequency_table(counts, total):
+    # Lines of a table of how many of `total` checkmates each pattern was found in, most common first.
+    # counts is a Counter of pattern names like the one classify_corpus returns
+    lines = ['%-24s %7s %7s' % ('Pattern', 'Mates', '%')]
+    for name, count in sorted(counts.items(), key=lambda item: (-item[1], PATTERN_IDS[item[0]])):
+        lines.append('%-24s %7d %6.1f%%' % (name, count, 100 * count / total if total else 0))
+    lines.append('%-24s %7d' % ('Checkmates', total))
+    return lines
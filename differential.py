@@ -0,0 +1,301 @@
+import argparse
+import importlib
+import importlib.util
+import json
+import os
+import random
+import sys
+import time
+
+import chess
+from BitboardPattern import BitboardPattern
+from CheckmatePattern import CheckmatePattern, PATTERN_NAMES
+from corpus import final_position
+
+# Runs a candidate classifier next to CheckmatePattern on the same positions and reports every position where
+# the labels differ, so a faster engine (or a faster CheckmatePattern) can only land if it labels everything
+# the way the old one did, quirks included: patterns found more than once (corner_and_morphys, hook), patterns
+# that never run because a rule before them in the branch raises the TypeError classify() swallows, and the
+# IndexError of Anderssen's mate on a corner.
+#
+# The positions are the final positions of the games in the corpus files (a FEN, SAN moves or a PGN per line,
+# like games.txt) plus random legal mated positions: the mates found by playing random games, and the mates
+# among random placements of the kings and a few pieces, which have the kings on edges and corners and the
+# odd pieces real games rarely get to. Every position the labels differ on is made smaller, by taking pieces
+# off for as long as it stays legal, mate and the engines still disagree, so the report shows the few pieces
+# that matter. The report also has positions/sec for every engine over the same positions.
+#
+#     python3 differential.py                                     bitboard and batch against CheckmatePattern
+#     python3 differential.py --engine bitboard --random 5000 --seed 7 benchmarks/data/mates.fen
+#     python3 differential.py --reference old_checkmate:CheckmatePattern --engine checkmate
+#
+# An engine is one of ENGINES or module:Class for any class that works like CheckmatePattern, so a changed
+# CheckmatePattern can be checked against a copy of the old one (old_checkmate.py above). The exit code is 1
+# if any engine disagreed with the reference.
+
+CORPUS = [os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'data', name)
+          for name in ('mates.fen', 'games.txt')]
+
+# Pieces random placements are made from, kings aside
+PIECES = [chess.Piece(piece_type, color) for piece_type in (chess.PAWN, chess.KNIGHT, chess.BISHOP, chess.ROOK,
+                                                             chess.QUEEN) for color in chess.COLORS]
+
+
+def labels(result):
+    # What has to be the same between two engines: (piece, region, pattern IDs in order, double check)
+    return result.piece, result.region, tuple(result.patterns), result.double_check
+
+
+def without_duplicates(outcome):
+    # classify_batch only keeps whether a pattern was found, not how many times or in which order
+    if isinstance(outcome, str):
+        return outcome
+    piece, region, patterns, double_check = outcome
+    return piece, region, tuple(sorted(set(patterns))), double_check
+
+
+def scalar_engine(engine):
+    def run(boards):
+        outcomes = []
+        for board in boards:
+            try:
+                outcomes.append(labels(engine(board).classify()))
+            except Exception as error:
+                # The exception is part of the behaviour, an engine has to raise the same one
+                outcomes.append(type(error).__name__)
+        return outcomes
+    run.exact = True
+    return run
+
+
+def batch_engine(boards):
+    # classify_batch, row by row the same as labels() would give for it. Needs numpy, so it's only imported here
+    from vectorized import REGIONS, classify_batch
+    result = classify_batch(boards)
+    outcomes = []
+    for i in range(len(boards)):
+        if result.error[i]:
+            outcomes.append('IndexError')
+            continue
+        piece = int(result.piece[i])
+        region = int(result.region[i])
+        outcomes.append((chess.piece_symbol(piece).upper() if piece else None,
+                         REGIONS[region] if region >= 0 else None,
+                         tuple(int(pattern) for pattern in result.patterns[i].nonzero()[0]),
+                         bool(result.double_check[i])))
+    return outcomes
+
+
+batch_engine.exact = False
+
+ENGINES = {
+    'checkmate': scalar_engine(CheckmatePattern),
+    'bitboard': scalar_engine(BitboardPattern),
+    'batch': batch_engine,
+}
+
+
+def load_engine(name):
+    if name in ENGINES:
+        return ENGINES[name]
+    module, _, cls = name.partition(':')
+    if not cls:
+        raise ValueError('an engine is one of %s or module:Class, not %r' % (', '.join(ENGINES), name))
+    return scalar_engine(getattr(importlib.import_module(module), cls))
+
+
+def corpus_boards(paths):
+    boards = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    position = final_position(line.strip())
+                    boards.append(position if isinstance(position, chess.Board) else chess.Board(position))
+    return boards
+
+
+def mating_move(board, rng):
+    # A move that mates straight away, None if there isn't one
+    moves = list(board.legal_moves)
+    rng.shuffle(moves)
+    for move in moves:
+        if board.gives_check(move):
+            board.push(move)
+            mate = board.is_checkmate()
+            board.pop()
+            if mate:
+                return move
+    return None
+
+
+def random_game_mates(count, rng, max_plies=300):
+    # Plays random games and keeps the position after every mate one of the moves would give. The game goes on
+    # with some other move, a game that has got to a mate usually has more of them coming
+    mates = []
+    while len(mates) < count:
+        board = chess.Board()
+        while len(mates) < count and not board.is_game_over() and board.ply() < max_plies:
+            move = mating_move(board, rng)
+            if move is not None:
+                board.push(move)
+                mates.append(board.copy(stack=False))
+                board.pop()
+            board.push(rng.choice([other for other in board.legal_moves if other != move] or [move]))
+    return mates
+
+
+def random_placement_mates(count, rng, max_pieces=6):
+    # Puts both kings and up to max_pieces other pieces on random squares, and keeps the legal positions where
+    # the side to move is mated
+    mates = []
+    while len(mates) < count:
+        board = chess.Board(None)
+        squares = rng.sample(chess.SQUARES, 2 + rng.randint(1, max_pieces))
+        board.set_piece_at(squares[0], chess.Piece(chess.KING, chess.WHITE))
+        board.set_piece_at(squares[1], chess.Piece(chess.KING, chess.BLACK))
+        for square in squares[2:]:
+            piece = rng.choice(PIECES)
+            if piece.piece_type != chess.PAWN or not chess.BB_SQUARES[square] & chess.BB_BACKRANKS:
+                board.set_piece_at(square, piece)
+        board.turn = rng.choice(chess.COLORS)
+        if board.is_check() and board.is_valid() and board.is_checkmate():
+            mates.append(board)
+    return mates
+
+
+def random_mates(count, seed):
+    # Half from random games, half from random placements
+    rng = random.Random(seed)
+    return random_game_mates(count // 2, rng) + random_placement_mates(count - count // 2, rng)
+
+
+def disagree(reference, engine, board):
+    expected, got = reference([board])[0], engine([board])[0]
+    if not engine.exact:
+        expected = without_duplicates(expected)
+    return expected != got
+
+
+def minimise(board, reference, engine):
+    # Takes pieces other than the kings off one at a time, for as long as the position stays legal and mate and
+    # the engines still disagree on it. Castling rights, the en passant square and the move counters go first
+    board = board.copy(stack=False)
+    simpler = board.copy(stack=False)
+    simpler.castling_rights = chess.BB_EMPTY
+    simpler.ep_square = None
+    simpler.halfmove_clock, simpler.fullmove_number = 0, 1
+    if disagree(reference, engine, simpler):
+        board = simpler
+
+    smaller_found = True
+    while smaller_found:
+        smaller_found = False
+        for square in chess.scan_reversed(board.occupied & ~board.kings):
+            smaller = board.copy(stack=False)
+            smaller.remove_piece_at(square)
+            if smaller.is_valid() and smaller.is_checkmate() and disagree(reference, engine, smaller):
+                board = smaller
+                smaller_found = True
+    return board
+
+
+def describe(outcome):
+    if isinstance(outcome, str):
+        return 'raised ' + outcome
+    piece, region, patterns, double_check = outcome
+    found = ', '.join(PATTERN_NAMES[i] for i in patterns) or 'no patterns'
+    return '%s, %s: %s' % ('double check' if double_check else piece, region, found)
+
+
+def timed(engine, boards):
+    start = time.perf_counter()
+    outcomes = engine(boards)
+    return outcomes, time.perf_counter() - start
+
+
+def compare(boards, sources, reference_name, engine_names, minimise_limit=20):
+    # Runs the reference and every engine over boards, sources says where each board came from. Returns the
+    # report as a dict
+    reference = load_engine(reference_name)
+    expected, seconds = timed(reference, boards)
+    report = {
+        'positions': len(boards),
+        'reference': reference_name,
+        'engines': {reference_name: {'seconds': seconds, 'positions_per_sec': len(boards) / seconds}},
+    }
+    for name in engine_names:
+        engine = load_engine(name)
+        outcomes, seconds = timed(engine, boards)
+        mismatches = []
+        for board, source, want, got in zip(boards, sources, expected, outcomes):
+            if not engine.exact:
+                want = without_duplicates(want)
+            if want == got:
+                continue
+            mismatch = {'source': source, 'fen': board.fen(), 'reference': describe(want), 'engine': describe(got)}
+            if len(mismatches) < minimise_limit:
+                smallest = minimise(board, reference, engine)
+                mismatch['minimised'] = smallest.fen()
+                mismatch['minimised_reference'] = describe(reference([smallest])[0])
+                mismatch['minimised_engine'] = describe(engine([smallest])[0])
+            mismatches.append(mismatch)
+        report['engines'][name] = {'seconds': seconds, 'positions_per_sec': len(boards) / seconds,
+                                   'exact': engine.exact, 'mismatches': len(mismatches),
+                                   'examples': mismatches}
+    return report
+
+
+def print_report(report, examples):
+    print('%d positions, reference %s' % (report['positions'], report['reference']))
+    for name, engine in report['engines'].items():
+        line = '%-12s %9.0f positions/sec' % (name, engine['positions_per_sec'])
+        if name == report['reference']:
+            print(line + ', reference')
+            continue
+        print(line + ', %d mismatches%s' % (engine['mismatches'],
+                                            '' if engine['exact'] else ' (without duplicate patterns)'))
+        for mismatch in engine['examples'][:examples]:
+            print('    %s  (%s)' % (mismatch['fen'], mismatch['source']))
+            print('        reference: ' + mismatch['reference'])
+            print('        engine:    ' + mismatch['engine'])
+            if 'minimised' in mismatch:
+                print('        minimised: %s' % mismatch['minimised'])
+                print('        reference: ' + mismatch['minimised_reference'])
+                print('        engine:    ' + mismatch['minimised_engine'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check classifiers against CheckmatePattern, position by position')
+    parser.add_argument('corpus', nargs='*', default=CORPUS,
+                        help='files with a FEN, SAN moves or a PGN per line, default the benchmark data')
+    parser.add_argument('--engine', action='append',
+                        help='engine to check, one of %s or module:Class (can be repeated, defaults to bitboard '
+                             'and batch if numpy is installed)' % ', '.join(ENGINES))
+    parser.add_argument('--reference', default='checkmate')
+    parser.add_argument('--random', type=int, default=1000, help='random mated positions to add')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--examples', type=int, default=5, help='mismatches to print for each engine')
+    parser.add_argument('--json', action='store_true', help='print the whole report as JSON')
+    args = parser.parse_args(argv)
+
+    engines = args.engine or ['bitboard'] + (['batch'] if importlib.util.find_spec('numpy') else [])
+    boards = corpus_boards(args.corpus)
+    sources = ['corpus'] * len(boards)
+    start = time.perf_counter()
+    mates = random_mates(args.random, args.seed)
+    print('%d random mates made in %.1f s' % (len(mates), time.perf_counter() - start), file=sys.stderr)
+    boards += mates
+    sources += ['random game'] * (args.random // 2) + ['random placement'] * (args.random - args.random // 2)
+
+    report = compare(boards, sources, args.reference, engines)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report, args.examples)
+    if any(engine.get('mismatches') for engine in report['engines'].values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+import asyncio
+import email.utils
+import json
+from datetime import datetime, timezone
+
+import aiohttp
+
+from CheckmatePattern import CheckmatePattern
+from lichess import MATE_EXPORT, classify_mate, mate_gave
+
+# Downloading the games of lots of players at once (a team, everyone in a tournament) with asyncio and
+# aiohttp (pip install aiohttp, only this module needs it). berserk isn't used here, the exports are read
+# straight from the Lichess API as NDJSON, one game per line, and handed on as soon as each line arrives.
+#
+#     async with GameFetcher(token, concurrency=4) as fetcher:
+#         async for player, game, gave, pattern in fetcher.classify(players):
+#             ...
+#
+# - At most `concurrency` exports run at the same time, over one pool of connections.
+# - When Lichess answers 429 (too many requests) every export waits before its next request, for as long as
+#   the Retry-After header says or a minute otherwise, like the API docs ask. Other failures are retried
+#   with exponential backoff. An export that broke off halfway carries on from the last game it got.
+# - classify() asks for the final position instead of the moves and for standard games only (MATE_EXPORT
+#   in lichess.py), which is a small part of the bytes of a full export.
+# - base_url can point at a stand-in server (benchmarks/lichess_server.py) to run everything offline.
+
+LICHESS = 'https://lichess.org'
+
+
+def query(params):
+    # aiohttp wants strings, Lichess wants true/false and comma separated lists
+    values = {}
+    for key, value in params.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            value = 'true' if value else 'false'
+        elif isinstance(value, (list, tuple)):
+            value = ','.join(value)
+        values[key] = str(value)
+    return values
+
+
+def retry_after(value, default):
+    # Seconds to wait from a Retry-After header, which can be a number of seconds or an HTTP date (RFC 9110).
+    # default when there is no header or it can't be read
+    if value is None:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class GameFetcher:
+
+    def __init__(self, token=None, concurrency=4, base_url=LICHESS, retries=5, backoff=1.0, rate_limit_wait=60):
+        self.token = token
+        self.concurrency = concurrency
+        self.base_url = base_url.rstrip('/')
+        self.retries = retries
+        self.backoff = backoff
+        self.rate_limit_wait = rate_limit_wait
+        self.session = None
+        self.semaphore = None
+        # Loop time before which nobody sends a request, set when Lichess says we are going too fast
+        self.paused_until = 0
+
+        self.requests = 0
+        self.rate_limited = 0
+        self.games = 0
+        self.bytes = 0
+        # player -> createdAt of the newest game of theirs that arrived
+        self.newest = {}
+        # player -> the exception their export finally failed with
+        self.errors = {}
+
+    async def __aenter__(self):
+        headers = {'Accept': 'application/x-ndjson'}
+        if self.token:
+            headers['Authorization'] = 'Bearer ' + self.token
+        self.session = aiohttp.ClientSession(headers=headers,
+                                             connector=aiohttp.TCPConnector(limit=self.concurrency))
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def wait_for_rate_limit(self):
+        loop = asyncio.get_running_loop()
+        while loop.time() < self.paused_until:
+            await asyncio.sleep(self.paused_until - loop.time())
+
+    def pause(self, seconds):
+        loop = asyncio.get_running_loop()
+        self.paused_until = max(self.paused_until, loop.time() + seconds)
+
+    async def export(self, player, **params):
+        # Yields player's games (dicts like the API sends them, newest first). params go on the query string,
+        # e.g. since/until in milliseconds, max, rated, perfType
+        url = '%s/api/games/user/%s' % (self.base_url, player)
+        failures = 0
+        while True:
+            await self.wait_for_rate_limit()
+            self.requests += 1
+            try:
+                async with self.session.get(url, params=query(params)) as response:
+                    if response.status == 429:
+                        self.rate_limited += 1
+                        failures += 1
+                        if failures > self.retries:
+                            response.raise_for_status()
+                        self.pause(retry_after(response.headers.get('Retry-After'), self.rate_limit_wait))
+                        continue
+                    response.raise_for_status()
+                    async for line in response.content:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        self.bytes += len(line) + 1
+                        game = json.loads(line)
+                        # If the connection breaks, carry on with the games older than this one
+                        params['until'] = game['createdAt'] - 1
+                        self.newest[player] = max(self.newest.get(player, 0), game['createdAt'])
+                        self.games += 1
+                        yield game
+                    return
+            except (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as error:
+                failure = error
+            except aiohttp.ClientResponseError as error:
+                # 4xx other than 429 won't get better by asking again
+                if error.status < 500:
+                    raise
+                failure = error
+            failures += 1
+            if failures > self.retries:
+                raise failure
+            await asyncio.sleep(self.backoff * 2 ** (failures - 1))
+
+    async def export_many(self, players, since=None, **params):
+        # Yields (player, game) for every player's games as they arrive, at most `concurrency` exports at a
+        # time. A player whose export keeps failing ends up in self.errors and the others carry on.
+        # since can be a dict of player -> since, to carry on from where each player was left last time
+        queue = asyncio.Queue(maxsize=1000)
+        done = object()
+
+        async def export_player(player):
+            async with self.semaphore:
+                try:
+                    player_since = since.get(player) if isinstance(since, dict) else since
+                    async for game in self.export(player, since=player_since, **params):
+                        await queue.put((player, game))
+                except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                    self.errors[player] = error
+
+        async def export_all():
+            try:
+                await asyncio.gather(*(export_player(player) for player in players))
+            finally:
+                await queue.put(done)
+
+        task = asyncio.create_task(export_all())
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                yield item
+            await task
+        finally:
+            task.cancel()
+
+    async def classify(self, players, engine=CheckmatePattern, **params):
+        # Yields (player, game, gave, pattern) for every mate in the players' games as soon as it is
+        # downloaded, like lichess.classify_games. Only what the classifier needs is asked for (MATE_EXPORT),
+        # params can add filters like rated=True, since and until or change those defaults
+        params = dict(MATE_EXPORT, **params)
+        async for player, game in self.export_many(players, **params):
+            gave = mate_gave(game, player)
+            if gave is not None:
+                yield player, game, gave, classify_mate(game, engine)
@@ -0,0 +1,143 @@
+import chess
+from collections import namedtuple
+
+# Board geometry the patterns keep asking about, worked out once for all 64 squares when this module is imported.
+#
+# KING_SQUARES[square] describes a losing king standing on that square:
+# region - 'corner', 'side' or 'center'
+# orientation - the edge or corner the king is on ('left', 'right', 'bottom', 'top', 'bottom left', 'bottom right',
+#               'top left', 'top right'), None in the center
+# squares - the squares around the king in the order the patterns index them (available_squares)
+# mask - the same squares as a bitboard
+KingSquare = namedtuple('KingSquare', ['region', 'orientation', 'squares', 'mask'])
+
+
+def _surrounding(king):
+
+    #012
+    #3 4
+    #567
+
+    return (king + 7, king + 8, king + 9,
+            king - 1,           king + 1,
+            king - 9, king - 8, king - 7)
+
+
+def _side(king):
+
+    #01     34      123     4 0
+    # 2     2       0 4     321
+    #43     10
+
+    # If the king is on the left side
+    if chess.square_file(king) == 0:
+        return 'left', (king + 8, king + 9, king + 1, king - 7, king - 8)
+    # If king is on right
+    elif chess.square_file(king) == 7:
+        return 'right', (king - 8, king - 9, king - 1, king + 7, king + 8)
+    # Bottom
+    elif chess.square_rank(king) == 0:
+        return 'bottom', (king - 1, king + 7, king + 8, king + 9, king + 1)
+    # Top
+    elif chess.square_rank(king) == 7:
+        return 'top', (king + 1, king - 7, king - 8, king - 9, king - 1)
+    return None, None
+
+
+def _corner(king):
+
+    #21     12      0       0
+    # 0     0      21       12
+
+    corners = {
+        chess.A1: ('bottom left', (1, 9, 8)),
+        chess.H1: ('bottom right', (6, 14, 15)),
+        chess.A8: ('top left', (57, 49, 48)),
+        chess.H8: ('top right', (62, 54, 55)),
+    }
+    return corners.get(king, (None, None))
+
+
+def _mask(squares):
+    mask = 0
+    for square in squares:
+        if 0 <= square < 64:
+            mask |= chess.BB_SQUARES[square]
+    return mask
+
+
+# Raw king + offset squares for every square, like CheckmatePattern.surrounding_squares. Off the board
+# these go below 0 or above 63 and on the a and h files they wrap around to the next rank
+SURROUNDING_SQUARES = [_surrounding(square) for square in chess.SQUARES]
+# The squares king_on_side and king_on_corner return, None where they return None
+SIDE_SQUARES = [_side(square)[1] for square in chess.SQUARES]
+CORNER_SQUARES = [_corner(square)[1] for square in chess.SQUARES]
+
+KING_SQUARES = []
+for _square in chess.SQUARES:
+    _file = chess.square_file(_square)
+    _rank = chess.square_rank(_square)
+    if _file in (0, 7) and _rank in (0, 7):
+        _orientation, _squares = _corner(_square)
+        KING_SQUARES.append(KingSquare('corner', _orientation, _squares, _mask(_squares)))
+    elif _file in (0, 7) or _rank in (0, 7):
+        _orientation, _squares = _side(_square)
+        KING_SQUARES.append(KingSquare('side', _orientation, _squares, _mask(_squares)))
+    else:
+        _squares = SURROUNDING_SQUARES[_square]
+        KING_SQUARES.append(KingSquare('center', None, _squares, _mask(_squares)))
+
+# SURROUNDING_SQUARES as bitboards, keeping the wrapped squares and dropping the ones off the board
+BB_RAW_SURROUNDING = [_mask(squares) for squares in SURROUNDING_SQUARES]
+
+# Squares exactly two king steps away from each square
+BB_DISTANCE_2 = [_mask([other for other in chess.SQUARES if chess.square_distance(square, other) == 2])
+                 for square in chess.SQUARES]
+
+# Canonical frames for a king in the center. The neighbour squares are turned (in 90 degree steps) so that a
+# checker next to the king always ends up in the same slot: straight below the king (slot 6) when it checks
+# along a rank or file and below and to the right (slot 7) when it checks diagonally. Patterns with one
+# rule per direction (swallow's tail, dovetail, hook) then only need the rule for that one orientation.
+# CENTER_FRAMES[king][checker] is (slot the checker is in on the plain neighbour list, turned neighbours),
+# only for checkers next to a king in the center
+
+#012
+#3 4
+#567
+
+_SLOT_DIRECTIONS = [(-1, 1), (0, 1), (1, 1), (-1, 0), (1, 0), (-1, -1), (0, -1), (1, -1)]
+
+
+def _turns(slot):
+    # The slot a direction ends up in after turning it 90 degrees clockwise
+    file_step, rank_step = _SLOT_DIRECTIONS[slot]
+    return _SLOT_DIRECTIONS.index((rank_step, -file_step))
+
+
+def _center_frames(king):
+    squares = SURROUNDING_SQUARES[king]
+    frames = {}
+    for slot in range(8):
+        canonical_slot = 7 if _SLOT_DIRECTIONS[slot][0] and _SLOT_DIRECTIONS[slot][1] else 6
+        order = list(range(8))
+        while order[canonical_slot] != slot:
+            order = [_turns(i) for i in order]
+        frames[squares[slot]] = (slot, tuple(squares[i] for i in order))
+    return frames
+
+
+CENTER_FRAMES = [_center_frames(square) if KING_SQUARES[square].region == 'center' else None
+                 for square in chess.SQUARES]
+
+# Where a rook or queen has to stand for a ladder mate given from each square: on the line next to
+# whichever edge the checker is on (CheckmatePattern.ladder checks all four edges the same way)
+BB_LADDER_SUPPORT = []
+for _square in chess.SQUARES:
+    _support = 0
+    for _file_edge, _file_support in ((0, chess.BB_FILE_B), (7, chess.BB_FILE_G)):
+        if chess.square_file(_square) == _file_edge:
+            _support |= _file_support
+    for _rank_edge, _rank_support in ((0, chess.BB_RANK_2), (7, chess.BB_RANK_7)):
+        if chess.square_rank(_square) == _rank_edge:
+            _support |= _rank_support
+    BB_LADDER_SUPPORT.append(_support)
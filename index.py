@@ -0,0 +1,368 @@
+import argparse
+import json
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+import chess
+from CheckmatePattern import PATTERN_IDS
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# An inverted index from what a mate looks like to the games it happened in, for questions like "every
+# smothered mate with the king on h8" or "Anastasia's mates given by rated blitz players above 2000" over an
+# archive of millions of classified games. Each game gets a number (its document) and terms like
+#
+#     pattern:12        pattern ID 12 was found (PATTERN_NAMES[12])
+#     king:h8           the mated king was on h8
+#     piece:Q           the mating piece, piece:double for a double check
+#     region:corner     where the mated king was
+#     unclassified      the classifier gave up on the position
+#     speed:blitz, rated / casual, rating:2000 (the rating of the side that gave mate, in steps of 100)
+#
+# and every term has the sorted list of the documents that have it (its postings). IndexWriter collects them
+# while games are classified (cli.py --index does) and writes them to one file:
+#
+#     header      MAGIC, then documents, bytes of terms JSON, bytes of game IDs as three little endian uint64
+#     terms       JSON of term -> [where its postings start in the postings, how many]
+#     id_ends     uint64 per document, where its game ID ends in the game IDs
+#     game IDs    the IDs one after the other
+#     postings    uint32 document numbers, each term's sorted, from the next multiple of 8 bytes
+#
+# GameIndex memory maps the file and hands out postings as views of it without reading or copying them, so
+# opening an index with tens of millions of games is instant and a query only touches the pages of the terms
+# it asks for:
+#
+#     index = GameIndex('games.idx')
+#     docs = index.search(pattern_term("Anastasia's mate"), 'speed:blitz', 'rated', rating_terms(2000))
+#     index.game_ids(docs)
+#
+# Every argument of search() is a term or a list of terms, which matches games that have any of them. The
+# games of the argument with the fewest are looked up in the postings of the others by binary search, with
+# numpy when it is installed. Big archives can
+# be indexed a part at a time and put together with merge_indexes().
+#
+# python3 index.py games.idx --pattern "Smothered mate" --king h8 [--speed blitz --rated --min-rating 2000]
+
+MAGIC = b'MATEIDX1'
+HEADER = struct.Struct('<8sQQQ')
+# uint32 is enough for 4 billion games
+POSTING = 'I'
+RATING_STEP = 100
+
+
+def pattern_term(pattern):
+    # A pattern's name or ID
+    return 'pattern:%d' % (PATTERN_IDS[pattern] if isinstance(pattern, str) else pattern)
+
+
+def rating_terms(low, high=4000):
+    # The terms for ratings from low up to (not including) high, to pass to search() as one argument
+    return ['rating:%d' % rating for rating in range(low - low % RATING_STEP, high, RATING_STEP)]
+
+
+def mated_king(fen):
+    # Square of the mated king, the side to move's, without setting up a chess.Board
+    placement, turn = fen.split()[:2]
+    king = 'K' if turn == 'w' else 'k'
+    rank, file = 7, 0
+    for char in placement:
+        if char == '/':
+            rank -= 1
+            file = 0
+        elif char.isdigit():
+            file += int(char)
+        elif char == king:
+            return chess.square(file, rank)
+        else:
+            file += 1
+    return None
+
+
+def game_terms(result, king=None, speed=None, rated=None, rating=None):
+    # The terms of one game. king is the mated king's square, the rest say who played it and how
+    if result is None:
+        terms = ['unclassified']
+    else:
+        terms = [pattern_term(i) for i in sorted(set(result.patterns))]
+        terms.append('piece:' + (result.piece or 'double'))
+        if result.region:
+            terms.append('region:' + result.region)
+    if king is not None:
+        terms.append('king:' + chess.SQUARE_NAMES[king])
+    if speed:
+        terms.append('speed:' + speed)
+    if rated is not None:
+        terms.append('rated' if rated else 'casual')
+    if rating:
+        terms.append('rating:%d' % (int(rating) - int(rating) % RATING_STEP))
+    return terms
+
+
+def little_endian(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class IndexWriter:
+
+    def __init__(self):
+        self.postings = {}
+        self.ids = bytearray()
+        self.id_ends = array('Q')
+
+    def __len__(self):
+        return len(self.id_ends)
+
+    def add_terms(self, game_id, terms):
+        # Adds a game with the terms given, returns its document number
+        doc = len(self.id_ends)
+        self.ids += game_id.encode()
+        self.id_ends.append(len(self.ids))
+        for term in terms:
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = array(POSTING)
+            postings.append(doc)
+        return doc
+
+    def add(self, game_id, result, fen=None, speed=None, rated=None, rating=None):
+        # A classified game: its CheckmateResult (None if the classifier gave up), the mate's FEN, and for
+        # games with them the Lichess speed, whether it was rated and the rating of the side that gave mate
+        king = mated_king(fen) if fen else None
+        return self.add_terms(game_id, game_terms(result, king, speed, rated, rating))
+
+    def write(self, path):
+        # Documents are added in order, so every term's postings are sorted already. Offsets are in bytes
+        terms = {}
+        offset = 0
+        for term in sorted(self.postings):
+            terms[term] = [offset, len(self.postings[term])]
+            offset += len(self.postings[term]) * 4
+        write_index(path, len(self.id_ends), terms, little_endian(self.id_ends), bytes(self.ids),
+                    (little_endian(self.postings[term]) for term in sorted(self.postings)))
+
+
+def postings_start(documents, terms_size, ids_size):
+    # The postings start on an 8 byte boundary after the game IDs, so they can be viewed as uint32
+    start = HEADER.size + terms_size + documents * 8 + ids_size
+    return start + -start % 8
+
+
+def write_index(path, documents, terms, id_ends, ids, postings):
+    terms_json = json.dumps(terms, separators=(',', ':')).encode()
+    padding = postings_start(documents, len(terms_json), len(ids)) - (HEADER.size + len(terms_json) + len(id_ends) +
+                                                                      len(ids))
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, documents, len(terms_json), len(ids)))
+        f.write(terms_json)
+        f.write(id_ends)
+        f.write(ids)
+        f.write(b'\0' * padding)
+        for chunk in postings:
+            f.write(chunk)
+
+
+class GameIndex:
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.documents, terms_size, ids_size = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError(path + ' is not a game index')
+        start = HEADER.size
+        self.terms = json.loads(bytes(self.map[start:start + terms_size]))
+        start += terms_size
+        self.view = memoryview(self.map)
+        self.id_ends = self.uint(start, self.documents, 'Q')
+        self.ids_start = start + self.documents * 8
+        self.ids_size = ids_size
+        self.postings_start = postings_start(self.documents, terms_size, ids_size)
+
+    def close(self):
+        self.id_ends = None
+        self.file.close()
+        self.view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            # Postings handed out are still views of the file, it gets unmapped once they are gone
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.documents
+
+    def uint(self, offset, count, typecode):
+        # count uints at offset, viewing the file rather than copying it where the byte order allows
+        view = self.view[offset:offset + count * array(typecode).itemsize]
+        if sys.byteorder == 'little':
+            return view.cast(typecode)
+        values = array(typecode, view)
+        values.byteswap()
+        return values
+
+    def postings(self, term):
+        # The sorted document numbers of a term, empty for a term no game has
+        if term not in self.terms:
+            return array(POSTING)
+        offset, count = self.terms[term]
+        return self.uint(self.postings_start + offset, count, POSTING)
+
+    def count(self, term):
+        return self.terms.get(term, (0, 0))[1]
+
+    def game_id(self, doc):
+        start = self.id_ends[doc - 1] if doc else 0
+        return bytes(self.view[self.ids_start + start:self.ids_start + self.id_ends[doc]]).decode()
+
+    def game_ids(self, docs):
+        return [self.game_id(int(doc)) for doc in docs]
+
+    def any_of(self, terms):
+        # Documents with any of the terms, sorted
+        if isinstance(terms, str):
+            return self.postings(terms)
+        lists = [self.postings(term) for term in terms]
+        if numpy is not None:
+            return numpy.unique(numpy.concatenate([numpy.asarray(postings, dtype=numpy.uint32) for postings in lists] or
+                                                  [numpy.empty(0, numpy.uint32)]))
+        return array(POSTING, sorted(set().union(*lists)))
+
+    def having(self, docs, terms):
+        # The documents of docs (sorted) that have any of the terms. Each of docs is looked up in the postings
+        # instead of the postings being read through, which is what makes a short list against a long one fast
+        if isinstance(terms, str):
+            terms = [terms]
+        if numpy is not None:
+            docs = numpy.asarray(docs, dtype=numpy.uint32)
+            keep = numpy.zeros(len(docs), dtype=bool)
+            for term in terms:
+                postings = numpy.asarray(self.postings(term), dtype=numpy.uint32)
+                if len(postings):
+                    at = numpy.minimum(numpy.searchsorted(postings, docs), len(postings) - 1)
+                    keep |= postings[at] == docs
+            return docs[keep]
+        lists = [self.postings(term) for term in terms]
+        if len(docs) * 16 > sum(len(postings) for postings in lists):
+            # Not much shorter, a set of the postings is quicker than looking every document up
+            members = set().union(*lists)
+            return array(POSTING, [doc for doc in docs if doc in members])
+        starts = [0] * len(lists)
+        kept = array(POSTING)
+        for doc in docs:
+            for i, postings in enumerate(lists):
+                # docs are sorted, so every lookup starts where the last one in the same postings stopped
+                start = starts[i] = bisect_left(postings, doc, starts[i])
+                if start < len(postings) and postings[start] == doc:
+                    kept.append(doc)
+                    break
+        return kept
+
+    def search(self, *terms):
+        # Documents with all of the terms, sorted. An argument that is a list matches any of its terms. The
+        # argument with the fewest games gives the candidates, the others only get asked about those
+        if not terms:
+            return array(POSTING, range(self.documents))
+        terms = sorted(terms, key=lambda term: self.count(term) if isinstance(term, str) else
+                       sum(self.count(alternative) for alternative in term))
+        found = self.any_of(terms[0])
+        for term in terms[1:]:
+            if not len(found):
+                break
+            found = self.having(found, term)
+        return found
+
+
+def merge_indexes(paths, path):
+    # One index with the games of all of the ones in paths, in that order
+    indexes = [GameIndex(part) for part in paths]
+    try:
+        terms = {}
+        for index in indexes:
+            for term, (_, count) in index.terms.items():
+                terms[term] = terms.get(term, 0) + count
+        offsets = {}
+        offset = 0
+        for term in sorted(terms):
+            offsets[term] = [offset, terms[term]]
+            offset += terms[term] * 4
+
+        id_ends = array('Q')
+        ids = bytearray()
+        for index in indexes:
+            base = len(ids)
+            id_ends.extend(end + base for end in index.id_ends)
+            ids += index.view[index.ids_start:index.ids_start + index.ids_size]
+
+        def postings():
+            for term in sorted(terms):
+                base = 0
+                for index in indexes:
+                    # The documents of each part come after the ones before it, so they stay sorted
+                    part = index.postings(term)
+                    yield little_endian(array(POSTING, (doc + base for doc in part)) if base else array(POSTING, part))
+                    base += index.documents
+
+        write_index(path, sum(index.documents for index in indexes), offsets, little_endian(id_ends), bytes(ids),
+                    postings())
+    finally:
+        for index in indexes:
+            index.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Find games in an index written by cli.py --index')
+    parser.add_argument('index')
+    parser.add_argument('--pattern', action='append', default=[], help='pattern name or ID, can be repeated')
+    parser.add_argument('--king', help='square of the mated king, like h8')
+    # Stored as piece:Q and so on, so q finds the same games as Q
+    parser.add_argument('--piece', type=lambda piece: 'double' if piece.lower() == 'double' else piece.upper(),
+                        choices=['Q', 'R', 'B', 'N', 'P', 'double'], help='mating piece (Q, R, B, N, P) or double')
+    parser.add_argument('--region', choices=['corner', 'side', 'center'])
+    parser.add_argument('--speed', help='Lichess speed, like blitz')
+    rated = parser.add_mutually_exclusive_group()
+    rated.add_argument('--rated', action='store_true')
+    rated.add_argument('--casual', action='store_true')
+    parser.add_argument('--min-rating', type=int, help='of the side that gave mate')
+    parser.add_argument('--count', action='store_true', help='only print how many games were found')
+    args = parser.parse_args(argv)
+
+    terms = [pattern_term(int(pattern) if pattern.isdigit() else pattern) for pattern in args.pattern]
+    if args.king:
+        terms.append('king:' + args.king.lower())
+    if args.piece:
+        terms.append('piece:' + args.piece)
+    if args.region:
+        terms.append('region:' + args.region)
+    if args.speed:
+        terms.append('speed:' + args.speed)
+    if args.rated or args.casual:
+        terms.append('rated' if args.rated else 'casual')
+    if args.min_rating is not None:
+        terms.append(rating_terms(args.min_rating))
+
+    with GameIndex(args.index) as index:
+        docs = index.search(*terms)
+        if args.count:
+            print(len(docs))
+        else:
+            for game_id in index.game_ids(docs):
+                print(game_id)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import json
+import time
+from collections import Counter, defaultdict
+
+from rules import RULES
+
+# Opt-in profiling for the classifiers. Profile.instrument(engine) returns a subclass of the engine where
+# every pattern method counts its calls, time and matches, and classify() counts the dispatch branch
+# (king region x mating piece) each position went down and the exceptions that were swallowed or raised.
+# The engines themselves are left alone, so there is nothing to pay when profiling isn't switched on.
+#
+#     profile = Profile()
+#     engine = profile.instrument(CheckmatePattern)
+#     for result in classify_many(fens, engine=engine):
+#         ...
+#     print(profile.to_json())
+
+# Everything classify() can dispatch to
+PATTERN_METHODS = sorted({rule.method for rule in RULES})
+
+
+def branch_name(result):
+    if result.double_check:
+        return 'double check'
+    if result.region is None or result.piece is None:
+        return 'none'
+    return result.region + ' ' + result.piece
+
+
+class Profile:
+
+    def __init__(self):
+        self.calls = Counter()
+        self.seconds = defaultdict(float)
+        self.matches = Counter()
+        self.errors = Counter()
+        self.branches = Counter()
+        self.branch_seconds = defaultdict(float)
+        # Exceptions find_checkmate_pattern's except TypeError swallowed, by the pattern that raised them
+        self.swallowed = Counter()
+        # Exceptions that made it out of classify(), by type
+        self.raised = Counter()
+
+    def instrument(self, engine):
+        profile = self
+        methods = {}
+
+        def wrap(name, method):
+            def instrumented(self, *args):
+                before = len(self.result.patterns)
+                start = time.perf_counter()
+                try:
+                    return method(self, *args)
+                except Exception as error:
+                    profile.errors[name, type(error).__name__] += 1
+                    self._last_error = name
+                    raise
+                finally:
+                    profile.seconds[name] += time.perf_counter() - start
+                    profile.calls[name] += 1
+                    profile.matches[name] += len(self.result.patterns) - before
+            return instrumented
+
+        for name in PATTERN_METHODS:
+            if hasattr(engine, name):
+                methods[name] = wrap(name, getattr(engine, name))
+
+        def classify(self):
+            self._last_error = None
+            start = time.perf_counter()
+            try:
+                return engine.classify(self)
+            except Exception as error:
+                profile.raised[type(error).__name__] += 1
+                raise
+            finally:
+                branch = branch_name(self.result)
+                profile.branches[branch] += 1
+                profile.branch_seconds[branch] += time.perf_counter() - start
+
+        def swallowed(self, error):
+            profile.swallowed[self._last_error or 'dispatch', type(error).__name__] += 1
+            engine.swallowed(self, error)
+
+        methods['classify'] = classify
+        methods['swallowed'] = swallowed
+        return type('Instrumented' + engine.__name__, (engine,), methods)
+
+    def report(self):
+        return {
+            'patterns': {
+                name: {
+                    'calls': self.calls[name],
+                    'seconds': round(self.seconds[name], 6),
+                    'matches': self.matches[name],
+                }
+                for name in sorted(self.calls, key=self.seconds.get, reverse=True)
+            },
+            'branches': {
+                branch: {
+                    'positions': self.branches[branch],
+                    'seconds': round(self.branch_seconds[branch], 6),
+                }
+                for branch in sorted(self.branches)
+            },
+            'swallowed': {'{} {}'.format(*key): count for key, count in sorted(self.swallowed.items())},
+            'raised': dict(self.raised),
+        }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.report(), **kwargs)
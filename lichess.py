@@ -0,0 +1,85 @@
+import chess
+from CheckmatePattern import CheckmatePattern, classify_pattern
+from corpus import final_board
+
+# Helpers for games exported from the Lichess API (the dicts berserk hands back).
+# Everything here is a generator, so games are dealt with one at a time as they are downloaded
+# and nothing holds on to a player's whole history.
+
+# The perf types of standard chess. Asking the export for only these leaves the variant games on the server
+STANDARD_PERFS = 'ultraBullet,bullet,blitz,rapid,classical,correspondence'
+
+# Export parameters that leave out everything the classifier doesn't need: no moves, clocks, evals, opening
+# or PGN, only the final position (lastFen) and the standard games. The status of a game can't be filtered
+# on the server, so the games that didn't end in mate still come, but each of them is a short line now
+MATE_EXPORT = {
+    'moves': False,
+    'lastFen': True,
+    'tags': False,
+    'clocks': False,
+    'evals': False,
+    'opening': False,
+    'pgnInJson': False,
+    'perfType': STANDARD_PERFS,
+}
+
+
+def side_gave(white, black, winner, player):
+    # True if player gave the mate, False if they got mated and None if they didn't play the game. white and
+    # black are the players' names and winner 'white' or 'black'. Lichess names aren't case sensitive
+    sides = {(white or '').lower(): 'white', (black or '').lower(): 'black'}
+    if not player or player.lower() not in sides:
+        return None
+    return sides[player.lower()] == winner
+
+
+def standard_mate(game):
+    return game.get('status') == 'mate' and game.get('variant') == 'standard'
+
+
+def mate_gave(game, player):
+    # For a standard game of player's that ended in checkmate, True if player gave the mate and False if they got
+    # mated. None for every other game, and for the games player wasn't in
+    if not standard_mate(game):
+        return None
+    # A side played by stockfish has no user
+    white, black = (game.get('players', {}).get(color, {}).get('user', {}).get('name') for color in ('white', 'black'))
+    return side_gave(white, black, game.get('winner'), player)
+
+
+def game_board(game):
+    # The final position of an exported game, from lastFen when the export has it and from the moves otherwise
+    fen = game.get('lastFen')
+    if fen is None:
+        return final_board(game['moves'])
+    if ' ' not in fen:
+        # Only the pieces, in a mate the side that got mated is to move
+        fen += ' b' if game.get('winner') == 'white' else ' w'
+    return chess.Board(fen)
+
+
+def classify_mate(game, engine=CheckmatePattern):
+    # The classifier for a game's final position after classify() has run, so pattern.board is the final
+    # position and pattern.result what was found in it (None if the classifier gave up on the position)
+    pattern = engine(game_board(game))
+    classify_pattern(pattern)
+    return pattern
+
+
+def mated_games(games, player, progress=None, every=500):
+    # Yields (game, gave) for every standard game that ended in checkmate, gave is True if player gave the mate.
+    # progress(checked) is called every `every` games so long downloads can report how far they got
+    checked = 0
+    for game in games:
+        checked += 1
+        if progress and checked % every == 0:
+            progress(checked)
+        gave = mate_gave(game, player)
+        if gave is not None:
+            yield game, gave
+
+
+def classify_games(games, player, engine=CheckmatePattern, progress=None):
+    # Yields (game, gave, pattern) for every mate as soon as it arrives, pattern as classify_mate() returns it
+    for game, gave in mated_games(games, player, progress):
+        yield game, gave, classify_mate(game, engine)
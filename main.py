@@ -1,64 +1,78 @@
 from CheckmatePattern import CheckmatePattern
-import chess, chess.pgn
-import io
-import berserk
+from corpus import frequency_table
+from lichess import STANDARD_PERFS
+from store import GameStore
 import json
 
-mate_names = ["Pawn mate", "Other"]
-mate_frequencies = [0] * len(mate_names)
+# Importing this module doesn't touch the network or token.json, berserk is only loaded once games are
+# about to be downloaded. For scripts and batches use cli.py instead of the prompts here
 
-with open('token.json') as f:
-    token = json.load(f)
 
-client = berserk.Client(session=berserk.TokenSession(token["token"]))
-player = input('Please enter the lichess.org account you want to analyze: ')
+def lichess_client(path='token.json'):
+    import berserk
+    with open(path) as f:
+        token = json.load(f)
+    return berserk.Client(session=berserk.TokenSession(token["token"]))
 
 
-print("Fetching " + player + "'s games. This may take a moment on the number of games they have played...\n")
-games = list(client.games.export_by_player(player))
+def main():
+    player = input('Please enter the lichess.org account you want to analyze: ')
 
-gave_checkmate_moves = []
-recieved_checkmate_moves = []
+    answer = input("Would you like to see " + player +"'s a. given checkamtes or b. recieved checkmates? (a / b) ")
+    show_given = answer == 'a'
 
-gave_checkmate_ids = []
-recieved_checkmate_ids = []
+    # Checkmates from earlier runs are kept in games.sqlite, only newer games are downloaded
+    store = GameStore('games.sqlite')
+    updated = store.reclassify_stale()
+    if updated:
+        print('Updated', updated, 'saved checkmates to the latest patterns\n')
 
-for i in range(len(games)):
-    try:
-        if games[i]['status'] == 'mate' and games[i]['variant'] == 'standard':
-            if games[i]['players']['white']['user']['name'] == player and games[i]['winner'] == 'white':
-                gave_checkmate_moves.append(games[i]['moves'])
-                gave_checkmate_ids.append(games[i]['id'])
+    gave_checkmates = 0
+    recieved_checkmates = 0
+
+    def show_checkmate(game_id, gave, fen, result):
+        nonlocal gave_checkmates, recieved_checkmates
+        if gave:
+            gave_checkmates += 1
+        else:
+            recieved_checkmates += 1
+
+        if gave == show_given:
+            pattern = CheckmatePattern(fen)
+            if result is None:
+                print(pattern.board)
+                print('Could not classify this checkmate')
             else:
-                recieved_checkmate_moves.append(games[i]['moves'])
-                recieved_checkmate_ids.append(games[i]['id'])
-    except KeyError:
-        # If the user played against stockfish it messes up the keys
-        pass
-    
-print(player, 'has given', len(gave_checkmate_moves), 'checkmates total.')
-print(player, 'has recieved', len(recieved_checkmate_moves), 'checkmates total\n')
-
-answer = input("Would you like to see " + player +"'s a. given checkamtes or b. recieved checkmates? (a / b) ")
-
-gave_fens = []
-recieved_fens = []
-
-if answer == 'a':
-    if len(gave_checkmate_moves) > 0:
-        for i in gave_checkmate_moves:
-            gave_fens.append(chess.pgn.read_game(io.StringIO(i)).end().board().fen())
-        for i in range(len(gave_fens)):
-            CheckmatePattern(gave_fens[i]).find_checkmate_pattern()
-            print('https://lichess.org/' + gave_checkmate_ids[i])
-    else:
+                pattern.result = result
+                pattern.show()
+            print('https://lichess.org/' + game_id)
+
+    def show_progress(checked):
+        print('...', checked, 'new games checked so far:', gave_checkmates, 'checkmates given,', recieved_checkmates, 'recieved\n')
+
+    for checkmate in store.games(player):
+        show_checkmate(*checkmate)
+
+    client = lichess_client()
+    print("Fetching " + player + "'s new games. Checkmates are shown as soon as they are downloaded...\n")
+    # Only standard games, and none of the clocks, evals or opening names the classifier would throw away
+    for checkmate in store.update(client, player, progress=show_progress, perf_type=STANDARD_PERFS,
+                                  tags=False, clocks=False, evals=False, opening=False):
+        show_checkmate(*checkmate)
+    # The pattern counts are kept up to date in games.sqlite as games are stored
+    pattern_counts, shown_checkmates = store.frequencies(player, show_given)
+    store.close()
+
+    print(player, 'has given', gave_checkmates, 'checkmates total.')
+    print(player, 'has recieved', recieved_checkmates, 'checkmates total\n')
+
+    if show_given and gave_checkmates == 0:
         print(player, 'has never given a checkmate!')
-else:
-    if len(recieved_checkmate_moves) > 0:
-        for i in recieved_checkmate_moves:
-            recieved_fens.append(chess.pgn.read_game(io.StringIO(i)).end().board().fen())
-        for i in range(len(recieved_fens)):
-            CheckmatePattern(recieved_fens[i]).find_checkmate_pattern()
-            print('https://lichess.org/' + recieved_checkmate_ids[i])
-    else:
+    elif not show_given and recieved_checkmates == 0:
         print(player, 'has never recieved a checkmate!')
+    else:
+        print('\n'.join(frequency_table(pattern_counts, shown_checkmates)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+from functools import partial
+
+import chess
+from BitboardPattern import BitboardPattern
+from CheckmatePattern import CheckmatePattern, CLASSIFIER_VERSION, classify_position
+from corpus import worker_pool
+from records import decode, encode
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Mated positions in a fixed width binary file, so that after a rule change a whole archive can be classified
+# again without downloading or replaying any games or parsing a single FEN. A record is 88 bytes:
+#
+#     8 x uint64   pawns, knights, bishops, rooks, queens, kings, white pieces, black pieces
+#     16 bytes     game ID, padded with zero bytes
+#     uint32       patterns found, as a bitset like records.py keeps them
+#     uint8        side to move (1 white, 0 black)
+#     uint8        records.encode code of the labels (region, piece, double check), UNLABELLED if there are none
+#     uint8        CLASSIFIER_VERSION the labels were made with
+#     1 byte       padding
+#
+# all little endian, after a 16 byte header of MAGIC and the record size. Castling rights, en passant and the
+# move counters aren't kept, none of them change whether or how a position is mate.
+#
+#     with PositionWriter('archive.pos') as writer:       # adds to the file if it is there already
+#         writer.add(game_id, board_or_fen, result)       # result is optional
+#
+#     store = PositionStore('archive.pos')
+#     for game_id, board in store:                        # chess.Boards set straight from the bitboards
+#         ...
+#     store.records()                                     # a numpy view of the whole file, nothing copied
+#
+# relabel() classifies every record again (or only those labelled by an older CLASSIFIER_VERSION) and writes
+# the labels back in place, over a fork pool where every worker maps the file itself, so it is bound by the
+# classifier. cli.py --positions and GameStore.export_positions() fill a file.
+#
+# python3 positions.py archive.pos [--all] [--workers 4]
+
+MAGIC = b'MATEPOS1'
+HEADER = struct.Struct('<8sQ')
+RECORD = struct.Struct('<8Q16sIBBBx')
+ID_SIZE = 16
+UNLABELLED = 0xFF
+# Which of the 8 bitboards a piece letter sets, the colour is the 7th or 8th
+PIECE_BOARDS = {letter: piece_type - 1 for piece_type, letter in enumerate(chess.PIECE_SYMBOLS) if letter}
+
+if numpy is not None:
+    RECORD_DTYPE = numpy.dtype([(name, '<u8') for name in ('pawns', 'knights', 'bishops', 'rooks', 'queens', 'kings',
+                                                           'white', 'black')] +
+                               [('game_id', 'S%d' % ID_SIZE), ('patterns', '<u4'), ('turn', 'u1'), ('code', 'u1'),
+                                ('version', 'u1'), ('padding', 'V1')])
+
+
+def fen_bitboards(fen):
+    # The 8 bitboards and the side to move of a FEN, a lot quicker than setting up a chess.Board for it
+    placement, turn = fen.split()[:2]
+    boards = [0] * 8
+    square = 56
+    for char in placement:
+        if char == '/':
+            square -= 16
+        elif char.isdigit():
+            square += int(char)
+        else:
+            bit = 1 << square
+            boards[PIECE_BOARDS[char.lower()]] |= bit
+            boards[6 if char.isupper() else 7] |= bit
+            square += 1
+    return boards, turn == 'w'
+
+
+def board_bitboards(board):
+    return [board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings,
+            board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK]], board.turn
+
+
+def make_board(bitboards, turn):
+    # A chess.Board with the pieces set from the bitboards, no castling rights and no en passant square
+    board = chess.Board(None)
+    (board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings,
+     white, black) = bitboards
+    board.occupied_co[chess.WHITE] = white
+    board.occupied_co[chess.BLACK] = black
+    board.occupied = white | black
+    board.turn = bool(turn)
+    return board
+
+
+def pack(game_id, bitboards, turn, result=UNLABELLED, version=CLASSIFIER_VERSION):
+    game_id = game_id.encode()
+    if len(game_id) > ID_SIZE:
+        raise ValueError('game IDs can be at most %d bytes: %r' % (ID_SIZE, game_id))
+    if result is UNLABELLED:
+        code, bits, version = UNLABELLED, 0, 0
+    else:
+        code, bits = encode(result)
+    return RECORD.pack(*bitboards, game_id, bits, int(turn), code, version)
+
+
+class PositionWriter:
+
+    def __init__(self, path):
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if exists:
+            with open(path, 'rb') as f:
+                check_header(path, f.read(HEADER.size))
+        self.file = open(path, 'ab')
+        if not exists:
+            self.file.write(HEADER.pack(MAGIC, RECORD.size))
+        self.written = 0
+
+    def add(self, game_id, position, result=UNLABELLED, version=CLASSIFIER_VERSION):
+        # position is a chess.Board or a FEN, result the CheckmateResult (None if the classifier gave up on it)
+        # or left out for a position that hasn't been classified. version is the CLASSIFIER_VERSION of result
+        if isinstance(position, str):
+            bitboards, turn = fen_bitboards(position)
+        else:
+            bitboards, turn = board_bitboards(position)
+        self.file.write(pack(game_id, bitboards, turn, result, version))
+        self.written += 1
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def check_header(path, header):
+    if len(header) < HEADER.size or HEADER.unpack(header) != (MAGIC, RECORD.size):
+        raise ValueError(path + ' is not a position store')
+
+
+class PositionStore:
+
+    def __init__(self, path, writable=False):
+        self.path = path
+        self.file = open(path, 'r+b' if writable else 'rb')
+        check_header(path, self.file.read(HEADER.size))
+        self.count = (os.path.getsize(path) - HEADER.size) // RECORD.size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+
+    def close(self):
+        self.file.close()
+        try:
+            self.map.close()
+        except BufferError:
+            # records() handed out a view of the file, it gets unmapped once that is gone
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def record(self, i):
+        # (8 bitboards, game_id, patterns, turn, code, version) of record i, as unpacked from the file
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return RECORD.unpack_from(self.map, HEADER.size + i * RECORD.size)
+
+    def game_id(self, i):
+        return self.record(i)[8].rstrip(b'\0').decode()
+
+    def board(self, i):
+        fields = self.record(i)
+        return make_board(fields[:8], fields[10])
+
+    def result(self, i):
+        # The labels kept for record i: a CheckmateResult, None if the classifier gave up on it or it was never
+        # classified (labelled() tells the two apart)
+        fields = self.record(i)
+        return None if fields[11] == UNLABELLED else decode(fields[11], fields[9])
+
+    def labelled(self, i):
+        return self.record(i)[11] != UNLABELLED
+
+    def records_unpacked(self, start=0, stop=None):
+        # record() for records start to stop, unpacked straight from the mapped file
+        stop = self.count if stop is None else min(stop, self.count)
+        with memoryview(self.map) as view, \
+                view[HEADER.size + start * RECORD.size:HEADER.size + stop * RECORD.size] as records:
+            yield from RECORD.iter_unpack(records)
+
+    def boards(self, start=0, stop=None):
+        # (game_id, board) for records start to stop
+        for fields in self.records_unpacked(start, stop):
+            yield fields[8].rstrip(b'\0').decode(), make_board(fields[:8], fields[10])
+
+    def __iter__(self):
+        return self.boards()
+
+    def records(self):
+        # Every record as a numpy structured array (RECORD_DTYPE) on top of the mapped file: nothing is read
+        # until it is used, and in a writable store setting a field writes to the file
+        return numpy.frombuffer(self.map, dtype=RECORD_DTYPE, count=self.count, offset=HEADER.size)
+
+    def set_labels(self, i, result):
+        # Writes a CheckmateResult (or None) over the labels of record i, in a writable store
+        self.write_labels(i, *encode(result))
+
+    def write_labels(self, i, code, bits):
+        offset = HEADER.size + i * RECORD.size
+        struct.pack_into('<I', self.map, offset + 80, bits)
+        struct.pack_into('<BB', self.map, offset + 85, code, CLASSIFIER_VERSION)
+
+    def stale(self):
+        # Indexes of the records without labels from this CLASSIFIER_VERSION
+        if numpy is not None:
+            records = self.records()
+            return numpy.flatnonzero((records['version'] != CLASSIFIER_VERSION) |
+                                     (records['code'] == UNLABELLED)).tolist()
+        return [i for i, fields in enumerate(self.records_unpacked())
+                if fields[11] == UNLABELLED or fields[12] != CLASSIFIER_VERSION]
+
+    def relabel(self, engine=BitboardPattern, workers=None, everything=False, chunk_size=4096):
+        # Classifies the stale records again (all of them with everything) and writes the new labels over the
+        # old ones, in a writable store. Returns how many were classified and how many came out different
+        indexes = list(range(self.count)) if everything else self.stale()
+        chunks = [indexes[i:i + chunk_size] for i in range(0, len(indexes), chunk_size)]
+        changed = 0
+        for chunk, labels in zip(chunks, classify_chunks(self.path, chunks, engine, workers)):
+            for i, (code, bits) in zip(chunk, labels):
+                fields = self.record(i)
+                if (fields[11], fields[9]) != (code, bits):
+                    changed += 1
+                self.write_labels(i, code, bits)
+        self.map.flush()
+        return len(indexes), changed
+
+
+def classify_records(path, indexes, engine=BitboardPattern):
+    # Runs in a worker: (code, bitset) of the labels of each record. The worker maps the file itself, so only
+    # the record numbers and the labels go between processes
+    with PositionStore(path) as store:
+        labels = []
+        for i in indexes:
+            fields = store.record(i)
+            labels.append(encode(classify_position(make_board(fields[:8], fields[10]), engine)))
+        return labels
+
+
+def classify_chunks(path, chunks, engine, workers):
+    work = partial(classify_records, path, engine=engine)
+    if workers == 1:
+        yield from map(work, chunks)
+        return
+    with worker_pool(workers) as pool:
+        yield from pool.imap(work, chunks)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Classify the positions in a position store again')
+    parser.add_argument('store')
+    parser.add_argument('--all', action='store_true', help='every position, not only those with older labels')
+    parser.add_argument('--workers', type=int, default=None, help='processes, default one per CPU')
+    parser.add_argument('--engine', choices=['bitboard', 'checkmate'], default='bitboard')
+    args = parser.parse_args(argv)
+
+    engine = BitboardPattern if args.engine == 'bitboard' else CheckmatePattern
+    start = time.perf_counter()
+    with PositionStore(args.store, writable=True) as store:
+        classified, changed = store.relabel(engine, args.workers, args.all)
+    elapsed = time.perf_counter() - start
+    print('%d of %d positions classified in %.2f s (%.0f positions/sec), %d got different labels' % (
+        classified, len(store), elapsed, classified / elapsed if elapsed else 0, changed), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
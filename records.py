@@ -0,0 +1,196 @@
+from array import array
+from collections import Counter
+
+import chess, chess.polyglot
+from CheckmatePattern import CheckmateResult, PATTERN_IDS, PATTERN_NAMES
+
+# Small records for holding on to the results of millions of games. A classified game comes down to its ID,
+# the Zobrist hash of the final position (the same key cache.py uses), one small int for the mating piece,
+# region and double check, and the patterns as a bitset (bit i set = PATTERN_NAMES[i] was found). Keeping a
+# CheckmatePattern around instead costs a whole chess.Board, and a list of names costs a string per pattern.
+#
+# MateRecord is one game with __slots__, ResultBatch keeps whole batches as columns in array.array and counts
+# patterns straight from the bitsets. The bitsets don't keep the order the patterns matched in, or how many
+# times one pattern matched, so CheckmateResults that come back out have their patterns sorted by ID.
+
+REGIONS = [None, 'corner', 'side', 'center']
+PIECES = [None, 'P', 'N', 'B', 'R', 'Q']
+REGION_CODES = {region: code for code, region in enumerate(REGIONS)}
+PIECE_CODES = {piece: code for code, piece in enumerate(PIECES)}
+DOUBLE_CHECK = 1 << 5
+# A code for games the classifier gave up on (Anderssen's mate on a corner), every real result is below it
+UNCLASSIFIED = 1 << 6
+# 'I' is 4 bytes nearly everywhere, which is room for 32 patterns
+BITSET = 'I' if array('I').itemsize >= 4 else 'L'
+
+
+def pattern_mask(names):
+    # Bitset of the pattern names (or IDs) given
+    mask = 0
+    for name in names:
+        mask |= 1 << (PATTERN_IDS[name] if isinstance(name, str) else name)
+    return mask
+
+
+def bitset_names(bits):
+    return [name for i, name in enumerate(PATTERN_NAMES) if bits >> i & 1]
+
+
+def encode(result):
+    # (code, bitset) for a CheckmateResult, None meaning the classifier gave up on the position
+    if result is None:
+        return UNCLASSIFIED, 0
+    code = REGION_CODES[result.region] | PIECE_CODES[result.piece] << 2
+    if result.double_check:
+        code |= DOUBLE_CHECK
+    return code, pattern_mask(result.patterns)
+
+
+def decode(code, bits):
+    if code == UNCLASSIFIED:
+        return None
+    return CheckmateResult(PIECES[code >> 2 & 7], REGIONS[code & 3],
+                           [i for i in range(len(PATTERN_NAMES)) if bits >> i & 1], bool(code & DOUBLE_CHECK))
+
+
+def position_key(position):
+    # 64 bit Zobrist hash of a FEN or chess.Board
+    board = position if isinstance(position, chess.Board) else chess.Board(position)
+    return chess.polyglot.zobrist_hash(board)
+
+
+class MateRecord:
+
+    __slots__ = ('game_id', 'key', 'code', 'patterns')
+
+    def __init__(self, game_id, key, code, patterns):
+        self.game_id = game_id
+        self.key = key
+        self.code = code
+        self.patterns = patterns
+
+    @classmethod
+    def from_result(cls, game_id, position, result):
+        # position is the final FEN or chess.Board, result what the classifier returned for it (or None)
+        return cls(game_id, position_key(position), *encode(result))
+
+    @property
+    def region(self):
+        return REGIONS[self.code & 3]
+
+    @property
+    def piece(self):
+        return PIECES[self.code >> 2 & 7]
+
+    @property
+    def double_check(self):
+        return bool(self.code & DOUBLE_CHECK)
+
+    def names(self):
+        return bitset_names(self.patterns)
+
+    def result(self):
+        return decode(self.code, self.patterns)
+
+    def __eq__(self, other):
+        if not isinstance(other, MateRecord):
+            return NotImplemented
+        return (self.game_id, self.key, self.code, self.patterns) == (other.game_id, other.key, other.code, other.patterns)
+
+    def __repr__(self):
+        return 'MateRecord(game_id={!r}, key={:#018x}, code={}, patterns={:#x})'.format(
+            self.game_id, self.key, self.code, self.patterns)
+
+
+class ResultBatch:
+    # Columns for a whole batch of games: the game IDs back to back in one bytearray (with where each one
+    # ends), then a 64 bit hash, a code byte and a pattern bitset per game
+
+    def __init__(self):
+        self.ids = bytearray()
+        self.id_ends = array('Q')
+        self.keys = array('Q')
+        self.codes = array('B')
+        self.patterns = array(BITSET)
+
+    @classmethod
+    def from_results(cls, game_ids, positions, results):
+        batch = cls()
+        for game_id, position, result in zip(game_ids, positions, results):
+            batch.add(game_id, position, result)
+        return batch
+
+    @classmethod
+    def from_records(cls, records):
+        batch = cls()
+        batch.extend(records)
+        return batch
+
+    def add(self, game_id, position, result):
+        self.append(MateRecord.from_result(game_id, position, result))
+
+    def append(self, record):
+        self.ids += str(record.game_id).encode()
+        self.id_ends.append(len(self.ids))
+        self.keys.append(record.key)
+        self.codes.append(record.code)
+        self.patterns.append(record.patterns)
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def game_id(self, i):
+        start = self.id_ends[i - 1] if i else 0
+        return self.ids[start:self.id_ends[i]].decode()
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('ResultBatch index out of range')
+        return MateRecord(self.game_id(i), self.keys[i], self.codes[i], self.patterns[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def nbytes(self):
+        # Memory the columns take up, leaving out the few hundred bytes of the objects themselves
+        return len(self.ids) + sum(len(column) * column.itemsize
+                                   for column in (self.id_ends, self.keys, self.codes, self.patterns))
+
+    def combinations(self, region=None, piece=None):
+        # Counter of pattern bitset -> number of games with exactly those patterns. Games mostly share a handful
+        # of combinations, so everything below only looks at each combination once
+        if region is None and piece is None:
+            return Counter(self.patterns)
+        mask = (3 if region is not None else 0) | (7 << 2 if piece is not None else 0)
+        wanted = (REGION_CODES[region] if region is not None else 0) | \
+                 (PIECE_CODES[piece] << 2 if piece is not None else 0)
+        return Counter(bits for code, bits in zip(self.codes, self.patterns)
+                       if code & mask == wanted and code != UNCLASSIFIED)
+
+    def counts(self, region=None, piece=None):
+        # Counter of pattern name -> number of games it was found in, like classify_corpus's counts.
+        # region and piece only count the games mated in that region or by that piece
+        counts = Counter()
+        for bits, games in self.combinations(region, piece).items():
+            while bits:
+                low = bits & -bits
+                counts[PATTERN_NAMES[low.bit_length() - 1]] += games
+                bits ^= low
+        return counts
+
+    def count(self, *names, region=None, piece=None):
+        # Number of games in which every one of the patterns named was found
+        mask = pattern_mask(names)
+        return sum(games for bits, games in self.combinations(region, piece).items() if bits & mask == mask)
+
+    def matching(self, *names):
+        # Indexes of the games in which every one of the patterns named was found
+        mask = pattern_mask(names)
+        return [i for i, bits in enumerate(self.patterns) if bits & mask == mask]
@@ -0,0 +1,114 @@
+import chess
+from collections import namedtuple
+
+# Which patterns get tried for a checkmate, as data. classify() finds the losing king's region and the letter
+# of the checking piece, then runs the rules for that branch in the order they are listed here. A new pattern
+# only needs a method on CheckmatePattern and a line in RULES.
+#
+# region - 'corner', 'side' or 'center'
+# pieces - letters of the checking pieces the rule is for ('QR' = queen or rook)
+# method - name of the CheckmatePattern method
+# args - what it gets called with: 'squares' is available_squares, 'square' is the checker's square
+#
+# Prefilters, facts that are cheap to work out once per position. A rule whose prefilters fail can't
+# match, so it isn't run:
+# min_blocked - how many of the king's neighbour squares have to be blocked by his own pieces
+# winner_pieces - the winner needs at least one of these pieces (the patterns that look for a piece
+#                 with str(piece).upper())
+# white_pieces - white needs at least one of these pieces (the patterns that compare str(piece) to an
+#                upper case letter, which only white pieces are)
+Rule = namedtuple('Rule', ['region', 'pieces', 'method', 'args', 'min_blocked', 'winner_pieces', 'white_pieces'],
+                  defaults=(0, '', ''))
+
+SQUARES = ('squares',)
+SQUARE = ('square',)
+BOTH = ('squares', 'square')
+
+# box_corner, blind_swine in the center and suffocation_and_pillsburys for a knight on the side have always
+# been called one argument short. The TypeError stops the rest of the branch, so the rules after them never
+# run. They have no prefilters, that way they keep stopping the branch exactly where they used to.
+RULES = [
+    Rule('corner', 'QR', 'back_rank_corner', BOTH, min_blocked=2),
+    Rule('corner', 'Q', 'damianos_bishop_corner_and_lollis_corner', BOTH, winner_pieces='BP'),
+    Rule('corner', 'Q', 'queen_and_king_corner', SQUARE),
+    Rule('corner', 'R', 'anderssens', BOTH, winner_pieces='P'),
+    Rule('corner', 'R', 'anastasias_corner', SQUARES, min_blocked=1, winner_pieces='N'),
+    Rule('corner', 'R', 'arabian', BOTH, winner_pieces='N'),
+    Rule('corner', 'R', 'mayets_corner', BOTH, min_blocked=1, white_pieces='B'),
+    Rule('corner', 'QR', 'box_corner', SQUARES),
+    Rule('corner', 'QR', 'grecos', BOTH),
+    Rule('corner', 'QR', 'ladder_corner', BOTH),
+    Rule('corner', 'N', 'smothered', SQUARES, min_blocked=3),
+    Rule('corner', 'N', 'suffocation_corner', SQUARES),
+    Rule('corner', 'BN', 'corner_and_morphys', BOTH, min_blocked=1, winner_pieces='RQ'),
+
+    Rule('center', 'Q', 'swallows_tail', BOTH, min_blocked=2),
+    Rule('center', 'Q', 'dovetail', BOTH, min_blocked=2),
+    Rule('center', 'Q', 'dovetail_bishop', BOTH, white_pieces='B'),
+    Rule('center', 'Q', 'triangle_center', BOTH, min_blocked=1, winner_pieces='R'),
+    Rule('center', 'R', 'hook', BOTH, winner_pieces='N'),
+    Rule('center', 'R', 'blind_swine', SQUARES),
+
+    Rule('side', 'Q', 'scholars', BOTH, white_pieces='B'),
+    Rule('side', 'Q', 'back_rank', BOTH, min_blocked=3),
+    Rule('side', 'Q', 'epaulette', BOTH, min_blocked=2),
+    Rule('side', 'Q', 'damianos_bishop_and_lollis', BOTH, winner_pieces='BP'),
+    Rule('side', 'Q', 'damianos_and_max_langes', BOTH, white_pieces='BP'),
+    Rule('side', 'Q', 'queen_and_king', BOTH),
+    Rule('side', 'Q', 'box', SQUARES),
+    Rule('side', 'Q', 'ladder', BOTH),
+    Rule('side', 'R', 'ladder', BOTH),
+    Rule('side', 'R', 'suffocation_and_pillsburys', BOTH, min_blocked=3, white_pieces='B'),
+    Rule('side', 'R', 'blind_swine', BOTH, min_blocked=1),
+    Rule('side', 'R', 'back_rank', BOTH, min_blocked=3),
+    Rule('side', 'R', 'anastasias', SQUARES, winner_pieces='N'),
+    Rule('side', 'R', 'opera', BOTH, min_blocked=1, white_pieces='B'),
+    Rule('side', 'R', 'kill_box', BOTH, winner_pieces='Q'),
+    Rule('side', 'R', 'box', SQUARES),
+    Rule('side', 'R', 'anderssens', BOTH, winner_pieces='P'),
+    Rule('side', 'R', 'hook_side', BOTH, winner_pieces='N'),
+    Rule('side', 'B', 'balestra', BOTH),
+    Rule('side', 'N', 'smothered', SQUARES, min_blocked=5),
+    Rule('side', 'N', 'suffocation_and_pillsburys', SQUARES),
+]
+
+
+def piece_types(letters):
+    # Piece letters as a set of bits, one per piece type
+    types = 0
+    for letter in letters:
+        types |= 1 << chess.PIECE_SYMBOLS.index(letter.lower())
+    return types
+
+
+# RULES_BY_BRANCH[region, piece letter] is every rule for a branch, in the order of RULES
+RULES_BY_BRANCH = {}
+for _rule in RULES:
+    for _piece in _rule.pieces:
+        RULES_BY_BRANCH.setdefault((_rule.region, _piece), []).append(_rule)
+
+# The prefilters only depend on a handful of small numbers, so which rules survive them is worked out once
+# for each combination that comes up and looked up after that
+_candidates = {}
+
+
+def candidates(region, piece, blocked, winner_types, white_types):
+    # The rules for a branch that pass the prefilters, blocked being the number of blocked neighbour squares
+    # and winner_types and white_types the piece types each side has (board_piece_types())
+    key = (region, piece, blocked, winner_types, white_types)
+    rules = _candidates.get(key)
+    if rules is None:
+        rules = _candidates[key] = tuple(
+            rule for rule in RULES_BY_BRANCH.get((region, piece), ())
+            if blocked >= rule.min_blocked and
+            (not rule.winner_pieces or winner_types & piece_types(rule.winner_pieces)) and
+            (not rule.white_pieces or white_types & piece_types(rule.white_pieces)))
+    return rules
+
+
+def board_piece_types(board, color):
+    # Bits for the piece types color has on the board, like piece_types()
+    occupied = board.occupied_co[color]
+    return ((board.pawns & occupied and 1 << chess.PAWN) | (board.knights & occupied and 1 << chess.KNIGHT) |
+            (board.bishops & occupied and 1 << chess.BISHOP) | (board.rooks & occupied and 1 << chess.ROOK) |
+            (board.queens & occupied and 1 << chess.QUEEN))
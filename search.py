@@ -0,0 +1,332 @@
+import argparse
+import csv
+import sys
+import time
+from collections import Counter, namedtuple
+from functools import partial
+
+import chess
+from BitboardPattern import BitboardPattern
+from CheckmatePattern import PATTERN_NAMES, classify_position
+from corpus import worker_pool
+
+# Which pattern a forced mate would end in, for puzzles and middlegame positions rather than finished games.
+# MateSearch looks for the shortest forced mate for the side to move, up to max_moves of their moves (a mate in
+# 3 is 5 plies), with python-chess generating the moves:
+#
+#     solution = MateSearch().solve(board, max_moves=3)
+#     if solution:
+#         print(solution.mate_in, solution.line, solution.result.names())
+#
+# The attacker tries checks first, then captures, then moves to squares near the enemy king. The defender tries
+# captures and king moves first, which is where refutations usually are. A transposition table remembers for
+# every position the shortest mate it was proven to have and the longest it was proven not to have, so
+# iterative deepening and positions reached by different move orders don't get searched twice.
+#
+# Every defence in the forced mate gets followed to its mating position, and those positions are classified:
+# solution.result is the mate at the end of the main line (the longest defence) and solution.patterns counts
+# the patterns over all of them.
+#
+# python3 search.py puzzles.csv --max-moves 3 --workers 4 -o tags.csv     (Lichess puzzle CSV format)
+
+# mate_in - moves the winner needs, line - the main line in UCI, result - CheckmateResult of the mate at its end
+# (None if the classifier gave up), patterns - Counter of pattern ID -> mating positions it was found in,
+# leaves - how many mating positions the forced mate has
+Solution = namedtuple('Solution', ['mate_in', 'line', 'result', 'patterns', 'leaves'])
+
+NOT_PROVEN = 1000
+# The columns of the Lichess puzzle database
+PUZZLE_COLUMNS = ['PuzzleId', 'FEN', 'Moves', 'Rating', 'RatingDeviation', 'Popularity', 'NbPlays', 'Themes',
+                  'GameUrl', 'OpeningTags']
+
+
+def position_key(board):
+    # Everything that decides which moves are legal, cheaper to build than a Zobrist hash
+    return (board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings,
+            board.occupied_co[chess.WHITE], board.turn, board.castling_rights, board.ep_square)
+
+
+def check_targets(king, color):
+    # Piece type -> squares from which a piece of that type and color would attack king, if nothing was in the
+    # way. The queen's are also every line through the king, which discovered checks come along
+    if king is None:
+        return dict.fromkeys(chess.PIECE_TYPES, 0)
+    diagonal = chess.BB_DIAG_ATTACKS[king][0]
+    straight = chess.BB_RANK_ATTACKS[king][0] | chess.BB_FILE_ATTACKS[king][0]
+    return {
+        chess.PAWN: chess.BB_PAWN_ATTACKS[not color][king],
+        chess.KNIGHT: chess.BB_KNIGHT_ATTACKS[king],
+        chess.BISHOP: diagonal,
+        chess.ROOK: straight,
+        chess.QUEEN: diagonal | straight,
+        chess.KING: 0,
+    }
+
+
+# Squares at most two king steps from each square, where quiet attacking moves get tried first
+NEAR_KING = [sum(chess.BB_SQUARES[other] for other in chess.SQUARES if chess.square_distance(square, other) <= 2)
+             for square in chess.SQUARES]
+
+
+class MateSearch:
+
+    def __init__(self, engine=BitboardPattern, checks_only=False, table_size=1000000):
+        # checks_only makes the attacker only try checking moves, which finds most puzzle mates much faster but
+        # misses the ones that start with a quiet move
+        self.engine = engine
+        self.checks_only = checks_only
+        self.table_size = table_size
+        # position key -> [shortest mate proven, longest mate ruled out], in the attacker's moves
+        self.table = {}
+        self.nodes = 0
+
+    def attacker_moves(self, board, checks_only=False):
+        # (move, gives check) for the side to move, best first. With checks_only (or self.checks_only) only
+        # the checking moves
+        checks_only = checks_only or self.checks_only
+        king = board.king(not board.turn)
+        targets = check_targets(king, board.turn)
+        lines = targets[chess.QUEEN]
+        near = NEAR_KING[king] if king is not None else 0
+        theirs = board.occupied_co[not board.turn]
+        moves = []
+        for move in board.generate_legal_moves():
+            # board.gives_check plays the move to find out, so only the moves that land where their piece would
+            # attack the king, leave one of the king's lines (a discovered check) or are special get asked about
+            piece = board.piece_type_at(move.from_square)
+            to = chess.BB_SQUARES[move.to_square]
+            special = move.promotion or (piece == chess.KING and abs(move.to_square - move.from_square) == 2) or \
+                (piece == chess.PAWN and move.to_square == board.ep_square)
+            if (targets[piece] & to or lines & chess.BB_SQUARES[move.from_square] or special) and board.gives_check(move):
+                order = 0
+            elif checks_only:
+                continue
+            elif theirs & to:
+                order = 1
+            elif near & to:
+                order = 2
+            else:
+                order = 3
+            moves.append((order, move))
+        moves.sort(key=lambda item: item[0])
+        return [(move, order == 0) for order, move in moves]
+
+    def defender_moves(self, board):
+        king = board.king(board.turn)
+        theirs = board.occupied_co[not board.turn]
+        return sorted(board.generate_legal_moves(),
+                      key=lambda move: 0 if theirs & chess.BB_SQUARES[move.to_square] else 1 if move.from_square == king else 2)
+
+    def mates_in_one(self, board, moves):
+        for move, check in moves:
+            if check:
+                board.push(move)
+                self.nodes += 1
+                mate = board.is_checkmate()
+                board.pop()
+                if mate:
+                    yield move
+
+    def mate_within(self, board, n):
+        # True if the side to move can force mate in at most n moves
+        key = position_key(board)
+        entry = self.table.get(key)
+        if entry is None:
+            if len(self.table) >= self.table_size:
+                self.table.clear()
+            entry = self.table[key] = [NOT_PROVEN, 0]
+        if entry[0] <= n:
+            return True
+        if entry[1] >= n:
+            return False
+
+        found = self.attack(board, n)
+        if found:
+            entry[0] = min(entry[0], n)
+        else:
+            entry[1] = max(entry[1], n)
+        return found
+
+    def attack(self, board, n):
+        # Only a check can mate, so one move from the end only the checks are needed
+        moves = self.attacker_moves(board, checks_only=n == 1)
+        for _ in self.mates_in_one(board, moves):
+            return True
+        if n == 1:
+            return False
+        for move, check in moves:
+            board.push(move)
+            self.nodes += 1
+            forced = not self.escapes(board, n - 1)
+            board.pop()
+            if forced:
+                return True
+        return False
+
+    def escapes(self, board, n):
+        # True if the defender (to move) has a reply after which there is no mate in n. Stalemate escapes too
+        replies = self.defender_moves(board)
+        if not replies:
+            return not board.is_check()
+        for reply in replies:
+            board.push(reply)
+            self.nodes += 1
+            escaped = not self.mate_within(board, n)
+            board.pop()
+            if escaped:
+                return True
+        return False
+
+    def distance(self, board, n):
+        # Fewest moves the side to move needs to force mate, None if it takes more than n
+        for k in range(1, n + 1):
+            if self.mate_within(board, k):
+                return k
+        return None
+
+    def solve(self, board, max_moves=3):
+        # The shortest forced mate for the side to move, None if there is none in max_moves or fewer
+        board = board.copy(stack=False)
+        mate_in = self.distance(board, max_moves)
+        if mate_in is None:
+            return None
+        line = []
+        leaves = []
+        self.follow(board, mate_in, line, leaves, main=True)
+        results = [result for result in leaves if result is not None]
+        patterns = Counter(pattern for result in results for pattern in set(result.patterns))
+        return Solution(mate_in, line, leaves[0] if leaves else None, patterns, len(leaves))
+
+    def follow(self, board, n, line, leaves, main):
+        # Plays the forced mate out from a position where the attacker mates in n: the first mating move the
+        # search would pick, then every defence. The main line follows the defence that holds out longest and
+        # its mate goes first in leaves
+        moves = self.attacker_moves(board)
+        for move in self.mates_in_one(board, moves):
+            board.push(move)
+            if main:
+                line.append(move.uci())
+                leaves.insert(0, classify_position(board, self.engine))
+            else:
+                leaves.append(classify_position(board, self.engine))
+            board.pop()
+            return
+        for move, check in moves:
+            board.push(move)
+            if not self.escapes(board, n - 1):
+                replies = []
+                for reply in board.generate_legal_moves():
+                    board.push(reply)
+                    replies.append((self.distance(board, n - 1), reply))
+                    board.pop()
+                longest = max(replies, key=lambda item: item[0])[1]
+                if main:
+                    line += [move.uci(), longest.uci()]
+                for k, reply in replies:
+                    board.push(reply)
+                    self.follow(board, k, line, leaves, main and reply == longest)
+                    board.pop()
+                board.pop()
+                return
+            board.pop()
+
+
+# Each worker keeps its own search (and transposition table) between puzzles
+_worker_search = None
+
+
+def puzzle_board(row):
+    # In the Lichess puzzle CSV the FEN is the position before the opponent's move, which is the first of Moves
+    board = chess.Board(row['FEN'])
+    moves = row.get('Moves', '').split()
+    if moves:
+        board.push_uci(moves[0])
+    return board
+
+
+def puzzle_depth(row, max_moves):
+    # mateInN in the themes says how deep to look, otherwise max_moves
+    for theme in row.get('Themes', '').split():
+        if theme.startswith('mateIn') and theme[6:].isdigit():
+            return min(int(theme[6:]), max_moves)
+    return max_moves
+
+
+def solve_puzzle(row, max_moves, checks_only, engine, search=None):
+    # Returns (puzzle ID, solution or None, nodes searched, seconds). In a worker search is None and the
+    # worker's own MateSearch is used
+    global _worker_search
+    if search is None:
+        if _worker_search is None or _worker_search.checks_only != checks_only or _worker_search.engine is not engine:
+            _worker_search = MateSearch(engine, checks_only)
+        search = _worker_search
+    nodes = search.nodes
+    start = time.perf_counter()
+    solution = search.solve(puzzle_board(row), puzzle_depth(row, max_moves))
+    return row['PuzzleId'], solution, search.nodes - nodes, time.perf_counter() - start
+
+
+def read_puzzles(path):
+    # Dicts of the rows of a puzzle CSV, with or without the header line
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        first = next(reader, None)
+        if first is None:
+            return
+        if 'FEN' in first:
+            header = first
+        else:
+            header = PUZZLE_COLUMNS
+            yield dict(zip(header, first))
+        for values in reader:
+            yield dict(zip(header, values))
+
+
+def solve_puzzles(rows, max_moves=3, workers=None, checks_only=False, engine=BitboardPattern, chunk_size=16):
+    # Yields (puzzle ID, solution, nodes, seconds) for every puzzle in order, on a pool of worker processes
+    # unless workers is 1
+    solve = partial(solve_puzzle, max_moves=max_moves, checks_only=checks_only, engine=engine)
+    if workers == 1:
+        search = MateSearch(engine, checks_only)
+        yield from (solve(row, search=search) for row in rows)
+        return
+    with worker_pool(workers) as pool:
+        yield from pool.imap(solve, rows, chunksize=chunk_size)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Tag puzzles with the patterns of their forced mates')
+    parser.add_argument('puzzles', help='CSV in the Lichess puzzle format (PuzzleId, FEN, Moves, ..., Themes)')
+    parser.add_argument('--max-moves', type=int, default=3, help='longest mate looked for, in the winner\'s moves')
+    parser.add_argument('--workers', type=int, default=None, help='processes, default one per CPU')
+    parser.add_argument('--checks-only', action='store_true', help='only try checking moves for the attacker')
+    parser.add_argument('-o', '--output', default='-', help='CSV to write to, - for stdout')
+    args = parser.parse_args(argv)
+
+    out = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    writer = csv.writer(out)
+    writer.writerow(['puzzle_id', 'mate_in', 'line', 'piece', 'region', 'patterns', 'all_patterns', 'nodes'])
+    puzzles = nodes = 0
+    start = time.perf_counter()
+    for puzzle_id, solution, searched, seconds in solve_puzzles(read_puzzles(args.puzzles), args.max_moves,
+                                                                args.workers, args.checks_only):
+        puzzles += 1
+        nodes += searched
+        if solution is None:
+            writer.writerow([puzzle_id, '', '', '', '', '', '', searched])
+            continue
+        result = solution.result
+        writer.writerow([puzzle_id, solution.mate_in, ' '.join(solution.line),
+                         result.piece if result else '', result.region if result else '',
+                         ';'.join(result.names()) if result else '',
+                         ';'.join('%s:%d' % (PATTERN_NAMES[i], count) for i, count in sorted(solution.patterns.items())),
+                         searched])
+    if out is not sys.stdout:
+        out.close()
+    elapsed = time.perf_counter() - start
+    print('%d puzzles in %.2f s: %.1f positions/sec, %.0f nodes/sec' % (
+        puzzles, elapsed, puzzles / elapsed, nodes / elapsed), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
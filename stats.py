@@ -0,0 +1,185 @@
+from collections import Counter
+from datetime import datetime, timezone
+from itertools import product
+
+from CheckmatePattern import PATTERN_NAMES
+
+# Pattern frequencies by player, month, time control and direction (given or received), kept as counters that
+# add up. Every game is counted in its own cell and in each rollup above it, where one or more of the four are
+# ALL, so "player X's top patterns" or "every player's bullet mates in 2024-03" is one lookup instead of a scan
+# over the games:
+#
+#     stats = PatternStats()
+#     for game, player, gave, result in mates:          # Lichess game dicts and CheckmateResults
+#         stats.add_game(game, player, gave, result)
+#     stats.top('alice', direction='given', n=5)          # [('Back-rank mate', 120), ...]
+#
+# Counts only ever get added, so the stats of different workers, days or files can be merged with += and come
+# out the same as counting all of the games in one go. save_stats() adds them to a table in a SQLite file
+# (GameStore keeps its own in games.sqlite up to date this way) and top_patterns() answers from there.
+#
+# A cell is a dict of stat -> count: how many games (GAMES), how many the classifier gave up on (UNCLASSIFIED),
+# how many were double checks (DOUBLE_CHECKS), and for every pattern ID how many games it was found in. The
+# SQLite table has the same stats in its stat column. add() only counts a game in its own cell, among the ones
+# waiting to be rolled up, and those get added to their rollups all at once the next time the stats are read,
+# merged or saved. That's once per cell instead of sixteen times per game.
+
+ALL = '*'
+DIRECTIONS = {True: 'given', False: 'received'}
+GAMES, UNCLASSIFIED, DOUBLE_CHECKS = -3, -2, -1
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS pattern_stats (
+    player TEXT NOT NULL,
+    month TEXT NOT NULL,
+    speed TEXT NOT NULL,
+    direction TEXT NOT NULL,
+    stat INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (player, month, speed, direction, stat)
+) WITHOUT ROWID;
+'''
+
+
+def month(created_at):
+    # 'YYYY-MM' (UTC) of a timestamp in milliseconds like Lichess sends, or of a datetime like berserk makes
+    if not isinstance(created_at, datetime):
+        created_at = datetime.fromtimestamp(created_at / 1000, timezone.utc)
+    return created_at.strftime('%Y-%m')
+
+
+class PatternStats:
+
+    def __init__(self):
+        # (player, month, speed, direction) -> cell, for the cells and the rollups alike
+        self.cells = {}
+        # The counts added since the last roll_up(), by cell
+        self.pending = {}
+
+    def __getstate__(self):
+        self.roll_up()
+        return {'cells': self.cells}
+
+    def __setstate__(self, state):
+        self.cells = state['cells']
+        self.pending = {}
+
+    def __len__(self):
+        self.roll_up()
+        return len(self.cells)
+
+    def __eq__(self, other):
+        self.roll_up()
+        return isinstance(other, PatternStats) and self.cells == other.roll_up().cells
+
+    def add(self, player, created_at, speed, gave, result, count=1):
+        # Counts one game. A count of -1 takes a game back out, for when its labels change
+        key = (player, created_at if isinstance(created_at, str) else month(created_at), speed or 'unknown',
+               DIRECTIONS[bool(gave)])
+        cell = self.pending.get(key)
+        if cell is None:
+            cell = self.pending[key] = {}
+        cell[GAMES] = cell.get(GAMES, 0) + count
+        if result is None:
+            cell[UNCLASSIFIED] = cell.get(UNCLASSIFIED, 0) + count
+            return
+        # A pattern that matched twice is still one game
+        for stat in set(result.patterns):
+            cell[stat] = cell.get(stat, 0) + count
+        if result.double_check:
+            cell[DOUBLE_CHECKS] = cell.get(DOUBLE_CHECKS, 0) + count
+
+    def add_game(self, game, player, gave, result):
+        # A game dict from a Lichess export, like lichess.mated_games yields them
+        self.add(player, game['createdAt'], game.get('speed'), gave, result)
+
+    def add_cell(self, key, counts):
+        cell = self.cells.get(key)
+        if cell is None:
+            self.cells[key] = dict(counts)
+        else:
+            for stat, count in counts.items():
+                cell[stat] = cell.get(stat, 0) + count
+
+    def roll_up(self):
+        cells = self.cells
+        for (player, month, speed, direction), counts in self.pending.items():
+            # The cell itself first, then every combination with ALL in place of some of the four
+            for key in product((player, ALL), (month, ALL), (speed, ALL), (direction, ALL)):
+                cell = cells.get(key)
+                if cell is None:
+                    cells[key] = dict(counts)
+                else:
+                    for stat, count in counts.items():
+                        cell[stat] = cell.get(stat, 0) + count
+        self.pending = {}
+        return self
+
+    def merge(self, other):
+        # Adds other's counts to these
+        self.roll_up()
+        for key, counts in other.roll_up().cells.items():
+            self.add_cell(key, counts)
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def __add__(self, other):
+        return PatternStats().merge(self).merge(other)
+
+    def cell(self, player=ALL, month=ALL, speed=ALL, direction=ALL):
+        self.roll_up()
+        return self.cells.get((player, month, speed, direction), {})
+
+    def games(self, player=ALL, month=ALL, speed=ALL, direction=ALL):
+        return self.cell(player, month, speed, direction).get(GAMES, 0)
+
+    def frequencies(self, player=ALL, month=ALL, speed=ALL, direction=ALL):
+        # (Counter of pattern name -> games it was found in, games) for corpus.frequency_table
+        cell = self.cell(player, month, speed, direction)
+        return cell_frequencies(cell), cell.get(GAMES, 0)
+
+    def top(self, player=ALL, month=ALL, speed=ALL, direction=ALL, n=5):
+        # The n most common patterns as (name, games) pairs, ties go to the lower pattern ID
+        return self.frequencies(player, month, speed, direction)[0].most_common(n)
+
+    def rows(self):
+        # (player, month, speed, direction, stat, count) for every count that isn't 0
+        self.roll_up()
+        for key, cell in self.cells.items():
+            for stat, count in cell.items():
+                if count:
+                    yield key + (stat, count)
+
+    @classmethod
+    def from_rows(cls, rows):
+        stats = cls()
+        for player, month, speed, direction, stat, count in rows:
+            stats.add_cell((player, month, speed, direction), {stat: count})
+        return stats
+
+
+def cell_frequencies(cell):
+    return Counter({PATTERN_NAMES[stat]: cell[stat] for stat in sorted(cell) if stat >= 0 and cell[stat]})
+
+
+def save_stats(db, stats):
+    # Adds stats to the pattern_stats table of a sqlite3 connection (made with SCHEMA), the caller commits
+    db.executemany('INSERT INTO pattern_stats VALUES (?, ?, ?, ?, ?, ?) '
+                   'ON CONFLICT (player, month, speed, direction, stat) DO UPDATE SET count = count + excluded.count',
+                   stats.rows())
+
+
+def load_stats(db):
+    return PatternStats.from_rows(db.execute('SELECT * FROM pattern_stats'))
+
+
+def stored_cell(db, player=ALL, month=ALL, speed=ALL, direction=ALL):
+    return dict(db.execute('SELECT stat, count FROM pattern_stats '
+                           'WHERE player = ? AND month = ? AND speed = ? AND direction = ?',
+                           (player, month, speed, direction)))
+
+
+def top_patterns(db, player=ALL, month=ALL, speed=ALL, direction=ALL, n=5):
+    # PatternStats.top() from the saved table, without loading the rest of it
+    return cell_frequencies(stored_cell(db, player, month, speed, direction)).most_common(n)
@@ -0,0 +1,256 @@
+import sqlite3
+from datetime import datetime
+
+from CheckmatePattern import CheckmatePattern, CheckmateResult, CLASSIFIER_VERSION, classify_position
+from lichess import MATE_EXPORT, classify_games, classify_mate, mate_gave
+from stats import ALL, DIRECTIONS, GAMES, SCHEMA as STATS_SCHEMA, PatternStats, cell_frequencies, save_stats, stored_cell
+
+# A local SQLite file with every checkmate that has been downloaded and classified, so a re-run only has to
+# fetch the games played since the last run. Each game keeps its final FEN and the CLASSIFIER_VERSION its
+# labels were made with, so after a rule change only the out of date labels get worked out again.
+#
+# The pattern_stats table (see stats.py) is kept up to date with every game that is added or relabelled, so
+# top_patterns() and frequencies() never have to go through the games.
+#
+# Files written by an older STORE_VERSION are upgraded when they are opened, see upgrade().
+
+# Bump this when files stored by older versions need more than new tables or columns, upgrade() says what
+# happens to them.
+# 1: games are kept once for each player, files from before that have them keyed by the game ID alone
+# 2: mates given with black were stored as received
+STORE_VERSION = 2
+
+GAMES_COLUMNS = ['id', 'player', 'created_at', 'gave', 'fen', 'piece', 'region', 'patterns', 'double_check',
+                 'version', 'speed']
+
+GAMES_TABLE = '''
+CREATE TABLE IF NOT EXISTS %s (
+    id TEXT NOT NULL,
+    player TEXT NOT NULL,
+    created_at INTEGER NOT NULL,
+    gave INTEGER NOT NULL,
+    fen TEXT NOT NULL,
+    piece TEXT,
+    region TEXT,
+    patterns TEXT,
+    double_check INTEGER,
+    version INTEGER,
+    speed TEXT,
+    -- The same game is kept once for each player when both sides were downloaded
+    PRIMARY KEY (id, player)
+);
+'''
+
+SCHEMA = GAMES_TABLE % 'games' + '''
+CREATE INDEX IF NOT EXISTS games_player ON games (player, created_at);
+CREATE TABLE IF NOT EXISTS players (
+    name TEXT PRIMARY KEY,
+    last_seen INTEGER NOT NULL
+);
+'''
+
+
+def timestamp(value):
+    # Lichess sends milliseconds, berserk turns them into datetimes
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    return int(value)
+
+
+class GameStore:
+
+    def __init__(self, path='games.sqlite'):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA + STATS_SCHEMA)
+        # Files from before speed was kept get the column, their games count as 'unknown'
+        if 'speed' not in [row[1] for row in self.db.execute('PRAGMA table_info(games)')]:
+            self.db.execute('ALTER TABLE games ADD COLUMN speed TEXT')
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version < STORE_VERSION:
+            self.upgrade(version)
+        # Counts of the games added since the last commit, they go into pattern_stats with it
+        self.stats = PatternStats()
+        if self.db.execute('SELECT 1 FROM pattern_stats LIMIT 1').fetchone() is None and \
+                self.db.execute('SELECT 1 FROM games LIMIT 1').fetchone() is not None:
+            self.rebuild_stats()
+
+    def close(self):
+        self.db.close()
+
+    def commit(self):
+        save_stats(self.db, self.stats)
+        self.stats = PatternStats()
+        self.db.commit()
+
+    def upgrade(self, version):
+        if version < 1 and [row[1] for row in self.db.execute('PRAGMA table_info(games)') if row[5]] == ['id']:
+            # CREATE TABLE IF NOT EXISTS left the old key, and with it INSERT OR REPLACE of one player's copy of
+            # a game deletes the other player's. SQLite can't change a primary key, so the table gets made again
+            columns = ', '.join(GAMES_COLUMNS)
+            self.db.execute(GAMES_TABLE % 'games_rekeyed')
+            self.db.execute('INSERT INTO games_rekeyed (%s) SELECT %s FROM games' % (columns, columns))
+            self.db.execute('DROP TABLE games')
+            self.db.execute('ALTER TABLE games_rekeyed RENAME TO games')
+            self.db.execute('CREATE INDEX IF NOT EXISTS games_player ON games (player, created_at)')
+        if version < 2:
+            # A mate given with black was stored as received, and a game doesn't say which colour the player had,
+            # so none of the received ones can be trusted. They go, the stats get counted again without them,
+            # and forgetting the last runs makes the next update download every game again
+            self.db.execute('DELETE FROM games WHERE gave = 0')
+            self.db.execute('DELETE FROM players')
+            self.db.execute('DELETE FROM pattern_stats')
+        self.db.execute('PRAGMA user_version = %d' % STORE_VERSION)
+        self.db.commit()
+
+    def rebuild_stats(self):
+        # Counts every stored game again, for files that had games before pattern_stats existed
+        self.db.execute('DELETE FROM pattern_stats')
+        self.stats = PatternStats()
+        for row in self.db.execute('SELECT player, created_at, speed, gave, piece, region, patterns, double_check '
+                                   'FROM games'):
+            self.stats.add(row[0], row[1], row[2], row[3], self.result(row[4:]))
+        self.commit()
+
+    def last_seen(self, player):
+        # createdAt (in milliseconds) of the newest game downloaded for player, None if there are none yet
+        row = self.db.execute('SELECT last_seen FROM players WHERE name = ?', (player,)).fetchone()
+        return row[0] if row else None
+
+    def set_last_seen(self, player, created_at):
+        self.db.execute('INSERT INTO players (name, last_seen) VALUES (?, ?) '
+                        'ON CONFLICT (name) DO UPDATE SET last_seen = MAX(last_seen, excluded.last_seen)',
+                        (player, created_at))
+
+    def add(self, game_id, player, created_at, gave, fen, result, speed=None):
+        # A game that is already stored gets replaced, and taken out of the stats first
+        old = self.db.execute('SELECT created_at, speed, gave, piece, region, patterns, double_check FROM games '
+                              'WHERE id = ? AND player = ?', (game_id, player)).fetchone()
+        if old is not None:
+            self.stats.add(player, old[0], old[1], old[2], self.result(old[3:]), count=-1)
+        self.db.execute('INSERT OR REPLACE INTO games (id, player, created_at, gave, fen, piece, region, patterns, '
+                        'double_check, version, speed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (game_id, player, created_at, int(gave), fen) + self.columns(result) + (speed,))
+        self.stats.add(player, created_at, speed, gave, result)
+
+    def columns(self, result):
+        # A result of None means the classifier gave up on the position, it is stored without labels
+        if result is None:
+            return (None, None, None, None, CLASSIFIER_VERSION)
+        return (result.piece, result.region, ','.join(str(i) for i in result.patterns),
+                int(result.double_check), CLASSIFIER_VERSION)
+
+    def result(self, row):
+        piece, region, patterns, double_check = row
+        if patterns is None:
+            return None
+        return CheckmateResult(piece, region, [int(i) for i in patterns.split(',') if i], bool(double_check))
+
+    def games(self, player, gave=None):
+        # Yields (game_id, gave, fen, result) for player's stored checkmates, oldest first
+        query = 'SELECT id, gave, fen, piece, region, patterns, double_check FROM games WHERE player = ?'
+        args = [player]
+        if gave is not None:
+            query += ' AND gave = ?'
+            args.append(int(gave))
+        for row in self.db.execute(query + ' ORDER BY created_at', args):
+            yield row[0], bool(row[1]), row[2], self.result(row[3:])
+
+    def reclassify_stale(self, engine=CheckmatePattern, batch_size=1000):
+        # Works the labels out again for every game classified by an older version of the rules. The stale games
+        # are read batch_size at a time and written through a second cursor, so a big file is never in memory
+        # all at once
+        stale = self.db.execute('SELECT id, player, fen, created_at, speed, gave, piece, region, patterns, double_check '
+                                'FROM games WHERE version IS NOT ?', (CLASSIFIER_VERSION,))
+        writer = self.db.cursor()
+        updated = 0
+        rows = stale.fetchmany(batch_size)
+        while rows:
+            labels = []
+            for game_id, player, fen, created_at, speed, gave, *old in rows:
+                result = classify_position(fen, engine)
+                labels.append(self.columns(result) + (game_id, player))
+                # Only the labels change, the game moves from the old patterns' counts to the new ones
+                self.stats.add(player, created_at, speed, gave, self.result(old), count=-1)
+                self.stats.add(player, created_at, speed, gave, result)
+            writer.executemany('UPDATE games SET piece = ?, region = ?, patterns = ?, double_check = ?, version = ? '
+                               'WHERE id = ? AND player = ?', labels)
+            updated += len(rows)
+            rows = stale.fetchmany(batch_size)
+        self.commit()
+        return updated
+
+    def export_positions(self, path, player=None):
+        # Adds the stored mates (only player's if given) with their labels to a positions.PositionWriter file.
+        # Labels from an older CLASSIFIER_VERSION go in as they are, positions.py relabels them
+        from positions import PositionWriter
+        query = 'SELECT id, fen, piece, region, patterns, double_check, version FROM games'
+        args = []
+        if player is not None:
+            query += ' WHERE player = ?'
+            args.append(player)
+        with PositionWriter(path) as writer:
+            for game_id, fen, piece, region, patterns, double_check, version in self.db.execute(query, args):
+                writer.add(game_id, fen, self.result((piece, region, patterns, double_check)), version)
+            return writer.written
+
+    def frequencies(self, player=ALL, direction=ALL, month=ALL, speed=ALL):
+        # (Counter of pattern name -> games it was found in, games) from pattern_stats. direction is 'given',
+        # 'received' or True/False, month is 'YYYY-MM' and speed a Lichess speed like 'blitz'
+        if isinstance(direction, bool):
+            direction = DIRECTIONS[direction]
+        cell = stored_cell(self.db, player, month, speed, direction)
+        return cell_frequencies(cell), cell.get(GAMES, 0)
+
+    def top_patterns(self, player=ALL, direction=ALL, month=ALL, speed=ALL, n=5):
+        return self.frequencies(player, direction, month, speed)[0].most_common(n)
+
+    def store_mate(self, game, player, gave, pattern):
+        # Keeps one classified mate, returns (game_id, gave, fen, result) for it
+        fen = pattern.board.fen()
+        self.add(game['id'], player, timestamp(game['createdAt']), gave, fen, pattern.result, game.get('speed'))
+        return game['id'], gave, fen, pattern.result
+
+    def update(self, client, player, engine=CheckmatePattern, progress=None, **filters):
+        # Downloads player's games newer than the last run, classifies the mates and stores them.
+        # client only needs client.games.export_by_player(player, since=..., **filters) like berserk.Client, so
+        # a stand-in client works for running this offline. filters go to the export as they are (rated,
+        # perf_type, moves=False and so on). Yields (game_id, gave, fen, result) for every new mate
+        since = self.last_seen(player)
+        newest = [since or 0]
+
+        def seen(games):
+            for game in games:
+                newest[0] = max(newest[0], timestamp(game['createdAt']))
+                yield game
+
+        games = client.games.export_by_player(player, since=since + 1 if since is not None else None, **filters)
+        try:
+            for game, gave, pattern in classify_games(seen(games), player, engine, progress):
+                yield self.store_mate(game, player, gave, pattern)
+            # Lichess sends the newest games first, so the timestamp only moves on once the whole export has
+            # arrived. An interrupted run starts from the old timestamp again next time
+            if newest[0]:
+                self.set_last_seen(player, newest[0])
+        finally:
+            self.commit()
+
+    async def update_many(self, fetcher, players, engine=CheckmatePattern, **params):
+        # update() for lots of players at once with a fetch.GameFetcher that has been entered already. Every
+        # player carries on from their own last run and only the fields in MATE_EXPORT are downloaded unless
+        # params say otherwise. Yields (player, game_id, gave, fen, result) for every new mate
+        since = {}
+        for player in players:
+            last_seen = self.last_seen(player)
+            if last_seen is not None:
+                since[player] = last_seen + 1
+        try:
+            async for player, game in fetcher.export_many(players, since=since, **dict(MATE_EXPORT, **params)):
+                gave = mate_gave(game, player)
+                if gave is not None:
+                    yield (player,) + self.store_mate(game, player, gave, classify_mate(game, engine))
+            # Same as update(), a player whose export failed keeps the old timestamp
+            for player in players:
+                if player in fetcher.newest and player not in fetcher.errors:
+                    self.set_last_seen(player, fetcher.newest[player])
+        finally:
+            self.commit()
@@ -0,0 +1,540 @@
+from collections import namedtuple
+
+import chess
+import numpy as np
+
+from BitboardPattern import BitboardPattern
+from CheckmatePattern import CheckmatePattern, PATTERN_IDS, PATTERN_NAMES, classify_position
+from geometry import KING_SQUARES, BB_RAW_SURROUNDING
+from rules import RULES_BY_BRANCH, piece_types
+
+# Classifying a whole batch of positions at once with NumPy (pip install numpy, nothing else needs it).
+#
+# The positions are turned into arrays: one uint64 bitboard per piece type and colour, the losing king's
+# square and the checker's square. Every rule is then worked out for the whole batch with array
+# operations instead of a Python loop per position, and the answer is a boolean matrix with a row per
+# position and a column per pattern (PATTERN_NAMES). Whether a pattern was found more than once for a
+# position isn't kept.
+#
+# The rules copy CheckmatePattern, quirks included, the same way BitboardPattern does. Positions that
+# can't be done as arrays (a king missing, or a rule in rules.py that has no array version here) go
+# through the scalar engine, and BatchResult.scalar says which ones did.
+#
+#     result = classify_batch(fens)
+#     result.patterns.sum(axis=0)          # how many positions each pattern was found in
+
+REGIONS = ['corner', 'side', 'center']
+
+# patterns - (positions, len(PATTERN_NAMES)) booleans
+# piece - piece type of the checker (chess.QUEEN and so on), 0 if nobody gives check
+# region - index into REGIONS, -1 if nobody gives check
+# double_check - more than one checker
+# error - the position raised IndexError, like classify() does for some of them
+# scalar - the position went through the scalar engine
+BatchResult = namedtuple('BatchResult', ['patterns', 'piece', 'region', 'double_check', 'error', 'scalar'])
+
+U64 = np.uint64
+
+# Tables for every square
+_SQUARES = np.arange(64)
+FILES = _SQUARES % 8
+RANKS = _SQUARES // 8
+BITS = np.array(chess.BB_SQUARES, dtype=U64)
+# The squares around a king in the order the patterns index them, padded to 8 columns with a1
+NEIGHBOURS = np.array([list(king.squares) + [0] * (8 - len(king.squares)) for king in KING_SQUARES])
+NEIGHBOUR_MASKS = np.array([king.mask for king in KING_SQUARES], dtype=U64)
+REGION_CODES = np.array([REGIONS.index(king.region) for king in KING_SQUARES], dtype=np.int8)
+DISTANCES = np.array([[chess.square_distance(a, b) for b in chess.SQUARES] for a in chess.SQUARES], dtype=np.int8)
+# DISTANCE_MASKS[square, d] - the squares exactly d king steps away
+DISTANCE_MASKS = np.array([[sum(chess.BB_SQUARES[b] for b in chess.SQUARES if chess.square_distance(a, b) == d)
+                            for d in range(8)] for a in chess.SQUARES], dtype=U64)
+KNIGHT_ATTACKS = np.array(chess.BB_KNIGHT_ATTACKS, dtype=U64)
+KING_ATTACKS = np.array(chess.BB_KING_ATTACKS, dtype=U64)
+# PAWN_ATTACKS[color, square]
+PAWN_ATTACKS = np.array(chess.BB_PAWN_ATTACKS, dtype=U64)
+RAW_SURROUNDING = np.array(BB_RAW_SURROUNDING, dtype=U64)
+
+
+def _table_bitwise_count(bitboards):
+    # np.bitwise_count for NumPy before 2.0, which doesn't have it: the bits of each of the 8 bytes from a table
+    bitboards = np.ascontiguousarray(bitboards, dtype=U64)
+    counts = BYTE_COUNTS[bitboards.reshape(-1).view(np.uint8)].reshape(bitboards.shape + (8,))
+    return counts.sum(axis=-1, dtype=np.uint8)
+
+
+BYTE_COUNTS = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+bitwise_count = getattr(np, 'bitwise_count', _table_bitwise_count)
+
+ORTHOGONAL = [(0, 1), (0, -1), (1, 0), (-1, 0)]
+DIAGONAL = [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+
+
+def rays(squares, occupied, directions):
+    # What a rook (ORTHOGONAL) or a bishop (DIAGONAL) on squares attacks, one square and one occupancy
+    # per position. Slider attacks go both ways, so this is also where such a piece has to stand to
+    # attack the square
+    attacks = np.zeros(len(squares), dtype=U64)
+    for file_step, rank_step in directions:
+        file = FILES[squares]
+        rank = RANKS[squares]
+        open_ray = np.ones(len(squares), dtype=bool)
+        for _ in range(7):
+            file = file + file_step
+            rank = rank + rank_step
+            open_ray &= (file >= 0) & (file < 8) & (rank >= 0) & (rank < 8)
+            bit = np.where(open_ray, BITS[np.where(open_ray, rank * 8 + file, 0)], U64(0))
+            attacks |= bit
+            open_ray &= (occupied & bit) == 0
+    return attacks
+
+
+def has(bitboards, squares):
+    # Whether each bitboard has its square set
+    return ((bitboards >> squares.astype(U64)) & U64(1)) != 0
+
+
+def msb(bitboards):
+    # Highest set square of each bitboard, like chess.msb. Meaningless for empty ones
+    smeared = bitboards.copy()
+    for shift in (1, 2, 4, 8, 16, 32):
+        smeared |= smeared >> U64(shift)
+    top = smeared ^ (smeared >> U64(1))
+    return np.log2(np.where(top == 0, U64(1), top).astype(np.float64)).astype(np.int64)
+
+
+class PositionBatch:
+    # A batch of positions as arrays. With mated=True every position is taken to be checkmate, which
+    # saves generating the legal moves of each one to find the winner like CheckmatePattern.winner() does
+
+    def __init__(self, positions, mated=False):
+        self.boards = [position if isinstance(position, chess.Board) else chess.Board(position)
+                       for position in positions]
+        boards = self.boards
+        bitboards = np.array([(board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings,
+                               board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK], board.checkers_mask())
+                              for board in boards], dtype=U64).reshape(-1, 9)
+        (self.pawns, self.knights, self.bishops, self.rooks, self.queens, self.kings,
+         self.white, self.black, self.checkers) = bitboards.T
+        # CheckmatePattern.winner() is only True for "1-0", black to move and mated
+        self.winner = np.array([board.turn == chess.BLACK and (mated or board.is_checkmate()) for board in boards],
+                               dtype=bool)
+
+    def __len__(self):
+        return len(self.boards)
+
+
+class _Features:
+    # Everything the rules ask about a batch, with the rays they need worked out once
+
+    def __init__(self, batch):
+        self.batch = batch
+        b = batch
+        self.occupied = b.white | b.black
+        self.winner_pieces = np.where(b.winner, b.white, b.black)
+        self.loser_pieces = np.where(b.winner, b.black, b.white)
+        self.white_bishops = b.bishops & b.white
+
+        loser_kings = b.kings & self.loser_pieces
+        winner_kings = b.kings & self.winner_pieces
+        self.kings_ok = (loser_kings != 0) & (winner_kings != 0)
+        self.king = np.where(self.kings_ok, msb(loser_kings), 0)
+        self.winner_king = np.where(self.kings_ok, msb(winner_kings), 0)
+        self.black_king = np.where(self.kings_ok, msb(b.kings & b.black), 0)
+
+        checkers = bitwise_count(b.checkers)
+        self.single = checkers == 1
+        self.double = checkers > 1
+        self.square = np.where(self.single, msb(b.checkers), 0)
+        self.piece = np.zeros(len(batch), dtype=np.int8)
+        for piece_type, pieces in enumerate((b.pawns, b.knights, b.bishops, b.rooks, b.queens, b.kings), 1):
+            self.piece[has(pieces, self.square) & self.single] = piece_type
+
+        self.region = REGION_CODES[self.king]
+        self.neighbours = NEIGHBOURS[self.king]
+        self.blocked = has(self.loser_pieces[:, None], self.neighbours)
+        self.blocked_count = bitwise_count(NEIGHBOUR_MASKS[self.king] & self.loser_pieces)
+        self.rays = {}
+
+    def S(self, i):
+        return self.neighbours[:, i]
+
+    def B(self, i):
+        return self.blocked[:, i]
+
+    def ray(self, key, squares, directions):
+        attacks = self.rays.get(key)
+        if attacks is None:
+            attacks = self.rays[key] = rays(squares, self.occupied, directions)
+        return attacks
+
+    def orthogonal(self, i):
+        # i is a neighbour slot, or 'square' for the checker
+        squares = self.square if i == 'square' else self.S(i)
+        return self.ray(('orthogonal', i), squares, ORTHOGONAL)
+
+    def diagonal(self, i):
+        squares = self.square if i == 'square' else self.S(i)
+        return self.ray(('diagonal', i), squares, DIAGONAL)
+
+    def checker_attacks(self):
+        # Squares the checker attacks, for rooks and queens (the only checkers the rules ask this about)
+        attacks = self.orthogonal('square')
+        return np.where(self.piece == chess.QUEEN, attacks | self.diagonal('square'), attacks)
+
+    def attackers(self, i):
+        # Board.attackers_mask(winner, square) for a neighbour slot or the checker
+        b = self.batch
+        squares = self.square if i == 'square' else self.S(i)
+        pawn_attacks = PAWN_ATTACKS[np.where(b.winner, chess.BLACK, chess.WHITE).astype(np.int64), squares]
+        return ((KING_ATTACKS[squares] & b.kings) | (KNIGHT_ATTACKS[squares] & b.knights) |
+                (self.orthogonal(i) & (b.rooks | b.queens)) | (self.diagonal(i) & (b.bishops | b.queens)) |
+                (pawn_attacks & b.pawns)) & self.winner_pieces
+
+
+### The rules as array operations. Each one returns (pattern name, mask of the positions it matches) pairs,
+### a None name meaning those positions raise IndexError
+
+def smothered(f):
+    return [('Smothered mate', (NEIGHBOUR_MASKS[f.king] & ~f.loser_pieces) == 0)]
+
+
+def suffocation_corner(f):
+    # The flag flips on every free square, so it ends up set for an odd number of them
+    free = bitwise_count(NEIGHBOUR_MASKS[f.king] & ~f.loser_pieces)
+    return [('Suffocation mate', free % 2 == 1)]
+
+
+def suffocation_and_pillsburys(f):
+    # Only the rook half, the knight half is the call one argument short
+    free = ~f.blocked[:, :5]
+    pillsburys = np.zeros(len(f.batch), dtype=bool)
+    for i in range(5):
+        pillsburys |= free[:, i] & ((f.diagonal(i) & f.white_bishops & f.winner_pieces) != 0)
+    return [("Pillsbury's mate", (free.sum(axis=1) <= 2) & pillsburys)]
+
+
+def back_rank(f):
+    # (available_squares[0] and available_squares[4] in attacks), so never with available_squares[0] on a1
+    return [('Back-rank mate', f.B(1) & f.B(2) & f.B(3) & (f.S(0) != 0) & has(f.checker_attacks(), f.S(4)))]
+
+
+def back_rank_corner(f):
+    return [('Back-rank mate', f.B(1) & f.B(2) & has(f.checker_attacks(), f.S(0)))]
+
+
+def scholars(f):
+    white_queen = (f.square == chess.F7) & has(f.white_bishops, np.full(len(f.batch), chess.C4))
+    black_queen = (f.square == chess.F2) & has(f.white_bishops, np.full(len(f.batch), chess.C5))
+    return [("Scholar's mate", np.where(f.batch.winner, white_queen, black_queen))]
+
+
+def anastasias(f):
+    # A knight attacking available_squares[1] or [3] that also attacks (available_squares[1] and [3])
+    knights = KNIGHT_ATTACKS[f.S(3)] & f.batch.knights & f.winner_pieces
+    return [("Anastasia's mate", (f.S(1) != 0) & (knights != 0))]
+
+
+def anastasias_corner(f):
+    knights = KNIGHT_ATTACKS[f.S(0)] & f.batch.knights & f.winner_pieces
+    return [("Anastasia's mate", f.B(1) & (knights != 0))]
+
+
+def arabian(f):
+    knights = KNIGHT_ATTACKS[f.square] & f.batch.knights & f.winner_pieces & DISTANCE_MASKS[f.king, 2]
+    return [('Arabian mate', knights != 0)]
+
+
+def epaulette(f):
+    return [('Epaulette mate', f.B(0) & f.B(4) & (DISTANCES[f.king, f.square] == 2))]
+
+
+def blind_swine(f):
+    # Only the side version, in the center it's called one argument short. Rooks of either colour count,
+    # and (rook and same file) or same rank is how the conditions group
+    rooks = f.batch.rooks
+    odd = f.blocked_count % 2 == 1
+    first = f.B(4) & odd
+    second = ~first & f.B(0) & odd
+    first &= (has(rooks, f.S(1)) & (FILES[f.square] == FILES[f.S(1)])) | (RANKS[f.square] == RANKS[f.S(1)])
+    second &= (has(rooks, f.S(3)) & (FILES[f.square] == FILES[f.S(3)])) | (RANKS[f.square] == RANKS[f.S(3)])
+    return [('Blind swine mate', first | second)]
+
+
+def swallows_tail(f):
+    # Only the last of the four gets the distance check
+    square, S, B = f.square, f.S, f.B
+    return [("Swallow's tail mate", (B(0) & B(2) & (square == S(6))) | (B(2) & B(7) & (square == S(3))) |
+             (B(7) & B(5) & (square == S(1))) |
+             (B(5) & B(0) & (square == S(4)) & (DISTANCES[f.king, square] == 1)))]
+
+
+def corner_and_morphys(f):
+    heavy = (f.batch.rooks | f.batch.queens) & f.winner_pieces
+    queens = f.batch.queens & f.winner_pieces
+    found = np.zeros(len(f.batch), dtype=bool)
+    for i in (1, 2):
+        found |= ((f.orthogonal(i) & heavy) | (f.diagonal(i) & queens)) != 0
+    found &= f.B(2)
+    return [("Morphy's mate", found & (f.piece == chess.BISHOP)), ('Corner mate', found & (f.piece == chess.KNIGHT))]
+
+
+def opera(f):
+    bishops = f.white_bishops & f.winner_pieces
+    return [('Opera mate', ((f.square == f.S(0)) & f.B(3) & ((f.diagonal(0) & bishops) != 0)) |
+             ((f.square == f.S(4)) & f.B(1) & ((f.diagonal(4) & bishops) != 0)))]
+
+
+def mayets_corner(f):
+    bishops = f.white_bishops & f.winner_pieces
+    return [("Mayet's mate", (f.square == f.S(0)) & (f.B(2) | f.B(1)) & ((f.diagonal(0) & bishops) != 0))]
+
+
+def damianos_and_max_langes(f):
+    # (available_squares[1] or ...) is always true, available_squares[1] is never a1 for a king on the side
+    defenders = f.attackers('square') & f.batch.white
+    on_slot = (f.square == f.S(1)) | (f.square == f.S(3))
+    return [("Damiano's mate", on_slot & ((defenders & f.batch.pawns) != 0)),
+            ("Max Lange's mate", on_slot & ((defenders & f.batch.bishops) != 0))]
+
+
+def _damianos_bishop_defenders(f):
+    # Defenders of the checker two steps from the black king (board.king(not self.winner) is always black)
+    return f.attackers('square') & DISTANCE_MASKS[f.black_king, 2]
+
+
+def damianos_bishop_and_lollis(f):
+    defenders = _damianos_bishop_defenders(f)
+    on_slot = f.square == f.S(2)
+    return [("Damiano's bishop mate", on_slot & ((defenders & f.batch.bishops) != 0)),
+            ("Lolli's mate", on_slot & ((defenders & f.batch.pawns) != 0))]
+
+
+def damianos_bishop_corner_and_lollis_corner(f):
+    defenders = _damianos_bishop_defenders(f)
+    on_slot = (f.square == f.S(0)) | (f.square == f.S(2))
+    ranks = RANKS[f.square]
+    king_ranks = RANKS[f.king]
+    lollis_ranks = ((ranks == 6) & (king_ranks == 7)) | ((ranks == 1) & (king_ranks == 0))
+    return [("Damiano's bishop mate", on_slot & ((defenders & f.batch.bishops) != 0)),
+            ("Lolli's mate", on_slot & lollis_ranks & ((defenders & f.batch.pawns) != 0))]
+
+
+def box(f):
+    # (available_squares[1] and [2] and [3]) is the first one on a1, or else [3]
+    S = f.S
+    square = np.where(S(1) == 0, S(1), np.where(S(2) == 0, S(2), S(3)))
+    return [('Box mate', has(KING_ATTACKS[f.winner_king], square))]
+
+
+def queen_and_king(f):
+    near = has(RAW_SURROUNDING[f.winner_king], f.square)
+    return [('Queen and king mate', near & ((f.square == f.S(1)) | (f.square == f.S(2))))]
+
+
+def queen_and_king_corner(f):
+    return [('Queen and king mate', has(RAW_SURROUNDING[f.winner_king], f.square))]
+
+
+def dovetail(f):
+    square, S, B = f.square, f.S, f.B
+    return [('Dovetail mate', (B(1) & B(3) & (square == S(7))) | (B(1) & B(4) & (square == S(5))) |
+             (B(4) & B(6) & (square == S(0))) | (B(6) & B(3) & (square == S(2))))]
+
+
+def dovetail_bishop(f):
+    # A bishop guarding one square next to the king that also covers another. Slider attacks go both ways,
+    # so it's a bishop on the diagonals of both
+    bishops = f.white_bishops & f.winner_pieces
+    found = np.zeros(len(f.batch), dtype=bool)
+    for slot, guarded, covered in ((7, 1, 3), (5, 1, 4), (0, 4, 6), (2, 6, 3)):
+        found |= (f.square == f.S(slot)) & ((f.diagonal(guarded) & f.diagonal(covered) & bishops) != 0)
+    return [('Dovetail bishop mate', found)]
+
+
+def kill_box(f):
+    # The queen two squares from the checker that also covers the square next to it. (available_squares[3]
+    # and ...) and (available_squares[0] and ...) fail when that square is a1
+    queens = f.attackers('square') & f.batch.queens & DISTANCE_MASKS[f.square, 2]
+    S = f.S
+
+    def covers(i):
+        return (queens & (f.orthogonal(i) | f.diagonal(i))) != 0
+
+    return [('Kill box mate', ((f.square == S(0)) & (S(3) != 0) & covers(4)) |
+             ((f.square == S(4)) & (S(0) != 0) & covers(1)))]
+
+
+def triangle_center(f):
+    rooks = f.attackers('square') & f.batch.rooks & DISTANCE_MASKS[f.square, 2] & NEIGHBOUR_MASKS[f.king]
+    return [('Triangle mate', (rooks != 0) & (f.B(1) | f.B(3) | f.B(4) | f.B(6)))]
+
+
+def balestra(f):
+    attackers = f.attackers(2) & DISTANCE_MASKS[f.black_king, 2] & DISTANCE_MASKS[f.square, 3]
+    return [('Balestra mate', (DISTANCES[f.square, f.black_king] == 2) & (attackers != 0))]
+
+
+def hook(f):
+    knights = KNIGHT_ATTACKS[f.square] & f.batch.knights & f.winner_pieces
+    square, S = f.square, f.S
+
+    def knight_on(*slots):
+        found = np.zeros(len(f.batch), dtype=bool)
+        for slot in slots:
+            found |= has(knights, S(slot))
+        return found
+
+    return [('Hook mate', ((square == S(1)) & knight_on(5, 7)) | ((square == S(3)) & knight_on(2, 7)) |
+             ((square == S(6)) & knight_on(0, 2)) | ((square == S(4)) & knight_on(0, 5)))]
+
+
+def hook_side(f):
+    knights = KNIGHT_ATTACKS[f.square] & f.batch.knights & f.winner_pieces
+    return [('Hook mate', ((f.square == f.S(0)) & has(knights, f.S(3))) |
+             ((f.square == f.S(4)) & has(knights, f.S(1))))]
+
+
+def anderssens(f):
+    pawn = has(f.batch.pawns & f.winner_pieces, f.S(2)) & ((RANKS[f.square] == 0) | (RANKS[f.square] == 7))
+    return [("Anderssen's mate", pawn & ((f.square == f.S(0)) | (f.square == f.S(4))))]
+
+
+def anderssens_corner(f):
+    # A corner king only has three squares around it, so looking at available_squares[4] raises IndexError
+    pawn = has(f.batch.pawns & f.winner_pieces, f.S(2)) & ((RANKS[f.square] == 0) | (RANKS[f.square] == 7))
+    return [("Anderssen's mate", pawn & (f.square == f.S(0))), (None, pawn & (f.square != f.S(0)))]
+
+
+def ladder(f):
+    # The last queen or rook (highest square) attacking available_squares[1], [2] or [3] has to stand
+    # next to the edge the checker is on, and the checker has to cover (available_squares[0] and [4])
+    heavy = (f.batch.rooks | f.batch.queens) & f.winner_pieces
+    queens = f.batch.queens & f.winner_pieces
+    attacker = np.full(len(f.batch), -1)
+    for i in (1, 2, 3):
+        found = ((f.orthogonal(i) & heavy) | (f.diagonal(i) & queens))
+        attacker = np.where((found != 0) & (f.square != f.S(i)), msb(found), attacker)
+    attacker_file = np.where(attacker >= 0, FILES[attacker], 0)
+    attacker_rank = np.where(attacker >= 0, RANKS[attacker], 0)
+
+    covered = has(f.checker_attacks(), np.where(f.S(0) == 0, f.S(0), f.S(4)))
+    file = FILES[f.square]
+    rank = RANKS[f.square]
+    edge = (((file == 0) & (attacker_file == 1)) | ((file == 7) & (attacker_file == 6)) |
+            ((rank == 0) & (attacker_rank == 1)) | ((rank == 7) & (attacker_rank == 6)))
+    return [('Ladder mate', covered & edge)]
+
+
+# The array version of each rule, by region and method. Rules without one here go through the scalar engine
+VECTOR_RULES = {
+    ('corner', 'back_rank_corner'): back_rank_corner,
+    ('corner', 'damianos_bishop_corner_and_lollis_corner'): damianos_bishop_corner_and_lollis_corner,
+    ('corner', 'queen_and_king_corner'): queen_and_king_corner,
+    ('corner', 'anderssens'): anderssens_corner,
+    ('corner', 'anastasias_corner'): anastasias_corner,
+    ('corner', 'arabian'): arabian,
+    ('corner', 'mayets_corner'): mayets_corner,
+    ('corner', 'smothered'): smothered,
+    ('corner', 'suffocation_corner'): suffocation_corner,
+    ('corner', 'corner_and_morphys'): corner_and_morphys,
+    ('center', 'swallows_tail'): swallows_tail,
+    ('center', 'dovetail'): dovetail,
+    ('center', 'dovetail_bishop'): dovetail_bishop,
+    ('center', 'triangle_center'): triangle_center,
+    ('center', 'hook'): hook,
+    ('side', 'scholars'): scholars,
+    ('side', 'back_rank'): back_rank,
+    ('side', 'epaulette'): epaulette,
+    ('side', 'damianos_bishop_and_lollis'): damianos_bishop_and_lollis,
+    ('side', 'damianos_and_max_langes'): damianos_and_max_langes,
+    ('side', 'queen_and_king'): queen_and_king,
+    ('side', 'box'): box,
+    ('side', 'ladder'): ladder,
+    ('side', 'suffocation_and_pillsburys'): suffocation_and_pillsburys,
+    ('side', 'blind_swine'): blind_swine,
+    ('side', 'anastasias'): anastasias,
+    ('side', 'opera'): opera,
+    ('side', 'kill_box'): kill_box,
+    ('side', 'anderssens'): anderssens,
+    ('side', 'hook_side'): hook_side,
+    ('side', 'balestra'): balestra,
+    ('side', 'smothered'): smothered,
+}
+
+
+def _stops(rule):
+    # The calls one argument short (see rules.py) raise TypeError, nothing after them in the branch runs
+    return len(rule.args) != getattr(CheckmatePattern, rule.method).__code__.co_argcount - 1
+
+
+def _types(batch, pieces):
+    b = batch
+    types = np.zeros(len(b), dtype=np.int64)
+    for piece_type, bitboards in ((chess.PAWN, b.pawns), (chess.KNIGHT, b.knights), (chess.BISHOP, b.bishops),
+                                  (chess.ROOK, b.rooks), (chess.QUEEN, b.queens)):
+        types |= np.where((bitboards & pieces) != 0, 1 << piece_type, 0)
+    return types
+
+
+def classify_batch(positions, engine=BitboardPattern, mated=False):
+    # positions is a PositionBatch or anything PositionBatch takes. engine classifies the positions that
+    # can't be done as arrays
+    batch = positions if isinstance(positions, PositionBatch) else PositionBatch(positions, mated)
+    f = _Features(batch)
+    n = len(batch)
+
+    patterns = np.zeros((n, len(PATTERN_NAMES)), dtype=bool)
+    error = np.zeros(n, dtype=bool)
+    scalar = f.single & ~f.kings_ok
+    winner_types = white_types = None
+
+    for (region, letter), rules in RULES_BY_BRANCH.items():
+        rows = f.single & f.kings_ok & (f.region == REGIONS.index(region)) & (f.piece == chess.PIECE_SYMBOLS.index(letter.lower()))
+        if not rows.any():
+            continue
+        for rule in rules:
+            if _stops(rule):
+                break
+            vector_rule = VECTOR_RULES.get((region, rule.method))
+            if vector_rule is not None:
+                for name, matches in vector_rule(f):
+                    if name is None:
+                        error |= rows & matches
+                        rows = rows & ~matches
+                    else:
+                        patterns[:, PATTERN_IDS[name]] |= rows & matches
+                continue
+
+            # No array version, the positions its prefilters let through go to the scalar engine
+            needed = rows & (f.blocked_count >= rule.min_blocked)
+            if rule.winner_pieces:
+                if winner_types is None:
+                    winner_types = _types(batch, f.winner_pieces)
+                needed &= (winner_types & piece_types(rule.winner_pieces)) != 0
+            if rule.white_pieces:
+                if white_types is None:
+                    white_types = _types(batch, batch.white)
+                needed &= (white_types & piece_types(rule.white_pieces)) != 0
+            scalar |= needed
+
+    patterns[error] = False
+    piece = np.where(f.single, f.piece, 0).astype(np.int8)
+    region = np.where(f.single, f.region, -1).astype(np.int8)
+    double_check = f.double.copy()
+
+    for i in np.flatnonzero(scalar):
+        patterns[i] = False
+        result = classify_position(batch.boards[i], engine)
+        if result is None:
+            error[i] = True
+            piece[i], region[i] = 0, -1
+            continue
+        error[i] = False
+        patterns[i, result.patterns] = True
+        piece[i] = chess.PIECE_SYMBOLS.index(result.piece.lower()) if result.piece else 0
+        region[i] = REGIONS.index(result.region) if result.region else -1
+        double_check[i] = result.double_check
+
+    piece[error] = 0
+    region[error] = -1
+    return BatchResult(patterns, piece, region, double_check, error, scalar)
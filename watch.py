@@ -0,0 +1,118 @@
+import json
+import time
+from collections import namedtuple
+
+import chess
+from BitboardPattern import BitboardPattern
+from CheckmatePattern import classify_position
+
+# Classifying a game while it is being played, for broadcast overlays and the like. A GameWatcher keeps one
+# board and pushes each move onto it as it arrives, so nothing gets replayed or parsed again. When a move
+# mates, the labels come out straight away:
+#
+#     watcher = GameWatcher(threats=True)
+#     for move in moves:                   # UCI like Lichess streams send ('e2e4'), SAN or chess.Move
+#         mate = watcher.push(move)
+#         if mate:
+#             print(mate.result.names())
+#         else:
+#             print([threat.move for threat in watcher.mate_threats])
+#
+# With threats=True the watcher also works out, after every move, which moves of the side to move would mate
+# and what each of those mates would be labelled. follow() reads the NDJSON of a Lichess game stream
+# (/api/stream/game/<id>), benchmarks/lichess_server.py can stand in for it.
+
+# A move that mated: ply is the number of half moves played in the game with it, move is in UCI and seconds is how
+# long it took from the move being handed over to the labels. result is None if the classifier gave up
+Mate = namedtuple('Mate', ['ply', 'move', 'result', 'seconds'])
+# A move the side to move has that would mate, and what the mate would be labelled
+Threat = namedtuple('Threat', ['move', 'result'])
+
+
+def stream_fen(message):
+    # Game streams send the FEN without the side to move sometimes, turns says how many plies have been played
+    fen = message['fen']
+    if ' ' not in fen:
+        fen += ' w' if message.get('turns', 0) % 2 == 0 else ' b'
+    return fen
+
+
+class GameWatcher:
+
+    def __init__(self, fen=chess.STARTING_FEN, engine=BitboardPattern, threats=False):
+        self.engine = engine
+        self.threats = threats
+        self.reset(fen)
+
+    def reset(self, fen=chess.STARTING_FEN, plies=None):
+        # plies is how many half moves the game had when it got to fen, worked out from the FEN's move number
+        # if it isn't given (a stream's FEN can be without one)
+        self.board = chess.Board(fen)
+        # Half moves played in the game so far, feed() skips that many
+        self.moves = self.board.ply() if plies is None else plies
+        self.mate = None
+        self.mate_threats = self.find_threats() if self.threats else []
+
+    def parse(self, move):
+        if isinstance(move, chess.Move):
+            return move
+        try:
+            return self.board.parse_uci(move)
+        except ValueError:
+            return self.board.parse_san(move)
+
+    def push(self, move):
+        # Plays move (a chess.Move, UCI or SAN) on the board. Returns a Mate if it mated, None otherwise.
+        # Raises ValueError for a move that isn't legal, the board is left as it was
+        start = time.perf_counter()
+        move = self.parse(move)
+        if not self.board.is_legal(move):
+            raise ValueError('illegal move %s in %s' % (move.uci(), self.board.fen()))
+        self.board.push(move)
+        self.moves += 1
+        if self.board.is_checkmate():
+            self.mate = Mate(self.moves, move.uci(), classify_position(self.board, self.engine),
+                             time.perf_counter() - start)
+            self.mate_threats = []
+            return self.mate
+        if self.threats:
+            self.mate_threats = self.find_threats()
+        return None
+
+    def find_threats(self):
+        # Every move that mates from here and its labels. Only the moves that give check get played out
+        threats = []
+        board = self.board
+        for move in board.generate_legal_moves():
+            if board.gives_check(move):
+                board.push(move)
+                if board.is_checkmate():
+                    threats.append(Threat(move.uci(), classify_position(board, self.engine)))
+                board.pop()
+        return threats
+
+    def feed(self, moves):
+        # For streams that send all the moves so far every time (the board API's gameState does): only the moves
+        # after the ones already pushed get played. Returns the Mate if one of them mated
+        mate = None
+        for move in moves.split()[self.moves:]:
+            mate = self.push(move) or mate
+        return mate
+
+    def follow(self, messages):
+        # Reads a Lichess game stream (NDJSON lines or the dicts in them) and yields what push() returned for
+        # every move. The first message sets up the position the game is at, every one with 'lm' after that
+        # is a move
+        started = False
+        for message in messages:
+            if isinstance(message, (str, bytes)):
+                if not message.strip():
+                    continue
+                message = json.loads(message)
+            if not started:
+                started = True
+                if 'fen' in message:
+                    self.reset(stream_fen(message), message.get('turns'))
+                continue
+            if 'lm' in message:
+                yield self.push(message['lm'])